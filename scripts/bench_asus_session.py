@@ -0,0 +1,57 @@
+# Benchmarks polling a local fake router with one-off requests vs AsusApi's pooled keep-alive session.
+# Run from the repo root: python -m scripts.bench_asus_session
+import argparse
+import os
+import statistics
+import time
+
+import requests
+
+os.environ.setdefault('ASUS_API_USERNAME', 'admin')
+os.environ.setdefault('ASUS_API_PASSWORD', 'admin')
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from wifimanager.asus_router import AsusApi, build_session
+from scripts.fake_router import FakeRouter
+
+
+class OneOffSession:
+    """Mimics the old behaviour of calling requests.get/post for every poll"""
+
+    def get(self, *args, **kwargs):
+        return requests.get(*args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        return requests.post(*args, **kwargs)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(label, router, api, polls):
+    router.reset_connection_count()
+    latencies = []
+    for _ in range(polls):
+        start = time.perf_counter()
+        api.get_client_connection_statuses()
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f'{label:<10} polls={polls} connections_opened={router.connections_opened:<4} '
+          f'p50={statistics.median(latencies):.2f}ms p99={percentile(latencies, 99):.2f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('AsusApi session benchmark.')
+    parser.add_argument('--polls', type=int, default=100)
+    parser.add_argument('--clients', type=int, default=10)
+    args = parser.parse_args()
+
+    with FakeRouter(num_clients=args.clients) as router:
+        for label, session in (('one-off', OneOffSession()), ('pooled', build_session())):
+            api = AsusApi(session=session, host=router.url)
+            run(label, router, api, args.polls)
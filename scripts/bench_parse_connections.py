@@ -0,0 +1,35 @@
+# Compares the streaming and BeautifulSoup parsers of the wireless status page on synthetic pages.
+# Run from the repo root: python -m scripts.bench_parse_connections
+import argparse
+import os
+import timeit
+
+os.environ.setdefault('ASUS_API_USERNAME', 'admin')
+os.environ.setdefault('ASUS_API_PASSWORD', 'admin')
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from wifimanager.asus_router import AsusApi
+from scripts.fake_router import build_wireless_status_page
+
+
+def time_parser(parser, page, number):
+    return min(timeit.repeat(lambda: parser(page), number=number, repeat=5)) / number * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Wireless status page parser benchmark.')
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 50, 100, 250, 500])
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'{"clients":>8} {"fast us":>10} {"soup us":>10} {"speedup":>8}')
+    for num_clients in args.clients:
+        page = build_wireless_status_page(num_clients)
+        assert AsusApi.parse_client_connection_html_fast(page) == AsusApi.parse_client_connection_html_soup(page)
+        fast = time_parser(AsusApi.parse_client_connection_html_fast, page, args.number)
+        soup = time_parser(AsusApi.parse_client_connection_html_soup, page, args.number)
+        print(f'{num_clients:>8} {fast:>10.1f} {soup:>10.1f} {soup / fast:>7.1f}x')
@@ -0,0 +1,172 @@
+# End to end benchmark of the collector and dashboard against a local fake router.
+# For each client count it measures collector cycle time, db queries per cycle, dashboard endpoint latency and
+# peak python memory, and writes the results as json so runs can be compared across commits.
+# Runs against a throwaway test db of the configured db which is destroyed afterwards.
+# Run from the repo root: python -m scripts.bench_pipeline --output bench.json
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wifi_manager.settings')
+os.environ.setdefault('ASUS_API_USERNAME', 'admin')
+os.environ.setdefault('ASUS_API_PASSWORD', 'admin')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext, get_runner, setup_test_environment
+
+from wifimanager import collector
+from wifimanager.asus_router import AsusApi, TokenManager
+from wifimanager.collector import RouterPollError
+from wifimanager.models import Client, ConnectionSample
+from wifimanager.router_cache import RouterSnapshotCache
+from scripts.fake_router import FakeRouter
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize_ms(durations):
+    return {
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'max_ms': round(max(durations) * 1000, 3),
+    }
+
+
+def measure_peak_memory_kb(func):
+    """Runs func once with tracemalloc on. Timings are taken without it since tracing slows everything down"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def bench_collector(apis, cycles):
+    """Runs sample collection and the client update like the collector does, one cycle at a time"""
+    failures = 0
+
+    def cycle():
+        nonlocal failures
+        for collect in (collector.collect_connection_samples, collector.update_connected_clients):
+            try:
+                collect(apis)
+            except RouterPollError:
+                failures += 1
+
+    durations, queries = [], []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            cycle()
+        durations.append(time.perf_counter() - start)
+        queries.append(len(captured))
+    return {
+        'cycles': cycles,
+        'failed_polls': failures,
+        'queries_per_cycle': max(queries),
+        'peak_memory_kb': measure_peak_memory_kb(cycle),
+        **summarize_ms(durations),
+    }
+
+
+def bench_endpoints(requests_per_endpoint):
+    test_client = TestClient()
+    endpoints = {
+        'index': (reverse('wifimanager:index'), {}),
+        'connection_samples': (reverse('wifimanager:get-connection-samples'), {'dt': .5}),
+        'connection_samples_columnar': (reverse('wifimanager:get-connection-samples'),
+                                        {'dt': .5, 'format': 'columnar'}),
+    }
+    results = {}
+    for name, (url, params) in endpoints.items():
+        durations = []
+        with CaptureQueriesContext(connection) as captured:
+            for _ in range(requests_per_endpoint):
+                start = time.perf_counter()
+                response = test_client.get(url, params)
+                durations.append(time.perf_counter() - start)
+                assert response.status_code == 200, f'{name} returned {response.status_code}'
+        results[name] = {
+            'requests': requests_per_endpoint,
+            'queries_per_request': len(captured) // requests_per_endpoint,
+            'response_kb': round(len(response.content) / 1024, 1),
+            'peak_memory_kb': measure_peak_memory_kb(lambda: test_client.get(url, params)),
+            **summarize_ms(durations),
+        }
+    return results
+
+
+def run(num_clients, args, token_file):
+    with FakeRouter(num_clients, latency=args.latency, failure_rate=args.failure_rate, seed=0) as router:
+        api = AsusApi(host=router.url, token_manager=TokenManager(token_file=token_file))
+        apis = [RouterSnapshotCache(api)]
+        cache.clear()
+        ConnectionSample.objects.all().delete()
+        Client.objects.all().delete()
+        result = {
+            'clients': num_clients,
+            'collector': bench_collector(apis, args.cycles),
+            'endpoints': bench_endpoints(args.requests),
+            'router_requests': dict(router.requests_served),
+        }
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Collector and dashboard benchmark against a fake router.')
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--cycles', type=int, default=20, help='collector cycles per client count')
+    parser.add_argument('--requests', type=int, default=20, help='requests per dashboard endpoint')
+    parser.add_argument('--latency', type=float, default=0, help='seconds the fake router adds to every response')
+    parser.add_argument('--failure-rate', type=float, default=0, help='fraction of router requests that fail')
+    parser.add_argument('--output', help='json file to write the results to, defaults to stdout')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    test_runner = get_runner(settings)(verbosity=0)
+    old_config = test_runner.setup_databases()
+    try:
+        with tempfile.TemporaryDirectory() as token_dir:
+            results = [run(num_clients, args, os.path.join(token_dir, 'asus_token')) for num_clients in args.clients]
+    finally:
+        test_runner.teardown_databases(old_config)
+
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'db': connection.vendor,
+        'settings': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,70 @@
+# Shows the query plans and timings of the connection sample range queries on a million synthetic samples.
+# Needs the postgres db from settings. Runs against a throwaway test db which is destroyed afterwards.
+# Run from the repo root: python -m scripts.bench_sample_queries
+import argparse
+import datetime
+import os
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wifi_manager.settings')
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.test.utils import get_runner
+from django.conf import settings
+from django.utils import timezone
+
+from wifimanager.models import Client, ConnectionSample
+
+
+def insert_samples(num_samples, num_clients, span):
+    """Inserts num_samples evenly spread over the last span for num_clients clients with generate_series"""
+    Client.objects.bulk_create([Client(mac_addr=f'02:00:00:00:{i // 256:02X}:{i % 256:02X}') for i in range(num_clients)])
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO {ConnectionSample._meta.db_table} (client_id, tx, rx, rssi, connection_time, time_of_sample)
+            SELECT '02:00:00:00:' || lpad(to_hex(i %% %s / 256), 2, '0') || ':' || lpad(to_hex(i %% %s %% 256), 2, '0'),
+                   random() * 300, random() * 300, -30 - (random() * 60)::int, i / %s,
+                   %s - (i * %s / %s) * interval '1 microsecond'
+            FROM generate_series(1, %s) AS i
+        ''', [num_clients, num_clients, num_clients, timezone.now(),
+              int(span.total_seconds() * 1e6), num_samples, num_samples])
+        cursor.execute(f'ANALYZE {ConnectionSample._meta.db_table}')
+
+
+def explain(label, query_set):
+    sql, params = query_set.query.sql_with_params()
+    with connection.cursor() as cursor:
+        start = time.perf_counter()
+        cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params)
+        plan = '\n    '.join(row[0] for row in cursor.fetchall())
+    print(f'{label} ({(time.perf_counter() - start) * 1000:.1f}ms)\n    {plan}\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Connection sample query plan benchmark.')
+    parser.add_argument('--samples', type=int, default=1000000)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--hours', type=float, default=24)
+    args = parser.parse_args()
+
+    test_runner = get_runner(settings)(verbosity=0)
+    old_config = test_runner.setup_databases()
+    try:
+        start = time.perf_counter()
+        insert_samples(args.samples, args.clients, datetime.timedelta(hours=args.hours))
+        print(f'Inserted {args.samples} samples in {time.perf_counter() - start:.1f}s\n')
+        now = timezone.now()
+        explain('get_connection_samples dt=.5',
+                ConnectionSample.objects.filter(time_of_sample__gt=now-datetime.timedelta(minutes=.5)))
+        explain('one client over an hour',
+                ConnectionSample.objects.filter(client_id='02:00:00:00:00:01',
+                                                time_of_sample__gt=now-datetime.timedelta(hours=1)))
+        explain('get_currently_connnected_clients', Client.get_currently_connnected_clients())
+        explain('remove_old_connection_samples rows to delete',
+                ConnectionSample.objects.filter(time_of_sample__lt=now-datetime.timedelta(minutes=5)).only('id'))
+    finally:
+        test_runner.teardown_databases(old_config)
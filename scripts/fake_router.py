@@ -0,0 +1,221 @@
+# A local stand-in for the asus router web server. Used by the benchmark scripts.
+# Serves login.cgi, update_clients.asp, Main_WStatus_Content.asp and start_apply2.htm with a configurable number of
+# clients, added latency and injected failures. Run it on its own with: python -m scripts.fake_router --clients 100
+import argparse
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+WIRELESS_STATUS_ROW = '{mac} Yes        Yes          {rssi}dBm No   {tx}M   {rx}M {connected}\n'
+
+WIRELESS_STATUS_PAGE = '''<html>
+<head><title>ASUS Wireless Router - Wireless Log</title></head>
+<body>
+<table><tr><td>
+<textarea cols="63" rows="25" readonly="readonly" wrap=off style="font-family:'Courier New', Courier, mono;">
+SSID: "boogie"
+Mode: Managed	RSSI: 0 dBm	SNR: 0 dB	noise: -91 dBm	Channel: 6
+BSSID: 2C:56:DC:00:00:01	Capability: ESS ShortSlot
+Supported Rates: [ 1(b) 2(b) 5.5(b) 6 9 11(b) 12 18 24 36 48 54 ]
+
+Stations List
+----------------------------------------
+idx MAC               Associated Authorized    RSSI PSM  Tx rate  Rx rate Connect Time
+{rows}</textarea>
+</td></tr></table>
+</body>
+</html>
+'''
+
+
+def fake_mac(i):
+    return ':'.join(f'{b:02X}' for b in (0x02, 0x00, (i >> 24) & 0xff, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff))
+
+
+def build_wireless_status_page(num_clients):
+    """Builds a Main_WStatus_Content.asp page with num_clients associated clients"""
+    rows = ''.join(
+        WIRELESS_STATUS_ROW.format(mac=fake_mac(i), rssi=-40 - i % 50, tx=round(1 + i * 1.5 % 300, 1),
+                                   rx=round(6.5 + i % 48, 1), connected=f'00:{i // 60 % 60:02}:{i % 60:02}')
+        for i in range(num_clients)
+    )
+    return WIRELESS_STATUS_PAGE.format(rows=rows)
+
+
+LOGIN_REDIRECT_PAGE = "<html><script>top.location.href='/Main_Login.asp';</script></html>"
+
+
+def build_update_clients_js(num_clients, blocked_macs=()):
+    """Builds an update_clients.asp javascript blob with num_clients clients"""
+    clients = ''.join(f'<0>client-{i}>192.168.1.{i % 254 + 1}>{fake_mac(i)}>0>0>0' for i in range(num_clients))
+    blocked = urllib.parse.quote('>'.join(sorted(blocked_macs)))
+    return (
+        f"fromNetworkmapd = '{clients}'.replace(/&#62/g, \">\").replace(/&#60/g, \"<\").split('<');\n"
+        f"time_scheduling_mac = decodeURIComponent('{blocked}').split('>');\n"
+    )
+
+
+class FakeRouterHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+
+    def do_GET(self):
+        if not self._before_response():
+            return
+        if self.path.startswith('/Main_WStatus_Content.asp'):
+            self._respond(build_wireless_status_page(self.server.num_clients))
+        elif self.path.startswith('/update_clients.asp'):
+            self._respond(build_update_clients_js(self.server.num_clients, self.server.blocked_macs))
+        else:
+            self._respond('not found', status=404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        if self.path.startswith('/login.cgi'):
+            if self._before_response(check_token=False):
+                self._respond('', headers={'Set-Cookie': f'asus_token={self.server.issue_token()}; HttpOnly;'})
+        elif not self._before_response():
+            return
+        elif self.path.startswith('/start_apply2.htm'):
+            macs = urllib.parse.parse_qs(body).get('MULTIFILTER_MAC', [''])[0]
+            self.server.blocked_macs = set(mac for mac in macs.split('>') if mac)
+            self.server.applies += 1
+            self._respond('<script>parent.showLoading(5);</script>')
+        else:
+            self._respond('not found', status=404)
+
+    def _before_response(self, check_token=True):
+        """Adds the configured latency and fails or redirects to the login page when it should"""
+        self.server.count_request(self.path.split('?')[0])
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail():
+            self._respond('internal error', status=500)
+            return False
+        if check_token and not self.server.is_valid_token(self._get_token()):
+            self._respond(LOGIN_REDIRECT_PAGE)
+            return False
+        return True
+
+    def _get_token(self):
+        for cookie in self.headers.get('Cookie', '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == 'asus_token':
+                return value
+        return ''
+
+    def _respond(self, body, status=200, headers=None):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeRouter(ThreadingMixIn, HTTPServer):
+    """
+    Serves the router endpoints AsusApi uses and counts the tcp connections and requests made against it.
+    :param latency: seconds added to every response
+    :param failure_rate: the fraction of requests answered with a 500
+    :param require_login: answer with the login page unless the request has a token from login.cgi
+    """
+    daemon_threads = True
+
+    def __init__(self, num_clients=10, host='127.0.0.1', port=0, latency=0, failure_rate=0, require_login=True,
+                 seed=None):
+        super().__init__((host, port), FakeRouterHandler)
+        self.num_clients = num_clients
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.require_login = require_login
+        self.blocked_macs = set()
+        self.applies = 0
+        self.connections_opened = 0
+        self.requests_served = Counter()
+        self._tokens = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}/'
+
+    def count_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def reset_connection_count(self):
+        with self._lock:
+            self.connections_opened = 0
+
+    def count_request(self, path):
+        with self._lock:
+            self.requests_served[path] += 1
+
+    def should_fail(self):
+        with self._lock:
+            return self.failure_rate > 0 and self._random.random() < self.failure_rate
+
+    def issue_token(self):
+        with self._lock:
+            token = str(self._random.getrandbits(100))
+            self._tokens.add(token)
+            return token
+
+    def is_valid_token(self, token):
+        with self._lock:
+            return not self.require_login or token in self._tokens
+
+    def expire_tokens(self):
+        """Logs every client out, like the router's auto logout"""
+        with self._lock:
+            self._tokens.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Local fake asus router.')
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--failure-rate', type=float, default=0, help='fraction of requests answered with a 500')
+    args = parser.parse_args()
+
+    router = FakeRouter(args.clients, args.host, args.port, latency=args.latency, failure_rate=args.failure_rate)
+    print(f'Fake router with {args.clients} clients at {router.url}. Press ctrl-c to stop.')
+    try:
+        router.serve_forever()
+    except KeyboardInterrupt:
+        router.server_close()
@@ -129,4 +129,67 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 # ASUS_API_USERNAME = ''
-# ASUS_API_PASSWORD = ''
\ No newline at end of file
+# ASUS_API_PASSWORD = ''
+# Routers to manage, by name. Without it the router at 192.168.1.1 is managed as 'default' with the credentials above.
+# Each router keeps its token in TOKEN_FILE, ~/asus_token_<name> by default. AiMesh nodes set BLOCK_VIA to the main
+# router's name since the main router's firewall blocks clients for the whole mesh.
+# ASUS_ROUTERS = {
+#     'main': {'HOST': 'http://192.168.1.1/', 'USERNAME': '', 'PASSWORD': ''},
+#     'node': {'HOST': 'http://192.168.1.2/', 'USERNAME': '', 'PASSWORD': '', 'BLOCK_VIA': 'main'},
+# }
+# Max threads polling routers at the same time.
+# ROUTER_POLL_WORKERS = 8
+# Router http session tuning. Can also be set as env variables.
+# ASUS_API_POOL_SIZE = 4
+# ASUS_API_RETRIES = 2
+# ASUS_API_BACKOFF_FACTOR = 0.3
+# ASUS_API_CONNECT_TIMEOUT = 3.05
+# ASUS_API_READ_TIMEOUT = 10.0
+# Seconds before the router login token is refreshed. Keep it below the router's auto logout time.
+# ASUS_API_TOKEN_MAX_AGE = 1200.0
+
+# Store connection samples in time buckets of this many minutes so old samples are removed by dropping a whole
+# bucket. Postgres 11+ only, run manage.py partition_connection_samples after setting it.
+# CONNECTION_SAMPLE_PARTITION_MINUTES = 60
+
+# Days to keep connection sample rollups for, by resolution in seconds. None keeps them forever.
+# CONNECTION_SAMPLE_ROLLUP_RETENTION_DAYS = {60: 7, 3600: 180, 86400: None}
+
+# Seconds between reads of new connection samples for the dashboard's live stream.
+# SAMPLE_STREAM_INTERVAL = 1
+
+# Seconds router snapshots (connected clients, connection statuses) are shared for, and the cache they're kept in.
+# Use a cache shared by all workers, eg. memcached or the db cache, when running more than one worker.
+# ROUTER_SNAPSHOT_TTL = 1
+# ROUTER_SNAPSHOT_CACHE = 'default'
+
+# Seconds to gather block/unblock requests for before applying them to the router in one firewall restart.
+# BLOCK_QUEUE_WINDOW = .5
+
+# Apply router jobs (block/unblock) before the request returns instead of in the background. Handy in tests.
+# ROUTER_JOBS_SYNC = False
+# Seconds after which a router job that's still pending is failed, eg. when the process applying it was restarted.
+# ROUTER_JOB_TIMEOUT = 60
+
+# Block clients whose average tx or rx in Mbps over WINDOW seconds goes over LIMIT. They're unblocked once blocked for
+# QUOTA_MIN_BLOCK_SECONDS and every average is back under RELEASE, 80% of LIMIT by default.
+# A rule with a GROUP only applies to the clients of that ClientGroup.
+# QUOTA_RULES = [
+#     {'METRIC': 'rx', 'WINDOW': 300, 'LIMIT': 50},
+#     {'METRIC': 'rx', 'WINDOW': 300, 'LIMIT': 10, 'GROUP': 'kids'},
+# ]
+# QUOTA_MIN_BLOCK_SECONDS = 300
+
+# Most seconds the collector sleeps between block schedule transitions before reloading the schedules, so edits made
+# on the dashboard are picked up.
+# BLOCK_SCHEDULE_RELOAD_INTERVAL = 60
+
+# Directory the collector spools samples to before they're written to the db, so sampling goes on while the db is
+# slow or down. Samples go straight to the db when it's not set. See wifimanager/spool.py.
+# SAMPLE_SPOOL_DIR = os.path.join(BASE_DIR, 'spool')
+# SAMPLE_SPOOL_SEGMENT_SIZE = 4 * 1024 * 1024
+# Flush each batch to disk so spooled samples survive a power cut, not just the collector crashing.
+# SAMPLE_SPOOL_FSYNC = False
+# Most batches written to the db per transaction, and seconds between drains when the spool is empty or the db is down.
+# SAMPLE_SPOOL_MAX_BATCHES = 500
+# SAMPLE_SPOOL_INTERVAL = 1
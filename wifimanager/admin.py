@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Client, ConnectionSample
+from . import router_jobs
+from .models import BlockReason, BlockSchedule, Client, ClientGroup, ConnectionSample, ConnectionSampleRollup, RouterJob
 
 
 @admin.register(Client)
@@ -9,3 +10,40 @@ class ClientAdmin(admin.ModelAdmin):
 
 
 admin.site.register(ConnectionSample)
+admin.site.register(ConnectionSampleRollup)
+
+
+@admin.register(RouterJob)
+class RouterJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'action', 'macs', 'status', 'created', 'finished')
+
+
+@admin.register(BlockReason)
+class BlockReasonAdmin(admin.ModelAdmin):
+    list_display = ('mac_addr', 'reason', 'created')
+    list_filter = ('reason',)
+
+
+@admin.register(BlockSchedule)
+class BlockScheduleAdmin(admin.ModelAdmin):
+    list_display = ('client', 'group', 'days', 'start', 'end', 'enabled')
+
+
+@admin.register(ClientGroup)
+class ClientGroupAdmin(admin.ModelAdmin):
+    list_display = ('name',)
+    filter_horizontal = ('clients',)
+    actions = ('block_groups', 'unblock_groups')
+
+    def block_groups(self, request, queryset):
+        self._submit(request, 'block', queryset)
+    block_groups.short_description = 'Block the clients of the selected groups'
+
+    def unblock_groups(self, request, queryset):
+        self._submit(request, 'unblock', queryset)
+    unblock_groups.short_description = 'Unblock the clients of the selected groups'
+
+    def _submit(self, request, action, queryset):
+        client_routers = dict(Client.objects.filter(groups__in=queryset).values_list('mac_addr', 'router'))
+        job = router_jobs.submit(action, client_routers, client_routers)
+        self.message_user(request, f'Submitted router job {job.pk} to {action} {len(client_routers)} clients')
@@ -0,0 +1,192 @@
+"""
+Per client bandwidth analytics over a window of raw connection samples.
+
+The window is loaded once into columnar numpy arrays sorted by client and time, a chunk of rows at a time as they're
+read from the db so no python object per sample is kept around. Every statistic is computed with whole array
+operations over the client groups, so the cost per sample stays a few numpy ops even with millions of samples.
+Only raw samples are analyzed, older samples have been rolled up, see rollups.py.
+"""
+import itertools
+from operator import itemgetter
+
+import numpy as np
+from django.db.models import FloatField, Func
+from django.utils import timezone
+
+from .models import ConnectionSample
+
+# a gap between two samples of a client longer than this means it was disconnected, it isn't counted as transfer
+MAX_SAMPLE_GAP = 10
+
+# clients whose transfer has a modified z-score above this are reported as anomalies
+ANOMALY_Z_SCORE = 3.5
+
+# rows fetched from the db and converted into arrays at a time
+LOAD_CHUNK_SIZE = 10000
+
+
+class Epoch(Func):
+    """Seconds since the unix epoch of a datetime. Computed by the db so rows don't need converting one by one"""
+    template = 'EXTRACT(EPOCH FROM %(expressions)s)'
+
+    def as_sqlite(self, compiler, connection):
+        return super().as_sql(compiler, connection, template='((julianday(%(expressions)s) - 2440587.5) * 86400.0)')
+
+
+class SampleWindow:
+    """
+    Connection samples as parallel arrays sorted by client then time.
+    client_index holds each sample's index into macs, times are unix timestamps.
+    """
+
+    def __init__(self, macs, client_index, times, tx, rx, rssi):
+        self.macs = macs
+        self.client_index = client_index
+        self.times = times
+        self.tx = tx
+        self.rx = rx
+        self.rssi = rssi
+
+    @classmethod
+    def load(cls, start, end=None, router=None):
+        samples = ConnectionSample.objects.filter(time_of_sample__gt=start)
+        if end is not None:
+            samples = samples.filter(time_of_sample__lte=end)
+        if router:
+            samples = samples.filter(router=router)
+        rows = (samples
+                .annotate(epoch=Epoch('time_of_sample', output_field=FloatField()))
+                .order_by('client_id', 'time_of_sample')
+                .values_list('client_id', 'epoch', 'tx', 'rx', 'rssi'))
+        rows = rows.iterator()
+        return cls.from_chunks(iter(lambda: list(itertools.islice(rows, LOAD_CHUNK_SIZE)), []))
+
+    @classmethod
+    def from_rows(cls, rows, chunk_size=LOAD_CHUNK_SIZE):
+        """Builds a window from a list of (mac, unix timestamp, tx, rx, rssi) rows already ordered by mac and time"""
+        return cls.from_chunks(rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size))
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Builds a window from lists of rows like from_rows, converting each list into typed arrays as it comes"""
+        macs, run_clients, run_lengths, columns = [], [], [], ([], [], [], [])
+        for chunk in chunks:
+            # rows are ordered by mac, so each client is a run of rows, which can carry on from the previous chunk
+            for mac, run in itertools.groupby(map(itemgetter(0), chunk)):
+                if not macs or mac != macs[-1]:
+                    macs.append(mac)
+                run_clients.append(len(macs) - 1)
+                run_lengths.append(sum(1 for _ in run))
+            for i, column in enumerate(columns, start=1):
+                column.append(np.fromiter(map(itemgetter(i), chunk), np.float64, len(chunk)))
+        if not macs:
+            return cls([], np.zeros(0, np.int64), np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0))
+        client_index = np.repeat(np.array(run_clients, dtype=np.int64), run_lengths)
+        return cls(macs, client_index, *(np.concatenate(column) for column in columns))
+
+    def __len__(self):
+        return len(self.times)
+
+    def get_client_stats(self):
+        """
+        Returns {mac: stats} with sample_count, mean/p95/max tx and rx in Mbps, tx_mb/rx_mb the estimated megabytes
+        transferred, mean rssi and rssi_trend in dBm per minute (negative means the signal is getting weaker)
+        """
+        if not len(self):
+            return {}
+        num_clients = len(self.macs)
+        counts = np.bincount(self.client_index, minlength=num_clients)
+        group_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        durations = self._get_sample_durations()
+        stats = {
+            'sample_count': counts,
+            'rssi': np.bincount(self.client_index, self.rssi, num_clients) / counts,
+            'rssi_trend': self._get_slopes(self.rssi, counts) * 60,
+        }
+        for metric, values in (('tx', self.tx), ('rx', self.rx)):
+            stats[f'{metric}_mean'] = np.bincount(self.client_index, values, num_clients) / counts
+            stats[f'{metric}_max'] = np.maximum.reduceat(values, group_starts)
+            stats[f'{metric}_p95'] = self._get_percentiles(values, 95, counts, group_starts)
+            # Mbps over the seconds until the next sample, in megabytes
+            stats[f'{metric}_mb'] = np.bincount(self.client_index, values * durations, num_clients) / 8
+        return {
+            mac: {name: values[i].item() for name, values in stats.items()}
+            for i, mac in enumerate(self.macs)
+        }
+
+    def _get_sample_durations(self):
+        """
+        Seconds each sample's rate is assumed to have lasted: until the client's next sample, within MAX_SAMPLE_GAP
+        """
+        durations = np.zeros(len(self))
+        if len(self) > 1:
+            gaps = np.diff(self.times)
+            same_client = self.client_index[1:] == self.client_index[:-1]
+            valid = same_client & (gaps <= MAX_SAMPLE_GAP)
+            durations[:-1] = np.where(valid, gaps, 0)
+            # a client's last sample counts for the typical gap between samples
+            typical_gap = np.median(gaps[valid]) if valid.any() else 0
+            durations[:-1][~same_client] = typical_gap
+            durations[-1] = typical_gap
+        return durations
+
+    def _get_percentiles(self, values, pct, counts, group_starts):
+        """Nearest rank percentile of values within each client, like rollups.percentile"""
+        # one sort on client index + value scaled into [0, .5] puts each client's values in order within its run
+        spread = values.max() - values.min()
+        scaled = (values - values.min()) / (2 * spread) if spread else np.zeros(len(values))
+        order = np.argsort(self.client_index + scaled)
+        ranks = np.maximum(np.ceil(pct / 100 * counts).astype(np.int64) - 1, 0)
+        return values[order][group_starts + ranks]
+
+    def _get_slopes(self, values, counts):
+        """Least squares slope of values over time per client, 0 for clients with a single sample time"""
+        num_clients = len(self.macs)
+        times = self.times - self.times.min()
+        mean_times = np.bincount(self.client_index, times, num_clients) / counts
+        mean_values = np.bincount(self.client_index, values, num_clients) / counts
+        time_deviations = times - mean_times[self.client_index]
+        covariance = np.bincount(self.client_index, time_deviations * (values - mean_values[self.client_index]),
+                                 num_clients)
+        variance = np.bincount(self.client_index, time_deviations ** 2, num_clients)
+        slopes = np.zeros(num_clients)
+        np.divide(covariance, variance, out=slopes, where=variance > 0)
+        return slopes
+
+
+def get_top_talkers(client_stats, limit=10):
+    """Returns the macs of the clients that transferred the most, most first"""
+    return sorted(client_stats, key=lambda mac: client_stats[mac]['tx_mb'] + client_stats[mac]['rx_mb'],
+                  reverse=True)[:limit]
+
+
+def get_anomalies(client_stats, z_score=ANOMALY_Z_SCORE):
+    """
+    Returns the macs of clients whose transfer is far above the rest, by modified z-score of the median
+    absolute deviation so one heavy client doesn't hide itself by pulling up the mean
+    """
+    if len(client_stats) < 3:
+        return []
+    macs = list(client_stats)
+    transfers = np.array([client_stats[mac]['tx_mb'] + client_stats[mac]['rx_mb'] for mac in macs])
+    median = np.median(transfers)
+    deviation = np.median(np.abs(transfers - median))
+    if deviation == 0:
+        return []
+    scores = 0.6745 * (transfers - median) / deviation
+    return [macs[i] for i in np.argsort(-scores) if scores[i] > z_score]
+
+
+def analyze(dt, router=None, top=10):
+    """Analyzes the raw samples in the range of now-dt, see SampleWindow.get_client_stats"""
+    now = timezone.now()
+    window = SampleWindow.load(now - dt, now, router)
+    client_stats = window.get_client_stats()
+    return {
+        'start': now - dt,
+        'end': now,
+        'sample_count': len(window),
+        'clients': client_stats,
+        'top_talkers': get_top_talkers(client_stats, top),
+        'anomalies': get_anomalies(client_stats),
+    }
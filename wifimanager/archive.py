@@ -0,0 +1,182 @@
+"""
+Compact columnar archives of connection samples and their rollups, for keeping months of history offline and
+loading slices back.
+
+An archive is a numpy .npz file, a zip of .npy arrays, written one chunk of rows at a time so memory stays bounded
+whatever the range. Raw samples are in members chunk_NNNNNN/<column> and rollups in rollup_chunk_NNNNNN/<column>, with
+macs and routers dictionary encoded as indexes into the macs and routers arrays written at the end.
+np.load(path) reads it too.
+
+Raw samples are only kept for RAW_SAMPLE_MAX_AGE, so most of an exported range's history is in its rollups. Imported
+raw samples older than that are rolled up into the buckets the archive has no rollups for and then removed by the
+collector's retention like any other sample, the imported rollups are kept for CONNECTION_SAMPLE_ROLLUP_RETENTION_DAYS.
+"""
+import itertools
+import json
+import zipfile
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Client, ConnectionSample, ConnectionSampleRollup
+from .rollups import METRICS, rollup_range
+
+ARCHIVE_VERSION = 2
+
+# column name, dtype
+COLUMNS = (
+    ('time', np.int64),
+    ('client', np.uint32),
+    ('router', np.uint16),
+    ('tx', np.float64),
+    ('rx', np.float64),
+    ('rssi', np.int16),
+    ('connection_time', np.uint32),
+)
+
+ROLLUP_STATS = tuple(f'{metric}_{stat}' for metric in METRICS for stat in ('min', 'avg', 'max', 'p95'))
+
+ROLLUP_COLUMNS = (
+    ('bucket_start', np.int64),
+    ('client', np.uint32),
+    ('resolution', np.uint32),
+    ('sample_count', np.uint32),
+) + tuple((stat, np.float64) for stat in ROLLUP_STATS)
+
+
+def _write_array(archive, name, array):
+    with archive.open(f'{name}.npy', 'w', force_zip64=True) as fh:
+        np.lib.format.write_array(fh, np.asarray(array), allow_pickle=False)
+
+
+def _encode_times(times):
+    # times are utc, numpy takes them without the tzinfo
+    return np.array([time.replace(tzinfo=None) for time in times], dtype='datetime64[us]').astype(np.int64)
+
+
+def _decode_times(column):
+    return [time.replace(tzinfo=timezone.utc) for time in column.astype('datetime64[us]').tolist()]
+
+
+def _write_chunks(archive, prefix, rows, columns, encoders, chunk_size):
+    """
+    Writes rows as chunks of columns, the columns named in encoders are encoded by them first
+    :return: the number of rows and chunks written
+    """
+    num_rows = num_chunks = 0
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+        for (name, dtype), column in zip(columns, zip(*chunk)):
+            if name in encoders:
+                column = encoders[name](column)
+            _write_array(archive, f'{prefix}{num_chunks:06d}/{name}', np.array(column, dtype=dtype))
+        num_rows += len(chunk)
+        num_chunks += 1
+    return num_rows, num_chunks
+
+
+def export_samples(samples, path, chunk_size=100000, rollups=None):
+    """
+    Writes the samples and rollups of querysets to an archive at path
+    :param chunk_size: rows per chunk, the most rows held in memory at once
+    :param rollups: a ConnectionSampleRollup queryset, no rollups are written when None
+    :return: the number of samples and rollups written
+    """
+    macs, routers = {}, {}
+    encoders = {
+        'time': _encode_times,
+        'bucket_start': _encode_times,
+        'client': lambda client_ids: [macs.setdefault(mac, len(macs)) for mac in client_ids],
+        'router': lambda router_names: [routers.setdefault(router, len(routers)) for router in router_names],
+    }
+    sample_rows = (samples
+                   .order_by('time_of_sample', 'id')
+                   .values_list('time_of_sample', 'client_id', 'router', 'tx', 'rx', 'rssi', 'connection_time')
+                   .iterator())
+    rollup_rows = (rollups
+                   .order_by('bucket_start', 'resolution', 'client_id')
+                   .values_list('bucket_start', 'client_id', 'resolution', 'sample_count', *ROLLUP_STATS)
+                   .iterator()) if rollups is not None else iter(())
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        num_samples, num_chunks = _write_chunks(archive, 'chunk_', sample_rows, COLUMNS, encoders, chunk_size)
+        num_rollups, num_rollup_chunks = _write_chunks(archive, 'rollup_chunk_', rollup_rows, ROLLUP_COLUMNS,
+                                                       encoders, chunk_size)
+        _write_array(archive, 'macs', np.array(list(macs), dtype='U17'))
+        _write_array(archive, 'routers', np.array(list(routers), dtype=str))
+        archive.writestr('meta.json', json.dumps({
+            'version': ARCHIVE_VERSION,
+            'samples': num_samples,
+            'chunks': num_chunks,
+            'columns': [name for name, dtype in COLUMNS],
+            'rollups': num_rollups,
+            'rollup_chunks': num_rollup_chunks,
+            'rollup_columns': [name for name, dtype in ROLLUP_COLUMNS],
+            'exported': timezone.now().isoformat(),
+        }))
+    return num_samples, num_rollups
+
+
+def read_chunks(path, rollups=False):
+    """
+    Yields the macs and routers of an archive, then each chunk of its samples, or of its rollups, as a dict of
+    column name: array with times as microseconds since the epoch
+    """
+    with np.load(path, allow_pickle=False) as archive:
+        meta = json.loads(archive.zip.read('meta.json'))
+        if meta['version'] not in (1, ARCHIVE_VERSION):
+            raise ValueError(f'Unsupported archive version {meta["version"]}')
+        yield archive['macs'].tolist(), archive['routers'].tolist()
+        # version 1 archives have no rollups
+        prefix, columns, num_chunks = (('rollup_chunk_', ROLLUP_COLUMNS, meta.get('rollup_chunks', 0)) if rollups
+                                       else ('chunk_', COLUMNS, meta['chunks']))
+        for i in range(num_chunks):
+            yield {name: archive[f'{prefix}{i:06d}/{name}'] for name, dtype in columns}
+
+
+def import_samples(path, batch_size=5000):
+    """
+    Adds the samples and rollups of an archive to the db in one transaction, reading one chunk at a time. Clients
+    missing from the db are added and the imported samples are rolled up, see the module docstring.
+    Rollups already in the db are kept over the archive's, but samples already in the db aren't detected, importing
+    an archive twice adds its samples twice.
+    :return: the number of samples and rollups added
+    """
+    chunks = read_chunks(path)
+    macs, routers = next(chunks)
+    num_samples = num_rollups = 0
+    first_time = last_time = None
+    # in one transaction so retention can't remove the old samples before they're rolled up
+    with transaction.atomic():
+        known_macs = set(Client.objects.filter(pk__in=macs).values_list('pk', flat=True))
+        Client.objects.bulk_create(Client(mac_addr=mac) for mac in macs if mac not in known_macs)
+        for chunk in chunks:
+            times = _decode_times(chunk['time'])
+            samples = [
+                ConnectionSample(time_of_sample=time, client_id=macs[client], router=routers[router], tx=tx, rx=rx,
+                                 rssi=rssi, connection_time=connection_time)
+                for time, client, router, tx, rx, rssi, connection_time in zip(
+                    times, *(chunk[name].tolist() for name, dtype in COLUMNS[1:]))
+            ]
+            ConnectionSample.objects.bulk_create(samples, batch_size=batch_size)
+            num_samples += len(samples)
+            # chunks are in time order
+            first_time, last_time = first_time or times[0], times[-1]
+        rollup_chunks = read_chunks(path, rollups=True)
+        next(rollup_chunks)
+        for chunk in rollup_chunks:
+            bucket_starts = _decode_times(chunk['bucket_start'])
+            rolled_up = set(ConnectionSampleRollup.objects
+                            .filter(bucket_start__gte=bucket_starts[0], bucket_start__lte=bucket_starts[-1])
+                            .values_list('resolution', 'client_id', 'bucket_start'))
+            rollups = [
+                ConnectionSampleRollup(bucket_start=bucket_start, client_id=macs[client], resolution=resolution,
+                                       sample_count=sample_count, **dict(zip(ROLLUP_STATS, stats)))
+                for bucket_start, client, resolution, sample_count, *stats in zip(
+                    bucket_starts, *(chunk[name].tolist() for name, dtype in ROLLUP_COLUMNS[1:]))
+                if (resolution, macs[client], bucket_start) not in rolled_up
+            ]
+            ConnectionSampleRollup.objects.bulk_create(rollups, batch_size=batch_size)
+            num_rollups += len(rollups)
+        if num_samples:
+            num_rollups += rollup_range(first_time, last_time)
+    return num_samples, num_rollups
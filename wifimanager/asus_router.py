@@ -1,11 +1,17 @@
 import requests
 import os
 import base64
+import html
 import logging
+import threading
 import urllib.parse
 import re
-from datetime import datetime
+import tempfile
+import time
+from datetime import datetime, timezone
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 logger = logging.getLogger(__name__)
@@ -20,36 +26,237 @@ except KeyError as e:
     ASUS_API_PASSWORD = getattr(settings, 'ASUS_API_PASSWORD', None)
 
 
+def _get_setting(name, default):
+    """Reads a tuning value from env variables or conf.settings, cast to the type of default"""
+    try:
+        value = os.environ[name]
+    except KeyError:
+        from django.conf import settings
+        value = getattr(settings, name, default)
+    return type(default)(value)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the process wide requests session used to talk to the router.
+    The session keeps its connections alive so polling the router doesn't open a new tcp connection on every call.
+    Pool size and retry/backoff are read from env variables or conf.settings:
+    ASUS_API_POOL_SIZE, ASUS_API_RETRIES, ASUS_API_BACKOFF_FACTOR. Every router in ASUS_ROUTERS keeps its own pool.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session(
+                    pool_size=_get_setting('ASUS_API_POOL_SIZE', 4),
+                    retries=_get_setting('ASUS_API_RETRIES', 2),
+                    backoff_factor=_get_setting('ASUS_API_BACKOFF_FACTOR', 0.3),
+                    num_hosts=len(get_router_configs()),
+                )
+    return _session
+
+
+def build_session(pool_size=4, retries=2, backoff_factor=0.3, num_hosts=1):
+    """
+    Builds a connection pooled requests session.
+    Only idempotent requests are retried, so posts to the router (login, block clients) are never sent twice.
+    :param pool_size: connections kept alive per host
+    :param num_hosts: hosts the session talks to, each keeps its pool. With fewer, switching between hosts drops
+                      the connections of the least recently used one
+    """
+    retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff_factor,
+                  status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=num_hosts, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+DEFAULT_ROUTER = 'default'
+
+
+def get_router_configs():
+    """
+    Returns {router name: config} from the ASUS_ROUTERS setting. A config can set HOST, USERNAME, PASSWORD,
+    TOKEN_FILE and BLOCK_VIA, the name of the router that blocks its clients (eg. the main router of an AiMesh).
+    Without ASUS_ROUTERS there's a single router named default at AsusApi.HOST.
+    """
+    from django.conf import settings
+    return getattr(settings, 'ASUS_ROUTERS', None) or {DEFAULT_ROUTER: {}}
+
+
+def get_router_apis():
+    """Returns an AsusApi for every configured router"""
+    return [AsusApi.for_router(router) for router in get_router_configs()]
+
+
+def get_block_router(router):
+    """
+    Returns the name of the router that applies blocks for clients on router.
+    Routers that aren't configured, eg. default after ASUS_ROUTERS is set, are blocked via the first configured router.
+    """
+    configs = get_router_configs()
+    if router not in configs:
+        return next(iter(configs))
+    return configs[router].get('BLOCK_VIA', router)
+
+
+class NotLoggedInError(Exception):
+    """The router answered with its login page, even after logging in again"""
+
+
+_token_managers = {}
+_token_managers_lock = threading.Lock()
+
+
+def get_token_manager(router=DEFAULT_ROUTER, token_file=None):
+    """
+    Returns the process wide TokenManager of router. The token is refreshed after ASUS_API_TOKEN_MAX_AGE seconds,
+    read from env variables or conf.settings. Keep it below the router's auto logout time.
+    :param token_file: where the token is kept, defaults to ~/asus_token for the default router and
+                       ~/asus_token_<router> for the others
+    """
+    token_manager = _token_managers.get(router)
+    if token_manager is None:
+        with _token_managers_lock:
+            token_manager = _token_managers.get(router)
+            if token_manager is None:
+                if token_file is None and router != DEFAULT_ROUTER:
+                    token_file = f'~/asus_token_{router}'
+                token_manager = TokenManager(max_age=_get_setting('ASUS_API_TOKEN_MAX_AGE', 1200.0),
+                                             token_file=token_file)
+                _token_managers[router] = token_manager
+    return token_manager
+
+
+class TokenManager:
+    """
+    Keeps the router login token in memory and logs in again before it gets too old.
+    The token file is only read when the manager is made. Logins are serialized, so callers that find the token
+    stale at the same time share a single login.
+    """
+
+    def __init__(self, max_age=1200.0, clock=time.time, token_file=None):
+        self.max_age = max_age
+        self.clock = clock
+        self.token_file = token_file
+        self._lock = threading.Lock()
+        self.token = AsusToken(path=token_file)
+        self.issued_at = self.token.get_saved_time() if self.token else None
+
+    def get_token(self, login):
+        """
+        Returns the current token, logging in first when there's no token or it's past max_age
+        :param login: a callable that logs in to the router and returns the new AsusToken
+        """
+        token = self.token
+        if not token or self.issued_at is None or self.clock() - self.issued_at >= self.max_age:
+            token = self.refresh(login, token)
+        return token
+
+    def refresh(self, login, stale_token=None):
+        """
+        Logs in and returns the new token.
+        :param stale_token: the token the caller found stale. If another caller already replaced it the
+                            replacement is returned without logging in again. None always logs in.
+        """
+        with self._lock:
+            if stale_token is not None and self.token is not stale_token:
+                return self.token
+            token = login()
+            if not token:
+                logger.info('Login failed')
+            self.token = token
+            self.issued_at = self.clock()
+            return token
+
+
 class AsusApi:
 
     HOST = 'http://192.168.1.1/'
 
-    def __init__(self, username=None, password=None):
-        self.asus_token = AsusToken()
+    # the router redirects requests without a valid token to its login page
+    LOGIN_REDIRECT_RE = re.compile(r'location\.href\s*=\s*[\'"]/?Main_Login\.asp')
+
+    def __init__(self, username=None, password=None, session=None, timeout=None, token_manager=None, host=None,
+                 router=DEFAULT_ROUTER):
+        self.router = router
+        self.host = host if host else self.HOST
+        self.token_manager = token_manager if token_manager is not None else get_token_manager(router)
         self.username = username if username else ASUS_API_USERNAME
         self.password = password if password else ASUS_API_PASSWORD
+        self.session = session if session is not None else get_session()
+        self.timeout = timeout if timeout is not None else (
+            _get_setting('ASUS_API_CONNECT_TIMEOUT', 3.05),
+            _get_setting('ASUS_API_READ_TIMEOUT', 10.0),
+        )
+
+    @classmethod
+    def for_router(cls, router):
+        """Makes an AsusApi for the router configured under that name in ASUS_ROUTERS"""
+        config = get_router_configs()[router]
+        return cls(config.get('USERNAME'), config.get('PASSWORD'), host=config.get('HOST'), router=router,
+                   token_manager=get_token_manager(router, config.get('TOKEN_FILE')))
+
+    @property
+    def asus_token(self):
+        return self.token_manager.token
 
     def login(self):
-        """Logs in to the router using either conf.settings or env variables"""
+        """Logs in to the router using either conf.settings or env variables, even if the current token is fresh"""
+        return self.token_manager.refresh(self._login)
+
+    def _login(self):
         url = self._get_url('login.cgi')
         data = {
             'login_authorization': self.get_credentials_b64_encoded()
         }
-        req = requests.post(url, headers=self._get_headers(), data=data)
+        req = self.session.post(url, headers=self._get_headers(), data=data, timeout=self.timeout)
         token_cookie_str = req.headers.get('Set-Cookie')
-        self.asus_token = AsusToken.from_cookie_str(token_cookie_str)
-        if not self.asus_token:
-            logger.info('Login failed')
+        return AsusToken.from_cookie_str(token_cookie_str, path=self.token_manager.token_file)
 
     def get_client_connection_statuses(self):
-        url = self._get_url('Main_WStatus_Content.asp')
-        res = requests.get(url, headers=self._get_headers())
-        return self.parse_client_connection_html(res.content.decode('utf-8'))
+        return self.parse_client_connection_html(self.get_page('Main_WStatus_Content.asp'))
 
     def get_connected_clients(self):
-        url = self._get_url('update_clients.asp')
-        res = requests.get(url, headers=self._get_headers())
-        return self.parse_clients(res.content.decode('utf-8'))
+        return self.parse_clients(self.get_page('update_clients.asp'))
+
+    def get_blocked_macs(self):
+        """Returns the macs the router currently blocks, including clients that aren't connected"""
+        return self.parse_blocked_macs(urllib.parse.unquote(self.get_page('update_clients.asp')))
+
+    def get_page(self, path):
+        """Gets a page from the router and returns it decoded"""
+        return self._request('get', path)
+
+    def _request(self, method, path, **kwargs):
+        """
+        Sends a request with the current token and returns the decoded response.
+        Logs in once and resends if the router answers with its login page.
+        """
+        token = self.token_manager.get_token(self._login)
+        content = self._send(method, path, token, **kwargs)
+        if self.is_login_redirect(content):
+            logger.info(f'Token rejected requesting {path}, logging in again')
+            token = self.token_manager.refresh(self._login, token)
+            content = self._send(method, path, token, **kwargs)
+            if self.is_login_redirect(content):
+                raise NotLoggedInError(f'Not logged in to the router requesting {path}')
+        return content
+
+    def _send(self, method, path, token, **kwargs):
+        send = getattr(self.session, method)
+        res = send(self._get_url(path), headers=self._get_headers(token), timeout=self.timeout, **kwargs)
+        return res.content.decode('utf-8')
+
+    @classmethod
+    def is_login_redirect(cls, content):
+        return cls.LOGIN_REDIRECT_RE.search(content) is not None
 
     def block_clients(self, client_macs):
         """
@@ -58,9 +265,7 @@ class AsusApi:
         :param client_macs - the mac addresses of clients to block. Must include macs already blocked if you want them
                              to continue being blocked.
         """
-        url = self._get_url('start_apply2.htm')
-        res = requests.post(url, headers=self._get_headers(), data=self.build_block_clients_data(client_macs))
-        return res.content.decode('utf-8')
+        return self._request('post', 'start_apply2.htm', data=self.build_block_clients_data(client_macs))
 
     def unblock_all_clients(self):
         return self.block_clients([])
@@ -99,15 +304,65 @@ class AsusApi:
 
     @classmethod
     def parse_client_connection_html(cls, connections_html):
+        """
+        Parses the stations list out of the Main_WStatus_Content.asp page.
+        Scans straight to the textarea and tokenizes its rows without building a tree.
+        Falls back to BeautifulSoup only to find a textarea the scan misses, eg. an upper case tag.
+        Raises a ValueError if the stations list can't be found or a row can't be tokenized.
+        :return: a list of ClientConnectionSample objects
+        """
+        text_area_content = cls.find_text_area_content(connections_html)
+        if text_area_content is None:
+            logger.debug('Falling back to BeautifulSoup to find the textarea in connections html')
+            return cls.parse_client_connection_html_soup(connections_html)
+        return cls.parse_stations_list(text_area_content)
+
+    @classmethod
+    def parse_client_connection_html_fast(cls, connections_html):
+        """Raises a ValueError if the textarea or stations list can't be found or a row can't be tokenized"""
+        text_area_content = cls.find_text_area_content(connections_html)
+        if text_area_content is None:
+            raise ValueError('textarea not found')
+        return cls.parse_stations_list(text_area_content)
+
+    @staticmethod
+    def find_text_area_content(connections_html):
+        """Returns the unescaped content of the first lower case textarea tag or None if there isn't a closed one"""
+        text_area_start = connections_html.find('<textarea')
+        if text_area_start == -1:
+            return None
+        text_area_start = connections_html.find('>', text_area_start) + 1
+        text_area_end = connections_html.find('</textarea>', text_area_start)
+        if text_area_start == 0 or text_area_end == -1:
+            return None
+        text_area_content = connections_html[text_area_start:text_area_end]
+        if '&' in text_area_content:
+            text_area_content = html.unescape(text_area_content)
+        return text_area_content
+
+    @staticmethod
+    def parse_stations_list(text_area_content):
+        """Raises a ValueError if the stations list can't be found or a row can't be tokenized"""
+        _, found, stations = text_area_content.partition('idx MAC')
+        if not found:
+            raise ValueError('stations list not found')
+        sample_time = datetime.now(timezone.utc)
+        from_sample_fields = ClientConnectionSample.from_sample_fields
         connection_samples = []
-        soup = BeautifulSoup(connections_html, 'html.parser')
-        text_area_content = soup.textarea.get_text().split('idx MAC')[1]
-        for sample in text_area_content.splitlines():
-            if 'Associated Authorized' not in sample and sample.strip():
-                new_sample = ClientConnectionSample.from_raw_sample_text(sample)
-                connection_samples.append(new_sample)
+        for sample in stations.splitlines():
+            sample_fields = sample.split()
+            if sample_fields and 'Associated Authorized' not in sample:
+                connection_samples.append(from_sample_fields(sample_fields, sample_time))
         return connection_samples
 
+    @classmethod
+    def parse_client_connection_html_soup(cls, connections_html):
+        """Raises a ValueError if the textarea or stations list can't be found or a row can't be tokenized"""
+        soup = BeautifulSoup(connections_html, 'html.parser')
+        if soup.textarea is None:
+            raise ValueError('textarea not found')
+        return cls.parse_stations_list(soup.textarea.get_text())
+
     @classmethod
     def parse_clients(cls, raw_clients_js):
         """
@@ -158,12 +413,12 @@ class AsusApi:
         return base64.b64encode(credentials_formatted.encode('utf-8'))
 
     def _get_url(self, path):
-        return f'{self.HOST}{path}'
+        return f'{self.host}{path}'
 
-    def _get_headers(self):
+    def _get_headers(self, token=''):
         headers = {
-            'Referer': 'http://192.168.1.1/Main_Login.asp',
-            'Cookie': f'asus_token={self.asus_token}'
+            'Referer': f'{self.host}Main_Login.asp',
+            'Cookie': f'asus_token={token}'
         }
         return headers
 
@@ -172,7 +427,9 @@ class AsusApi:
 
 
 class AsusToken:
-    def __init__(self, token=None):
+    def __init__(self, token=None, path=None):
+        """:param path: the token file, defaults to ~/asus_token"""
+        self.path = path
         if token is not None:
             self.token = token
             self._save_token()
@@ -180,9 +437,9 @@ class AsusToken:
             self.token = self._load_token()
 
     @staticmethod
-    def from_cookie_str(cookie_str):
+    def from_cookie_str(cookie_str, path=None):
         token_str = cookie_str.split(';')[0].split('=')[1] if cookie_str else ''
-        return AsusToken(token_str)
+        return AsusToken(token_str, path)
 
     def _load_token(self):
         """Loads the asus api token and returns it"""
@@ -194,11 +451,27 @@ class AsusToken:
             return ''
 
     def _save_token(self):
-        """Saves the asus token for future use"""
-        with open(self._get_token_full_path(), 'w') as fh:
-            fh.write(self.token)
+        """Saves the asus token for future use. The file is replaced atomically so readers never see a partial token"""
+        path = self._get_token_full_path()
+        fd, tmp_path = tempfile.mkstemp(prefix='.asus_token', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(self.token)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get_saved_time(self):
+        """Returns when the token file was last written as a unix timestamp, None if there is no file"""
+        try:
+            return os.path.getmtime(self._get_token_full_path())
+        except OSError:
+            return None
 
     def _get_token_full_path(self):
+        if self.path:
+            return os.path.expanduser(self.path)
         return os.path.join(os.path.expanduser("~"), 'asus_token')
 
     def __str__(self):
@@ -222,25 +495,50 @@ class AsusToken:
 
 
 class ClientConnectionSample:
-    """A sample of a clients connection at a point in time."""
-    def __init__(self, mac_addr, rssi, tx_rate, rx_rate, connection_time):
+    """
+    A sample of a clients connection at a point in time.
+    rssi is in dBm, tx_rate and rx_rate in Mbps and connection_time in seconds. Samples parsed from the same page
+    share one sample_time, an aware utc datetime so it keeps going forward when the clocks fall back.
+    Treat samples as immutable, they're hashed by value.
+    """
+    __slots__ = ('mac_addr', 'rssi', 'tx_rate', 'rx_rate', 'connection_time', 'sample_time')
+
+    def __init__(self, mac_addr, rssi, tx_rate, rx_rate, connection_time, sample_time=None):
         self.mac_addr = mac_addr
         self.rssi = rssi
         self.tx_rate = tx_rate
         self.rx_rate = rx_rate
         self.connection_time = connection_time
-        self.sample_time = datetime.now()
+        self.sample_time = sample_time if sample_time is not None else datetime.now(timezone.utc)
 
     @classmethod
-    def from_raw_sample_text(self, sample_text):
-        stripped_sample = re.subn(' +', ' ', sample_text)[0].strip()
-        if stripped_sample:
-            mac, *_, rssi, __, tx, rx, connection_time = stripped_sample.split(' ')
-            tx = tx.replace('M', '')
-            rx = rx.replace('M', '')
-            return ClientConnectionSample(mac, rssi, tx, rx, connection_time)
+    def from_raw_sample_text(cls, sample_text, sample_time=None):
+        sample_fields = sample_text.split()
+        if sample_fields:
+            return cls.from_sample_fields(sample_fields, sample_time)
         return None
 
+    @classmethod
+    def from_sample_fields(cls, sample_fields, sample_time=None):
+        """
+        Builds a sample from a whitespace split stations list row, eg. -60dBm 121.5M 6.5M 00:01:42.
+        Raises a ValueError if the row is too short or a field isn't a number.
+        """
+        mac, *_, rssi, __, tx, rx, connection_time = sample_fields
+        return cls(mac, int(rssi.replace('dBm', '')), float(tx.replace('M', '')), float(rx.replace('M', '')),
+                   cls.parse_connection_time(connection_time), sample_time)
+
+    @staticmethod
+    def parse_connection_time(connection_time):
+        """Parses a connection time into seconds eg. 01:24:12 -> 5052"""
+        seconds = 0
+        for part in connection_time.split(':'):
+            seconds = seconds * 60 + int(part)
+        return seconds
+
+    def _key(self):
+        return self.mac_addr, self.rssi, self.tx_rate, self.rx_rate, self.connection_time
+
     def __repr__(self):
         return str(self)
 
@@ -248,23 +546,27 @@ class ClientConnectionSample:
         return f'{self.mac_addr} (tx={self.tx_rate} rx={self.rx_rate})'
 
     def __eq__(self, other):
-        return (
-            self.mac_addr == other.mac_addr and
-            self.rssi == other.rssi and
-            self.tx_rate == other.tx_rate and
-            self.rx_rate == other.rx_rate and
-            self.connection_time == other.connection_time
-        )
+        if not isinstance(other, ClientConnectionSample):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
 
 
 class Client:
-    """Used to represent a client connected to the router"""
+    """Used to represent a client connected to the router. Treat clients as immutable, they're hashed by value"""
+    __slots__ = ('name', 'mac_addr', 'ip_addr', 'is_blocked')
+
     def __init__(self, name, mac_addr, ip_addr, is_blocked):
         self.name = name
         self.mac_addr = mac_addr
         self.ip_addr = ip_addr
         self.is_blocked = is_blocked
 
+    def _key(self):
+        return self.name, self.mac_addr, self.ip_addr, self.is_blocked
+
     def __repr__(self):
         return str(self)
 
@@ -272,10 +574,13 @@ class Client:
         return f'{self.name} (mac={self.mac_addr}  ip={self.ip_addr} blocked={self.is_blocked})'
 
     def __eq__(self, other):
-        return (self.name == other.name and
-                self.mac_addr == other.mac_addr and
-                self.ip_addr == other.ip_addr and
-                self.is_blocked == other.is_blocked)
+        if not isinstance(other, Client):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
 
 if __name__ == '__main__':
     asus = AsusApi()
@@ -0,0 +1,126 @@
+"""
+Coalesces block and unblock requests into as few router applies as possible.
+
+Every apply restarts the router's firewall, which drops connections for everyone. Intents are gathered for
+BLOCK_QUEUE_WINDOW seconds after the first one comes in, resolved against the router's currently blocked macs into
+one desired set and sent as a single apply. Nothing is sent when the desired set is already what the router blocks.
+Every router that applies blocks has its own queue, see get_block_queue.
+"""
+import logging
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection
+
+from .asus_router import DEFAULT_ROUTER, AsusApi, get_block_router, get_router_configs
+from .models import Client
+from .router_cache import RouterSnapshotCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class BlockStateQueue:
+    """
+    Gathers block/unblock intents and applies them to the router once per window.
+    Each intent returns a Future that resolves to a dict of the blocked macs and whether the router was written to.
+    """
+
+    def __init__(self, router=DEFAULT_ROUTER, api=None, window=None):
+        """
+        :param router: the name of the router the blocks are applied on
+        :param api: a RouterSnapshotCache, a new one around router's AsusApi is made for each apply when not given
+        :param window: seconds to wait for more intents after the first one before applying
+        """
+        self.router = router
+        self.api = api
+        self.window = window if window is not None else getattr(settings, 'BLOCK_QUEUE_WINDOW', .5)
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+        self._intents = {}
+        self._unblock_all = False
+        self._futures = []
+        self._timer = None
+
+    def block(self, *macs):
+        return self._submit({mac: True for mac in macs})
+
+    def unblock(self, *macs):
+        return self._submit({mac: False for mac in macs})
+
+    def unblock_all(self):
+        """Unblocks every client, intents submitted after this in the same window still apply"""
+        return self._submit({}, unblock_all=True)
+
+    def flush(self):
+        """Applies the pending intents now. Waits for an apply already in progress first"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            intents, unblock_all, futures = self._intents, self._unblock_all, self._futures
+            self._intents, self._unblock_all, self._futures = {}, False, []
+        if not futures:
+            return
+        try:
+            with self._apply_lock:
+                result = self._apply(intents, unblock_all)
+        except Exception as e:
+            logger.exception(f'Failed to apply blocked clients: {e}')
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for future in futures:
+                future.set_result(result)
+
+    def _submit(self, intents, unblock_all=False):
+        future = Future()
+        with self._lock:
+            if unblock_all:
+                self._intents = {}
+                self._unblock_all = True
+            self._intents.update(intents)
+            self._futures.append(future)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def _apply(self, intents, unblock_all):
+        api = self.api if self.api is not None else RouterSnapshotCache(AsusApi.for_router(self.router))
+        # read fresh, the write below would revert blocks made since a cached snapshot, eg. on the router's page
+        currently_blocked = set(api.get_blocked_macs(max_age=0))
+        blocked = set() if unblock_all else set(currently_blocked)
+        for mac, is_blocked in intents.items():
+            if is_blocked:
+                blocked.add(mac)
+            else:
+                blocked.discard(mac)
+        applied = blocked != currently_blocked
+        if applied:
+            api.block_clients(sorted(blocked))
+        Client.objects.filter(pk__in=blocked, is_blocked=False).update(is_blocked=True)
+        # only clients on routers blocked via this one, the other routers' blocks are untouched
+        routers = [router for router in {DEFAULT_ROUTER, *get_router_configs()} if get_block_router(router) == self.router]
+        Client.objects.filter(is_blocked=True, router__in=routers).exclude(pk__in=blocked).update(is_blocked=False)
+        return {'blocked': sorted(blocked), 'applied': applied}
+
+
+_block_queues = {}
+_block_queues_lock = threading.Lock()
+
+
+def get_block_queue(router):
+    """Returns the process wide queue of router"""
+    with _block_queues_lock:
+        if router not in _block_queues:
+            _block_queues[router] = BlockStateQueue(router)
+        return _block_queues[router]
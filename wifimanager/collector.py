@@ -0,0 +1,281 @@
+import heapq
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from .asus_router import get_router_apis
+from .models import Client, ConnectionSample
+from .quotas import QuotaEngine, get_quota_rules
+from .router_jobs import fail_stale_jobs
+from .rollups import rollup_connection_samples
+from .router_cache import RouterSnapshotCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A collector job that runs func every interval seconds and keeps track of how long its runs take"""
+
+    def __init__(self, name, func, interval, max_durations=1000, thread=None):
+        """
+        :param thread: the name of the JobScheduler thread the job runs on, jobs without one run on the thread that
+                       called JobScheduler.run. Jobs on the same thread never overlap.
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.thread = thread
+        self.runs = 0
+        self.failures = 0
+        self.durations = deque(maxlen=max_durations)
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.func()
+        except Exception as e:
+            self.failures += 1
+            logger.exception(f'Job {self.name} failed: {e}')
+        finally:
+            self.runs += 1
+            self.durations.append(time.perf_counter() - start)
+
+    def get_stats(self):
+        """Returns run count, failures and min/mean/p95/max duration in milliseconds of the recent runs"""
+        durations = sorted(self.durations)
+        stats = {'name': self.name, 'runs': self.runs, 'failures': self.failures}
+        if durations:
+            stats.update({
+                'min_ms': durations[0] * 1000,
+                'mean_ms': sum(durations) / len(durations) * 1000,
+                'p95_ms': durations[min(len(durations) - 1, int(len(durations) * .95))] * 1000,
+                'max_ms': durations[-1] * 1000,
+            })
+        return stats
+
+
+class JobScheduler:
+    """
+    Runs each job on its own interval until stop_event is set.
+    Runs are scheduled from the job's previous scheduled time, not from when it finished, so timing doesn't drift.
+    When a job overruns, the missed runs are skipped rather than run back to back, and the other jobs on its thread
+    wait, so slow jobs like rollups get a thread of their own, see Job.
+    """
+
+    def __init__(self, jobs, stop_event=None, clock=time.monotonic):
+        self.jobs = jobs
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.clock = clock
+
+    def run(self):
+        """Runs the jobs until stop is called, the ones with a thread on a daemon thread per thread name"""
+        jobs_by_thread = {}
+        for job in self.jobs:
+            jobs_by_thread.setdefault(job.thread, []).append(job)
+        threads = []
+        for name, jobs in jobs_by_thread.items():
+            if name is not None:
+                thread = threading.Thread(target=self._run_in_thread, args=(jobs,), name=name, daemon=True)
+                thread.start()
+                threads.append(thread)
+        try:
+            self._run_jobs(jobs_by_thread.get(None, []))
+        finally:
+            if threads:
+                self.stop()
+            for thread in threads:
+                thread.join()
+
+    def _run_in_thread(self, jobs):
+        try:
+            self._run_jobs(jobs)
+        finally:
+            connection.close()
+
+    def _run_jobs(self, jobs):
+        if not jobs:
+            self.stop_event.wait()
+            return
+        now = self.clock()
+        queue = [(now, i, job) for i, job in enumerate(jobs)]
+        heapq.heapify(queue)
+        while queue and not self.stop_event.is_set():
+            next_run, i, job = queue[0]
+            wait = next_run - self.clock()
+            if wait > 0 and self.stop_event.wait(wait):
+                break
+            job.run()
+            now = self.clock()
+            next_run += job.interval
+            if next_run <= now:
+                next_run += math.ceil((now - next_run) / job.interval) * job.interval
+            heapq.heapreplace(queue, (next_run, i, job))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class RouterPollError(Exception):
+    """Raised once every router has been polled when some of them failed"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(', '.join(f'{router}: {error}' for router, error in errors.items()))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the process wide pool routers are polled with, bounded by ROUTER_POLL_WORKERS"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ROUTER_POLL_WORKERS', 8),
+                                               thread_name_prefix='router-poll')
+    return _executor
+
+
+def get_routers():
+    """Returns a RouterSnapshotCache for every configured router"""
+    return [RouterSnapshotCache(api) for api in get_router_apis()]
+
+
+def poll_routers(fetch, apis, executor=None):
+    """
+    Calls fetch(api) for every router in parallel so a poll takes as long as the slowest router, not their sum.
+    :return: a tuple of ({router: result}, {router: exception}), one failing router doesn't stop the others
+    """
+    if len(apis) == 1:
+        futures = {apis[0].router: _call(fetch, apis[0])}
+    else:
+        futures = submit_polls(fetch, apis, executor)
+    return get_poll_results(futures)
+
+
+def submit_polls(fetch, apis, executor=None):
+    """Starts fetch(api) for every router on executor and returns {router: Future}"""
+    executor = executor if executor is not None else get_executor()
+    return {api.router: executor.submit(fetch, api) for api in apis}
+
+
+def get_poll_results(futures):
+    """Waits for the {router: Future} of submit_polls, see poll_routers"""
+    results, errors = {}, {}
+    for router, future in futures.items():
+        try:
+            results[router] = future.result()
+        except Exception as e:
+            logger.warning(f'Polling router {router} failed: {e}')
+            errors[router] = e
+    return results, errors
+
+
+def _call(func, *args):
+    """Runs func now and returns its outcome as a finished Future"""
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def collect_connection_samples(apis, executor=None, quota_engine=None, spool=None):
+    """
+    Gets the connection info for current clients from every router and adds it to the db.
+    Always takes a new reading so the same snapshot is never stored twice.
+    :param apis: a RouterSnapshotCache for each router
+    :param quota_engine: a QuotaEngine the samples are fed to
+    :param spool: a SampleSpool to append the samples to instead of the db, a SpoolDrainer moves them to the db
+    :return: the new ConnectionSamples, none when they're spooled
+    """
+    results, errors = poll_routers(lambda api: api.get_client_connection_statuses(max_age=0), apis, executor)
+    new_samples = []
+    for router, asus_connection_samples in results.items():
+        if spool is not None:
+            spool.append(router, asus_connection_samples)
+        else:
+            new_samples += ConnectionSample.create_from_asus_samples(asus_connection_samples, router=router)
+        if quota_engine is not None:
+            quota_engine.observe(asus_connection_samples)
+    if errors:
+        raise RouterPollError(errors)
+    return new_samples
+
+
+def update_connected_clients(apis, executor=None, futures=None):
+    """
+    Gets the connected clients from every router and updates the db
+    :param apis: a RouterSnapshotCache for each router
+    :param futures: {router: Future} of the connected clients when they're already being fetched, see submit_polls
+    :return: the added and changed macs and the number of unchanged clients over all routers
+    """
+    if futures is not None:
+        results, errors = get_poll_results(futures)
+    else:
+        results, errors = poll_routers(lambda api: api.get_connected_clients(), apis, executor)
+    clients_diff = {'added': [], 'changed': [], 'unchanged': 0}
+    for router, asus_clients in results.items():
+        router_diff = Client.sync_from_asus_clients(asus_clients, router=router)
+        for key in clients_diff:
+            clients_diff[key] += router_diff[key]
+    if errors:
+        raise RouterPollError(errors)
+    return clients_diff
+
+
+def collect_samples_and_clients(apis, executor=None, quota_engine=None, spool=None):
+    """
+    Runs collect_connection_samples and update_connected_clients together. The connected clients are fetched on the
+    executor while the connection statuses are, so a cycle waits on the routers once rather than once per page.
+    :return: the new ConnectionSamples, see collect_connection_samples
+    """
+    clients_futures = submit_polls(lambda api: api.get_connected_clients(), apis, executor)
+    try:
+        return collect_connection_samples(apis, executor, quota_engine, spool)
+    finally:
+        update_connected_clients(apis, futures=clients_futures)
+
+
+def build_jobs(sample_interval=2, clients_interval=2, remove_old_interval=2, rollup_interval=60, apis=None,
+               groups_interval=60, spool=None):
+    """
+    :param apis: the AsusApis to poll, defaults to every router in ASUS_ROUTERS
+    :param groups_interval: seconds between reloads of the client groups quota rules apply to
+    :param spool: a SampleSpool samples are collected into, see collect_connection_samples
+    """
+    apis = [RouterSnapshotCache(api) for api in apis] if apis is not None else get_routers()
+    quota_rules = get_quota_rules()
+    quota_engine = QuotaEngine(quota_rules) if quota_rules else None
+    if quota_engine is not None:
+        quota_engine.restore_blocked()
+    if sample_interval == clients_interval:
+        jobs = [Job('collect_samples_and_clients',
+                    lambda: collect_samples_and_clients(apis, quota_engine=quota_engine, spool=spool), sample_interval)]
+    else:
+        jobs = [
+            Job('collect_connection_samples',
+                lambda: collect_connection_samples(apis, quota_engine=quota_engine, spool=spool), sample_interval),
+            Job('update_connected_clients', lambda: update_connected_clients(apis), clients_interval),
+        ]
+    jobs += [
+        # off the collection thread so a slow rollup or delete doesn't hold up sampling. Both roll up raw samples,
+        # so they share a thread rather than race each other
+        Job('remove_old_connection_samples', ConnectionSample.remove_old_samples, remove_old_interval,
+            thread='collector-maintenance'),
+        Job('rollup_connection_samples', rollup_connection_samples, rollup_interval, thread='collector-maintenance'),
+        Job('fail_stale_router_jobs', fail_stale_jobs, 60, thread='collector-maintenance'),
+    ]
+    if quota_engine is not None and any(rule.group for rule in quota_rules):
+        jobs.append(Job('load_quota_groups', quota_engine.load_groups, groups_interval))
+    return jobs
@@ -0,0 +1,68 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from ...collector import Job, JobScheduler, build_jobs
+from ...schedules import ScheduleRunner
+from ...spool import SampleSpool, SpoolDrainer
+
+
+class Command(BaseCommand):
+    help = ('Collects connection samples and connected clients from the router and stores them in the db. '
+            'Also applies the block schedules')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample-interval', type=float, default=2,
+                            help='seconds between connection sample collections, can be < 1')
+        parser.add_argument('--clients-interval', type=float, default=2,
+                            help='seconds between connected client updates')
+        parser.add_argument('--remove-old-interval', type=float, default=2,
+                            help='seconds between removing old connection samples')
+        parser.add_argument('--rollup-interval', type=float, default=60,
+                            help='seconds between rolling samples up into minute, hour and day buckets')
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help='seconds between job duration reports')
+
+    def handle(self, *args, **options):
+        spool = SampleSpool.from_settings()
+        jobs = build_jobs(options['sample_interval'], options['clients_interval'], options['remove_old_interval'],
+                          options['rollup_interval'], spool=spool)
+        drainer = SpoolDrainer(spool) if spool is not None else None
+        report_job = Job('report_stats', lambda: self.write_stats(jobs), options['stats_interval'])
+        scheduler = JobScheduler(jobs + [report_job])
+        schedule_runner = ScheduleRunner()
+
+        def stop(signum, frame):
+            self.stdout.write(f'Received signal {signum}, stopping...')
+            scheduler.stop()
+            schedule_runner.stop()
+            if drainer is not None:
+                drainer.stop()
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        self.stdout.write('Now collecting samples. Press ctrl-c to stop.')
+        schedule_runner.start_in_background()
+        drainer_thread = None
+        if drainer is not None:
+            self.stdout.write(f'Spooling samples to {spool.path}')
+            drainer_thread = drainer.start_in_background()
+        try:
+            scheduler.run()
+        finally:
+            if drainer_thread is not None:
+                # let a drain in progress finish before its spool is closed
+                drainer.stop()
+                drainer_thread.join()
+            if spool is not None:
+                spool.close()
+        self.write_stats(jobs)
+
+    def write_stats(self, jobs):
+        for job in jobs:
+            stats = job.get_stats()
+            if 'mean_ms' in stats:
+                self.stdout.write('{name}: runs={runs} failures={failures} min={min_ms:.1f}ms mean={mean_ms:.1f}ms '
+                                  'p95={p95_ms:.1f}ms max={max_ms:.1f}ms'.format(**stats))
+            else:
+                self.stdout.write('{name}: runs={runs} failures={failures}'.format(**stats))
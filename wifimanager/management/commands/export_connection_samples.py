@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+import datetime
+
+from ...archive import export_samples
+from ...models import ConnectionSample, ConnectionSampleRollup
+
+
+def parse_time(value):
+    """Parses a date or datetime argument into an aware datetime in the current time zone"""
+    time = parse_datetime(value)
+    if time is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError(f'{value} is not a date or datetime, eg. 2017-09-01 or 2017-09-01T12:00')
+        time = datetime.datetime.combine(date, datetime.time())
+    return timezone.make_aware(time) if timezone.is_naive(time) else time
+
+
+class Command(BaseCommand):
+    help = ('Exports a range of connection samples and their rollups to a compact columnar .npz archive, '
+            'see import_connection_samples to load it back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='path of the archive to write')
+        parser.add_argument('--start', type=parse_time, help='date or datetime of the first sample to export')
+        parser.add_argument('--end', type=parse_time, help='date or datetime to export samples up to, not included')
+        parser.add_argument('--router', help='only export the samples taken by this router, and the rollups of the '
+                                             'clients last seen on it')
+        parser.add_argument('--chunk-size', type=int, default=100000,
+                            help='samples or rollups read from the db and written at a time')
+
+    def handle(self, *args, **options):
+        samples = ConnectionSample.objects.all()
+        rollups = ConnectionSampleRollup.objects.all()
+        if options['start']:
+            samples = samples.filter(time_of_sample__gte=options['start'])
+            rollups = rollups.filter(bucket_start__gte=options['start'])
+        if options['end']:
+            samples = samples.filter(time_of_sample__lt=options['end'])
+            rollups = rollups.filter(bucket_start__lt=options['end'])
+        if options['router']:
+            samples = samples.filter(router=options['router'])
+            # rollups don't keep the router that took their samples
+            rollups = rollups.filter(client__router=options['router'])
+        num_samples, num_rollups = export_samples(samples, options['output'], options['chunk_size'], rollups)
+        self.stdout.write(f'Exported {num_samples} samples and {num_rollups} rollups to {options["output"]}')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...archive import import_samples
+
+
+class Command(BaseCommand):
+    help = 'Loads the connection samples and rollups of an archive written by export_connection_samples into the db'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', help='path of the archive to load')
+        parser.add_argument('--batch-size', type=int, default=5000, help='samples or rollups per insert')
+
+    def handle(self, *args, **options):
+        try:
+            num_samples, num_rollups = import_samples(options['archive'], options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not import {options["archive"]}: {e}')
+        self.stdout.write(f'Imported {num_samples} samples and {num_rollups} rollups from {options["archive"]}')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ... import partitions
+
+
+class Command(BaseCommand):
+    help = ('Converts the connection sample table to the time bucketed layout set by '
+            'CONNECTION_SAMPLE_PARTITION_MINUTES. Postgres 11+ only')
+
+    def handle(self, *args, **options):
+        bucket_size = partitions.get_configured_bucket_size()
+        if bucket_size is None:
+            raise CommandError('Set CONNECTION_SAMPLE_PARTITION_MINUTES in settings first')
+        if connection.vendor != 'postgresql':
+            raise CommandError('The partitioned layout requires postgres')
+        if partitions.is_partitioned():
+            partitions.ensure_partitions(bucket_size)
+            self.stdout.write('Connection samples are already partitioned, made sure upcoming buckets exist')
+            return
+        partitions.convert_to_partitioned(bucket_size)
+        self.stdout.write(f'Connection samples partitioned into {bucket_size} buckets. Restart the collector.')
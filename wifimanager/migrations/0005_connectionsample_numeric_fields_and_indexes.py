@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def to_numeric(apps, schema_editor):
+    ConnectionSample = apps.get_model('wifimanager', 'ConnectionSample')
+    for sample in ConnectionSample.objects.all().iterator():
+        seconds = 0
+        for part in sample.connection_time.split(':'):
+            seconds = seconds * 60 + int(part)
+        sample.rssi_dbm = int(sample.rssi.replace('dBm', ''))
+        sample.connection_seconds = seconds
+        sample.save(update_fields=['rssi_dbm', 'connection_seconds'])
+
+
+def to_text(apps, schema_editor):
+    ConnectionSample = apps.get_model('wifimanager', 'ConnectionSample')
+    for sample in ConnectionSample.objects.all().iterator():
+        minutes, seconds = divmod(sample.connection_seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        sample.rssi = f'{sample.rssi_dbm}dBm'
+        sample.connection_time = f'{hours:02}:{minutes:02}:{seconds:02}'
+        sample.save(update_fields=['rssi', 'connection_time'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0004_auto_20170808_1507'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='connectionsample',
+            name='rssi_dbm',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='connectionsample',
+            name='connection_seconds',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        # defaults let the old fields be added back when the migration is reversed
+        migrations.AlterField(
+            model_name='connectionsample',
+            name='rssi',
+            field=models.CharField(default='', max_length=15, verbose_name='signal strength'),
+        ),
+        migrations.AlterField(
+            model_name='connectionsample',
+            name='connection_time',
+            field=models.CharField(default='', max_length=15),
+        ),
+        migrations.RunPython(to_numeric, to_text),
+        migrations.RemoveField(
+            model_name='connectionsample',
+            name='rssi',
+        ),
+        migrations.RemoveField(
+            model_name='connectionsample',
+            name='connection_time',
+        ),
+        migrations.RenameField(
+            model_name='connectionsample',
+            old_name='rssi_dbm',
+            new_name='rssi',
+        ),
+        migrations.RenameField(
+            model_name='connectionsample',
+            old_name='connection_seconds',
+            new_name='connection_time',
+        ),
+        migrations.AlterField(
+            model_name='connectionsample',
+            name='rssi',
+            field=models.SmallIntegerField(help_text='dBm', verbose_name='signal strength'),
+        ),
+        migrations.AlterField(
+            model_name='connectionsample',
+            name='connection_time',
+            field=models.PositiveIntegerField(help_text='seconds the client has been connected'),
+        ),
+        migrations.AlterField(
+            model_name='connectionsample',
+            name='time_of_sample',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='connectionsample',
+            index=models.Index(fields=['client', 'time_of_sample'], name='sample_client_time_idx'),
+        ),
+    ]
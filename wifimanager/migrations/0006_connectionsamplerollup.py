@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0005_connectionsample_numeric_fields_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConnectionSampleRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(choices=[(60, '1 minute'), (3600, '1 hour'), (86400, '1 day')], help_text='bucket size in seconds')),
+                ('bucket_start', models.DateTimeField()),
+                ('sample_count', models.PositiveIntegerField()),
+                ('tx_min', models.FloatField()),
+                ('tx_avg', models.FloatField()),
+                ('tx_max', models.FloatField()),
+                ('tx_p95', models.FloatField()),
+                ('rx_min', models.FloatField()),
+                ('rx_avg', models.FloatField()),
+                ('rx_max', models.FloatField()),
+                ('rx_p95', models.FloatField()),
+                ('rssi_min', models.FloatField()),
+                ('rssi_avg', models.FloatField()),
+                ('rssi_max', models.FloatField()),
+                ('rssi_p95', models.FloatField()),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='wifimanager.Client')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='connectionsamplerollup',
+            index=models.Index(fields=['resolution', 'bucket_start'], name='rollup_resolution_start_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='connectionsamplerollup',
+            unique_together={('resolution', 'client', 'bucket_start')},
+        ),
+    ]
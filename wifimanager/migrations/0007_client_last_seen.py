@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def set_last_seen_from_samples(apps, schema_editor):
+    Client = apps.get_model('wifimanager', 'Client')
+    for client in Client.objects.annotate(latest_sample=Max('connectionsample__time_of_sample')).exclude(
+            latest_sample=None):
+        Client.objects.filter(pk=client.pk).update(last_seen=client.latest_sample)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0006_connectionsamplerollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='time of the latest connection sample from the client', null=True),
+        ),
+        migrations.RunPython(set_last_seen_from_samples, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0007_client_last_seen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouterJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('block', 'block'), ('unblock', 'unblock'), ('unblock_all', 'unblock all')], max_length=16)),
+                ('macs', models.TextField(blank=True, help_text='comma separated macs the action applies to')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('succeeded', 'succeeded'), ('failed', 'failed')], default='pending', max_length=16)),
+                ('result', models.TextField(blank=True, help_text='json result of the action')),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
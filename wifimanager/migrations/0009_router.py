@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0008_routerjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='router',
+            field=models.CharField(db_index=True, default='default', help_text='name of the router the client was last sampled on', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='connectionsample',
+            name='router',
+            field=models.CharField(default='default', help_text='name of the router that took the sample', max_length=64),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0009_router'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days', models.CharField(default='0123456', help_text='weekdays the client is blocked on, 0 is monday', max_length=7)),
+                ('start', models.TimeField()),
+                ('end', models.TimeField(help_text='an end before start blocks until end the next day')),
+                ('enabled', models.BooleanField(default=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='block_schedules', to='wifimanager.Client')),
+            ],
+        ),
+    ]
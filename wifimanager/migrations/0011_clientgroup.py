@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0010_blockschedule'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blockschedule',
+            name='client',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='block_schedules', to='wifimanager.Client'),
+        ),
+        migrations.CreateModel(
+            name='ClientGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('clients', models.ManyToManyField(blank=True, related_name='groups', to='wifimanager.Client')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='blockschedule',
+            name='group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='block_schedules', to='wifimanager.ClientGroup'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0011_clientgroup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpoolCheckpoint',
+            fields=[
+                ('spool', models.CharField(help_text='directory of the spool', max_length=255, primary_key=True, serialize=False)),
+                ('segment', models.PositiveIntegerField(default=0)),
+                ('offset', models.PositiveIntegerField(default=0, help_text='bytes into the segment')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='connectionsample',
+            name='time_of_sample',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0012_spoolcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockReason',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mac_addr', models.CharField(db_index=True, max_length=17)),
+                ('reason', models.CharField(choices=[('manual', 'manual'), ('schedule', 'schedule'), ('quota', 'quota')], max_length=16)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('mac_addr', 'reason')},
+            },
+        ),
+    ]
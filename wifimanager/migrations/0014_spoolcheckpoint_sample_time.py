@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wifimanager', '0013_blockreason'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spoolcheckpoint',
+            name='sample_time',
+            field=models.DateTimeField(blank=True, help_text='time of the newest sample drained', null=True),
+        ),
+    ]
@@ -1,7 +1,16 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Case, Value, When
 from django.utils import timezone
 
 import datetime
+import json
+
+from . import partitions
+from .asus_router import DEFAULT_ROUTER
+
+
+RAW_SAMPLE_MAX_AGE = datetime.timedelta(minutes=5)
 
 
 class Client(models.Model):
@@ -10,6 +19,15 @@ class Client(models.Model):
     name_alias = models.CharField(max_length=200, default='')
     ip_addr = models.CharField(max_length=15, default='')
     is_blocked = models.BooleanField(default=False)
+    last_seen = models.DateTimeField(null=True, blank=True, db_index=True,
+                                     help_text='time of the latest connection sample from the client')
+    router = models.CharField(max_length=64, default=DEFAULT_ROUTER, db_index=True,
+                              help_text='name of the router the client was last sampled on')
+
+    @property
+    def mac_addr_safe(self):
+        """The mac address with : replaced so it can be used as an html id"""
+        return self.mac_addr.replace(':', '_')
 
     def update_from_asus_client(self, asus_client):
         self.mac_addr = asus_client.mac_addr
@@ -24,12 +42,53 @@ class Client(models.Model):
                 self.is_blocked == asus_client.is_blocked)
 
     @classmethod
-    def get_currently_connnected_clients(cls):
-        connection_samples = ConnectionSample.objects.filter(time_of_sample__gt=timezone.now()-datetime.timedelta(minutes=4))
-        clients = [sample.client for sample in connection_samples.distinct('client')]
-        for client in clients:
-            client.mac_addr_safe = client.mac_addr.replace(':', '_')
-        return clients
+    def sync_from_asus_clients(cls, asus_clients, router=DEFAULT_ROUTER):
+        """
+        Reconciles the db with the clients reported by the router using a constant number of queries.
+        New clients are tagged with router, known clients keep the router they were last sampled on.
+        :return: a dict with the macs of the added and changed clients and the number of unchanged clients
+        """
+        asus_clients_by_mac = {asus_client.mac_addr: asus_client for asus_client in asus_clients}
+        new_clients = []
+        changed_clients = []
+        with transaction.atomic():
+            known_clients = cls.objects.in_bulk(list(asus_clients_by_mac))
+            for mac_addr, asus_client in asus_clients_by_mac.items():
+                client = known_clients.get(mac_addr)
+                if client is None:
+                    new_clients.append(cls(mac_addr=asus_client.mac_addr, name=asus_client.name,
+                                           ip_addr=asus_client.ip_addr, is_blocked=asus_client.is_blocked,
+                                           router=router))
+                elif not client.compare_to_asus_client(asus_client):
+                    client.update_from_asus_client(asus_client)
+                    changed_clients.append(client)
+            if new_clients:
+                cls.objects.bulk_create(new_clients)
+            if changed_clients:
+                cls.bulk_update_fields(changed_clients, ['name', 'ip_addr', 'is_blocked'])
+        return {
+            'added': [client.mac_addr for client in new_clients],
+            'changed': [client.mac_addr for client in changed_clients],
+            'unchanged': len(asus_clients_by_mac) - len(new_clients) - len(changed_clients),
+        }
+
+    @classmethod
+    def bulk_update_fields(cls, clients, fields):
+        """Saves fields of every client in a single UPDATE query"""
+        updates = {
+            field: Case(*[When(pk=client.pk, then=Value(getattr(client, field))) for client in clients],
+                        output_field=cls._meta.get_field(field))
+            for field in fields
+        }
+        cls.objects.filter(pk__in=[client.pk for client in clients]).update(**updates)
+
+    @classmethod
+    def get_currently_connnected_clients(cls, router=None):
+        """Clients with a connection sample in the last 4 minutes, only the ones on router if it's given"""
+        clients = cls.objects.filter(last_seen__gt=timezone.now()-datetime.timedelta(minutes=4))
+        if router:
+            clients = clients.filter(router=router)
+        return clients.order_by('mac_addr')
 
     def __str__(self):
         return f'{self.mac_addr} ({self.ip_addr})'
@@ -40,9 +99,240 @@ class ConnectionSample(models.Model):
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
     tx = models.FloatField()
     rx = models.FloatField()
-    rssi = models.CharField('signal strength', max_length=15)
-    connection_time = models.CharField(max_length=15)
-    time_of_sample = models.DateTimeField(auto_now_add=True)
+    rssi = models.SmallIntegerField('signal strength', help_text='dBm')
+    connection_time = models.PositiveIntegerField(help_text='seconds the client has been connected')
+    time_of_sample = models.DateTimeField(default=timezone.now, db_index=True)
+    router = models.CharField(max_length=64, default=DEFAULT_ROUTER,
+                              help_text='name of the router that took the sample')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', 'time_of_sample'], name='sample_client_time_idx'),
+        ]
+
+    @classmethod
+    def create_from_asus_samples(cls, asus_samples, router=DEFAULT_ROUTER):
+        """
+        Adds the asus_samples taken by router to the db in a single transaction using a constant number of queries.
+        Samples keep the time they were taken, so samples replayed from the spool land where they belong.
+        Clients that aren't in the db yet are added as well and every sampled client's last_seen and router are updated.
+        :return: the new ConnectionSample objects
+        """
+        macs = {asus_sample.mac_addr for asus_sample in asus_samples}
+        # samples of a page share their time, so each time is only converted once
+        sample_times = {sample_time: datetime.datetime.fromtimestamp(sample_time.timestamp(), datetime.timezone.utc)
+                        for sample_time in {asus_sample.sample_time for asus_sample in asus_samples}}
+        with transaction.atomic():
+            known_macs = set(Client.objects.filter(pk__in=macs).values_list('pk', flat=True))
+            new_clients = [Client(mac_addr=mac, router=router) for mac in macs - known_macs]
+            if new_clients:
+                Client.objects.bulk_create(new_clients)
+            new_samples = [
+                cls(client_id=asus_sample.mac_addr, tx=asus_sample.tx_rate, rx=asus_sample.rx_rate,
+                    rssi=asus_sample.rssi, connection_time=asus_sample.connection_time, router=router,
+                    time_of_sample=sample_times[asus_sample.sample_time])
+                for asus_sample in asus_samples
+            ]
+            cls.objects.bulk_create(new_samples)
+            last_seen = max(sample_times.values(), default=None)
+            Client.objects.filter(pk__in=macs).update(last_seen=last_seen, router=router)
+        return new_samples
+
+    @classmethod
+    def remove_old_samples(cls, max_age=RAW_SAMPLE_MAX_AGE):
+        """
+        Deletes samples older than max_age and returns the number removed.
+        Samples are rolled up into ConnectionSampleRollup first so no history is lost, samples that can't be rolled
+        up yet because older samples may still be in the sample spool are kept until they are.
+        With the partitioned layout whole buckets are dropped instead, see partitions.py
+        """
+        from .rollups import get_raw_rollup_end, rollup_raw_samples
+        now = timezone.now()
+        rollup_raw_samples(now)
+        cutoff = min(now - max_age, get_raw_rollup_end(now))
+        bucket_size = partitions.get_bucket_size()
+        if bucket_size is not None:
+            return partitions.remove_samples_before(cutoff, bucket_size)
+        deleted_samples = cls.objects.filter(time_of_sample__lt=cutoff).delete()
+        return deleted_samples[0]
 
     def __str__(self):
         return f'{self.client} (tx={self.tx} rx={self.rx} connection_time={self.connection_time})'
+
+
+class ConnectionSampleRollup(models.Model):
+    """Min/avg/max/p95 of a clients connection samples over a 1 minute, 1 hour or 1 day bucket"""
+    RESOLUTION_CHOICES = (
+        (60, '1 minute'),
+        (3600, '1 hour'),
+        (86400, '1 day'),
+    )
+
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    resolution = models.PositiveIntegerField(choices=RESOLUTION_CHOICES, help_text='bucket size in seconds')
+    bucket_start = models.DateTimeField()
+    sample_count = models.PositiveIntegerField()
+    tx_min = models.FloatField()
+    tx_avg = models.FloatField()
+    tx_max = models.FloatField()
+    tx_p95 = models.FloatField()
+    rx_min = models.FloatField()
+    rx_avg = models.FloatField()
+    rx_max = models.FloatField()
+    rx_p95 = models.FloatField()
+    rssi_min = models.FloatField()
+    rssi_avg = models.FloatField()
+    rssi_max = models.FloatField()
+    rssi_p95 = models.FloatField()
+
+    class Meta:
+        unique_together = ('resolution', 'client', 'bucket_start')
+        indexes = [
+            models.Index(fields=['resolution', 'bucket_start'], name='rollup_resolution_start_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.client_id} {self.get_resolution_display()} {self.bucket_start} (tx={self.tx_avg} rx={self.rx_avg})'
+
+
+class RouterJob(models.Model):
+    """A write to the router that runs in the background, see router_jobs"""
+    ACTION_CHOICES = (
+        ('block', 'block'),
+        ('unblock', 'unblock'),
+        ('unblock_all', 'unblock all'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'pending'),
+        ('succeeded', 'succeeded'),
+        ('failed', 'failed'),
+    )
+
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+    macs = models.TextField(blank=True, help_text='comma separated macs the action applies to')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='pending')
+    result = models.TextField(blank=True, help_text='json result of the action')
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def to_dict(self):
+        return {
+            'id': self.pk,
+            'action': self.action,
+            'macs': self.macs.split(',') if self.macs else [],
+            'status': self.status,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+    def __str__(self):
+        return f'{self.get_action_display()} {self.macs} ({self.status})'
+
+
+class BlockSchedule(models.Model):
+    """A weekly time range a client, or every client of a group, is blocked during, see schedules"""
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='block_schedules', null=True, blank=True)
+    group = models.ForeignKey('ClientGroup', on_delete=models.CASCADE, related_name='block_schedules', null=True,
+                              blank=True)
+    days = models.CharField(max_length=7, default='0123456', help_text='weekdays the client is blocked on, 0 is monday')
+    start = models.TimeField()
+    end = models.TimeField(help_text='an end before start blocks until end the next day')
+    enabled = models.BooleanField(default=True)
+
+    def clean(self):
+        if (self.client_id is None) == (self.group_id is None):
+            raise ValidationError('Set either a client or a group')
+        if not self.days or set(self.days) - set('0123456'):
+            raise ValidationError({'days': 'Use the digits 0 (monday) to 6 (sunday)'})
+
+    def get_windows(self, first_day, num_days):
+        """Yields the aware (start, end) datetimes the client is blocked in, of the windows starting from first_day"""
+        for i in range(num_days):
+            day = first_day + datetime.timedelta(days=i)
+            if str(day.weekday()) not in self.days:
+                continue
+            end_day = day + datetime.timedelta(days=1) if self.end <= self.start else day
+            yield (self._make_aware(datetime.datetime.combine(day, self.start)),
+                   self._make_aware(datetime.datetime.combine(end_day, self.end)))
+
+    @staticmethod
+    def _make_aware(time):
+        """
+        Localizes a wall clock time on a day the clocks change too: a time skipped when they spring forward is taken
+        as the hour after it, a time repeated when they fall back as its second occurrence
+        """
+        return timezone.localtime(timezone.make_aware(time, is_dst=False))
+
+    def is_active_at(self, time):
+        # a window that started yesterday can still be running
+        day = timezone.localtime(time).date() - datetime.timedelta(days=1)
+        return any(start <= time < end for start, end in self.get_windows(day, 2))
+
+    def get_next_transition(self, after):
+        """Returns the first time after after that the schedule starts or stops blocking"""
+        day = timezone.localtime(after).date() - datetime.timedelta(days=1)
+        return min((time for window in self.get_windows(day, 9) for time in window if time > after), default=None)
+
+    def get_macs(self, memberships):
+        """:param memberships: {group name: macs}, see ClientGroup.get_memberships"""
+        if self.group_id is not None:
+            return memberships.get(self.group.name, set())
+        return {self.client_id}
+
+    def __str__(self):
+        return f'{self.group or self.client_id} blocked {self.start}-{self.end} on {self.days}'
+
+
+class ClientGroup(models.Model):
+    """A named set of clients, eg. kids' devices, that are blocked and unblocked together"""
+    name = models.CharField(max_length=200, unique=True)
+    clients = models.ManyToManyField(Client, related_name='groups', blank=True)
+
+    @classmethod
+    def get_client_routers(cls, group_id):
+        """Returns {mac: router} of the group's clients in one query, without loading the group"""
+        return dict(Client.objects.filter(groups=group_id).values_list('mac_addr', 'router'))
+
+    @classmethod
+    def get_memberships(cls):
+        """Returns {group name: set of macs} of every group in one query"""
+        memberships = {}
+        for name, mac in cls.clients.through.objects.values_list('clientgroup__name', 'client_id'):
+            memberships.setdefault(name, set()).add(mac)
+        return memberships
+
+    def __str__(self):
+        return self.name
+
+
+class SpoolCheckpoint(models.Model):
+    """How far a sample spool has been drained into the db. Saved in the same transaction as the drained samples"""
+    spool = models.CharField(max_length=255, primary_key=True, help_text='directory of the spool')
+    segment = models.PositiveIntegerField(default=0)
+    offset = models.PositiveIntegerField(default=0, help_text='bytes into the segment')
+    sample_time = models.DateTimeField(null=True, blank=True, help_text='time of the newest sample drained')
+
+    def __str__(self):
+        return f'{self.spool} at {self.segment}:{self.offset}'
+
+
+class BlockReason(models.Model):
+    """Why a client is blocked. A client is only unblocked by a schedule or quota once no other reason is left"""
+    REASON_CHOICES = (
+        ('manual', 'manual'),
+        ('schedule', 'schedule'),
+        ('quota', 'quota'),
+    )
+
+    mac_addr = models.CharField(max_length=17, db_index=True)
+    reason = models.CharField(max_length=16, choices=REASON_CHOICES)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('mac_addr', 'reason')
+
+    def __str__(self):
+        return f'{self.mac_addr} blocked by {self.get_reason_display()}'
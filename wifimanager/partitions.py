@@ -0,0 +1,147 @@
+"""
+Optional time bucketed layout for the ConnectionSample table. Postgres 11+ only.
+
+When CONNECTION_SAMPLE_PARTITION_MINUTES is set, the table is range partitioned on time_of_sample into buckets
+of that many minutes, so removing old samples drops whole buckets instead of deleting them row by row.
+The table is converted once with: python manage.py partition_connection_samples
+Restart the collector after converting so it picks up the new layout.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+PARTITIONS_AHEAD = 2
+
+_latest_bucket_created = None
+_is_partitioned = None
+
+
+def get_configured_bucket_size():
+    minutes = getattr(settings, 'CONNECTION_SAMPLE_PARTITION_MINUTES', None)
+    return datetime.timedelta(minutes=int(minutes)) if minutes else None
+
+
+def get_bucket_size():
+    """Returns the bucket size as a timedelta or None when the table doesn't use the partitioned layout"""
+    global _is_partitioned
+    bucket_size = get_configured_bucket_size()
+    if bucket_size is None or connection.vendor != 'postgresql':
+        return None
+    if _is_partitioned is None:
+        _is_partitioned = is_partitioned()
+    return bucket_size if _is_partitioned else None
+
+
+def get_table_name():
+    from .models import ConnectionSample
+    return ConnectionSample._meta.db_table
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [get_table_name()])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def get_bucket_start(time, bucket_size):
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return epoch + (time - epoch) // bucket_size * bucket_size
+
+
+def get_partition_name(bucket_start):
+    return f'{get_table_name()}_p{bucket_start:%Y%m%d_%H%M}'
+
+
+def create_partitions(start, end, bucket_size):
+    """Creates the bucket partitions covering start through end if they don't exist yet"""
+    table = connection.ops.quote_name(get_table_name())
+    bucket_start = get_bucket_start(start, bucket_size)
+    with connection.cursor() as cursor:
+        while bucket_start <= end:
+            partition = connection.ops.quote_name(get_partition_name(bucket_start))
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+                [bucket_start, bucket_start + bucket_size]
+            )
+            bucket_start += bucket_size
+
+
+def ensure_partitions(bucket_size, now=None):
+    """Makes sure the current and the next few buckets exist. Only issues ddl when a new bucket is needed"""
+    global _latest_bucket_created
+    now = now if now is not None else timezone.now()
+    latest_needed = get_bucket_start(now, bucket_size) + PARTITIONS_AHEAD * bucket_size
+    if _latest_bucket_created is None or _latest_bucket_created < latest_needed:
+        create_partitions(now, latest_needed, bucket_size)
+        _latest_bucket_created = latest_needed
+
+
+def remove_samples_before(cutoff, bucket_size):
+    """
+    Drops the buckets that end before cutoff and deletes the older rows left in the bucket straddling it.
+    :return: the number of samples removed, estimated from table stats for the dropped buckets
+    """
+    table = get_table_name()
+    removed = 0
+    ensure_partitions(bucket_size)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname, child.reltuples FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = %s", [table]
+        )
+        for partition, estimated_rows in cursor.fetchall():
+            try:
+                bucket_start = datetime.datetime.strptime(partition, f'{table}_p%Y%m%d_%H%M').replace(
+                    tzinfo=datetime.timezone.utc)
+            except ValueError:
+                continue
+            if bucket_start + bucket_size <= cutoff:
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(partition)}')
+                removed += max(int(estimated_rows), 0)
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(table)} WHERE time_of_sample < %s', [cutoff])
+        removed += cursor.rowcount
+    return removed
+
+
+def convert_to_partitioned(bucket_size):
+    """
+    Rebuilds the ConnectionSample table as a range partitioned table and copies the existing samples over.
+    The primary key becomes (id, time_of_sample) since postgres requires the partition key in it.
+    """
+    from .models import ConnectionSample
+    table = get_table_name()
+    old_table = f'{table}_unpartitioned'
+    quote = connection.ops.quote_name
+    client_table = ConnectionSample._meta.get_field('client').related_model._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT min(time_of_sample) FROM {quote(table)}')
+        oldest = cursor.fetchone()[0]
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        id_sequence = cursor.fetchone()[0]
+        cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old_table)}')
+        cursor.execute(
+            f'CREATE TABLE {quote(table)} (LIKE {quote(old_table)} INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (time_of_sample)'
+        )
+        cursor.execute(f'ALTER SEQUENCE {id_sequence} OWNED BY {quote(table)}.id')
+        now = timezone.now()
+        create_partitions(oldest or now, now + PARTITIONS_AHEAD * bucket_size, bucket_size)
+        cursor.execute(f'CREATE TABLE {quote(table + "_default")} PARTITION OF {quote(table)} DEFAULT')
+        cursor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(old_table)}')
+        cursor.execute(f'DROP TABLE {quote(old_table)}')
+        cursor.execute(f'ALTER TABLE {quote(table)} ADD PRIMARY KEY (id, time_of_sample)')
+        cursor.execute(
+            f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(table + "_client_id_fk")} '
+            f'FOREIGN KEY (client_id) REFERENCES {quote(client_table)} (mac_addr) DEFERRABLE INITIALLY DEFERRED'
+        )
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for index in ConnectionSample._meta.indexes:
+                schema_editor.add_index(ConnectionSample, index)
+            for field in ConnectionSample._meta.local_fields:
+                if field.db_index and not field.unique:
+                    schema_editor.execute(schema_editor._create_index_sql(ConnectionSample, [field]))
@@ -0,0 +1,175 @@
+"""
+Blocks clients automatically when their throughput stays over a quota.
+
+The collector feeds every batch of connection samples to a QuotaEngine, which keeps a time weighted moving average
+of each client's rate per rule, updated in constant time per sample without touching the db. A client is blocked
+when any rule's average goes over its LIMIT. It's only unblocked once it has been blocked for QUOTA_MIN_BLOCK_SECONDS
+and every average, decayed as if the client sent nothing while blocked, is back under the rule's RELEASE, so clients
+near a limit don't flap between blocked and unblocked. Blocks and unblocks are submitted as router jobs.
+
+Blocks are submitted with the quota reason, so an unblock leaves clients that are also blocked by hand or by a
+schedule alone, see router_jobs. The averages are kept in memory, after a restart restore_blocked picks the clients
+the engine had blocked back up from their BlockReasons and they're unblocked once they've been blocked long enough.
+"""
+import functools
+import logging
+import math
+
+from django.conf import settings
+
+from . import router_jobs
+from .analytics import MAX_SAMPLE_GAP
+from .models import BlockReason, ClientGroup
+
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaRule:
+    """Block a client when its average metric ('tx' or 'rx' in Mbps) over window seconds is above limit"""
+
+    def __init__(self, metric, window, limit, release=None, group=None):
+        """
+        :param release: the average the client has to drop under to be unblocked, 80% of limit by default
+        :param group: the name of the ClientGroup the rule applies to, every client when None
+        """
+        if metric not in ('tx', 'rx'):
+            raise ValueError(f'Unknown quota metric {metric}, expected tx or rx')
+        self.metric = metric
+        self.window = window
+        self.limit = limit
+        self.release = release if release is not None else limit * .8
+        self.group = group
+
+    @classmethod
+    def from_setting(cls, rule):
+        return cls(rule['METRIC'], rule['WINDOW'], rule['LIMIT'], rule.get('RELEASE'), rule.get('GROUP'))
+
+    def __repr__(self):
+        return (f'QuotaRule({self.metric!r}, window={self.window}, limit={self.limit}, release={self.release}, '
+                f'group={self.group!r})')
+
+
+def get_quota_rules():
+    """Returns the QUOTA_RULES from conf.settings as QuotaRules"""
+    return [QuotaRule.from_setting(rule) for rule in getattr(settings, 'QUOTA_RULES', [])]
+
+
+class RateAverage:
+    """
+    Exponentially weighted moving average of a rate sampled at irregular times.
+    Each rate is assumed to have lasted since the previous sample and is weighted by that time over window, so the
+    average reads the same whatever the sample interval. It starts at 0, a new client has to keep up a rate.
+    A rate lasts max_gap seconds at most, the rest of a longer gap, eg. while the client was disconnected or blocked,
+    counts as 0 so one sample after coming back can't push the average over a limit.
+    """
+    __slots__ = ('window', 'max_gap', 'value', 'time')
+
+    def __init__(self, window, time, max_gap=MAX_SAMPLE_GAP):
+        self.window = window
+        self.max_gap = max_gap
+        self.value = 0.
+        self.time = time
+
+    def update(self, rate, time):
+        if time <= self.time:
+            return
+        gap = time - self.time
+        self.value = (math.exp(-gap / self.window) * self.value
+                      + (1 - math.exp(-min(gap, self.max_gap) / self.window)) * rate)
+        self.time = time
+
+    def get_decayed(self, time):
+        """The average at time if nothing was sent since the last sample"""
+        return self.value * math.exp(min(self.time - time, 0) / self.window)
+
+
+class QuotaEngine:
+    """
+    Keeps each client's moving averages and decides who to block and unblock, see the module docstring.
+    Memory is a RateAverage per client and rule, observing a batch costs O(samples + blocked clients).
+    """
+
+    def __init__(self, rules=None, min_block_seconds=None,
+                 submit=functools.partial(router_jobs.submit, reason='quota')):
+        """
+        :param rules: QuotaRules, defaults to QUOTA_RULES
+        :param min_block_seconds: seconds a client stays blocked at least, defaults to QUOTA_MIN_BLOCK_SECONDS
+        :param submit: called with ('block' or 'unblock', macs) to apply decisions
+        """
+        self.rules = rules if rules is not None else get_quota_rules()
+        if min_block_seconds is None:
+            min_block_seconds = getattr(settings, 'QUOTA_MIN_BLOCK_SECONDS', 300)
+        self.min_block_seconds = min_block_seconds
+        self.submit = submit
+        self._averages = {}
+        self._blocked = {}
+        self._memberships = {}
+        if any(rule.group for rule in self.rules):
+            self.load_groups()
+
+    def load_groups(self):
+        """Reloads the members of the groups the rules apply to, in one query"""
+        self._memberships = ClientGroup.get_memberships()
+
+    def restore_blocked(self):
+        """Picks up the clients blocked for a quota before a restart, in one query"""
+        for mac, created in BlockReason.objects.filter(reason='quota').values_list('mac_addr', 'created'):
+            self._blocked.setdefault(mac, created.timestamp())
+
+    def observe(self, samples):
+        """
+        Updates the averages with a batch of ClientConnectionSamples and applies any block decisions.
+        :return: {'block': macs, 'unblock': macs} decided on this batch
+        """
+        if not samples or not self.rules:
+            return {'block': [], 'unblock': []}
+        to_block = []
+        for sample in samples:
+            time = sample.sample_time.timestamp()
+            averages = self._averages.get(sample.mac_addr)
+            if averages is None:
+                averages = self._averages[sample.mac_addr] = [RateAverage(rule.window, time) for rule in self.rules]
+            for rule, average in zip(self.rules, averages):
+                average.update(sample.tx_rate if rule.metric == 'tx' else sample.rx_rate, time)
+            if sample.mac_addr not in self._blocked and self._is_over_limit(sample.mac_addr, averages):
+                to_block.append(sample.mac_addr)
+        now = max(sample.sample_time for sample in samples).timestamp()
+        # clients restored after a restart have no averages yet, they count as released
+        to_unblock = [mac for mac, blocked_at in self._blocked.items() if now - blocked_at >= self.min_block_seconds
+                      and self._is_released(mac, self._averages.get(mac, ()), now)]
+        for mac in to_block:
+            self._blocked[mac] = now
+        for mac in to_unblock:
+            del self._blocked[mac]
+        self._apply('block', to_block)
+        self._apply('unblock', to_unblock)
+        return {'block': to_block, 'unblock': to_unblock}
+
+    def get_averages(self, mac):
+        """Returns the client's current average for each rule, None if it hasn't been seen"""
+        averages = self._averages.get(mac)
+        return [average.value for average in averages] if averages is not None else None
+
+    def is_blocked(self, mac):
+        return mac in self._blocked
+
+    def _applies(self, rule, mac):
+        return rule.group is None or mac in self._memberships.get(rule.group, ())
+
+    def _is_over_limit(self, mac, averages):
+        return any(average.value > rule.limit for rule, average in zip(self.rules, averages)
+                   if self._applies(rule, mac))
+
+    def _is_released(self, mac, averages, now):
+        return all(average.get_decayed(now) < rule.release for rule, average in zip(self.rules, averages)
+                   if self._applies(rule, mac))
+
+    def _apply(self, action, macs):
+        if not macs:
+            return
+        logger.info(f'Quota {action} of {", ".join(macs)}')
+        try:
+            self.submit(action, macs)
+        except Exception as e:
+            logger.exception(f'Failed to submit quota {action} of {", ".join(macs)}: {e}')
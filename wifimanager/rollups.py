@@ -0,0 +1,209 @@
+"""
+Downsamples raw connection samples into per client 1 minute, 1 hour and 1 day rollups.
+
+Raw samples are rolled up into 1 minute buckets before they're removed, 1 minute buckets into 1 hour buckets and
+1 hour buckets into 1 day buckets. Only buckets that have ended are rolled up and each level picks up where it
+left off, so running it repeatedly is cheap. With a sample spool, buckets are only rolled up once the spool has been
+drained past them, see get_raw_rollup_end. The p95 of coarser buckets is approximated from the finer buckets' p95s.
+"""
+import datetime
+import math
+from itertools import groupby
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import RAW_SAMPLE_MAX_AGE, ConnectionSample, ConnectionSampleRollup
+from .partitions import get_bucket_start
+from .spool import get_drained_until
+
+
+RESOLUTIONS = tuple(resolution for resolution, _ in ConnectionSampleRollup.RESOLUTION_CHOICES)
+
+# resolution: days to keep, None keeps them forever
+DEFAULT_RETENTION_DAYS = {60: 7, 3600: 180, 86400: None}
+
+# get_connection_samples picks the coarsest resolution that still gives at least this many buckets over dt
+MIN_BUCKETS_PER_QUERY = 30
+
+METRICS = ('tx', 'rx', 'rssi')
+
+
+def percentile(sorted_values, pct):
+    """Nearest rank percentile of an already sorted list"""
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def choose_resolution(dt):
+    """
+    Picks the resolution to serve a query over the last dt with.
+    :return: the rollup resolution in seconds, or None when raw samples still cover dt
+    """
+    if dt <= RAW_SAMPLE_MAX_AGE:
+        return None
+    for resolution in reversed(RESOLUTIONS):
+        if dt.total_seconds() / resolution >= MIN_BUCKETS_PER_QUERY:
+            return resolution
+    return RESOLUTIONS[0]
+
+
+def rollup_connection_samples(now=None):
+    """Brings every rollup level up to date and removes rollups past their retention"""
+    now = now if now is not None else timezone.now()
+    rollup_raw_samples(now)
+    # coarser buckets only end once every minute in them has been rolled up
+    raw_rollup_end = get_raw_rollup_end(now)
+    for finer_resolution, resolution in zip(RESOLUTIONS, RESOLUTIONS[1:]):
+        rollup_finer_rollups(finer_resolution, resolution, raw_rollup_end)
+    remove_old_rollups(now)
+
+
+def get_raw_rollup_end(now):
+    """
+    Returns the time raw samples are rolled up until, the start of the current minute. With a sample spool it's the
+    start of the minute before the newest sample drained, since the samples still in the spool can be older than now
+    and batches of different routers can be drained slightly out of order.
+    """
+    bucket_size = datetime.timedelta(seconds=RESOLUTIONS[0])
+    end = get_bucket_start(now, bucket_size)
+    drained_until = get_drained_until()
+    if drained_until is not None:
+        end = min(end, get_bucket_start(drained_until, bucket_size) - bucket_size)
+    return end
+
+
+def rollup_raw_samples(now=None):
+    """Rolls the raw samples of every ended minute that hasn't been rolled up yet into 1 minute buckets"""
+    now = now if now is not None else timezone.now()
+    start, end = _get_pending_range(RESOLUTIONS[0], ConnectionSample.objects.all(), 'time_of_sample',
+                                    get_raw_rollup_end(now))
+    if start is None:
+        return 0
+    rollups = _build_raw_rollups(start, end)
+    ConnectionSampleRollup.objects.bulk_create(rollups)
+    return len(rollups)
+
+
+def rollup_finer_rollups(finer_resolution, resolution, now=None):
+    """Combines the ended finer_resolution buckets that haven't been rolled up yet into resolution buckets"""
+    now = now if now is not None else timezone.now()
+    finer_rollups = ConnectionSampleRollup.objects.filter(resolution=finer_resolution)
+    start, end = _get_pending_range(resolution, finer_rollups, 'bucket_start', now)
+    if start is None:
+        return 0
+    rollups = _build_finer_rollups(finer_resolution, resolution, start, end)
+    ConnectionSampleRollup.objects.bulk_create(rollups)
+    return len(rollups)
+
+
+def rollup_range(start, end):
+    """
+    Rolls up the raw samples between start and end into every level, eg. samples imported from an archive that are
+    older than what's been rolled up already. Buckets that are already rolled up are left alone, and so are the ones
+    the regular rollup hasn't reached yet, it picks those up itself.
+    :return: the number of rollups added
+    """
+    added = 0
+    for finer_resolution, resolution in zip((None,) + RESOLUTIONS, RESOLUTIONS):
+        bucket_size = datetime.timedelta(seconds=resolution)
+        rollups = ConnectionSampleRollup.objects.filter(resolution=resolution)
+        latest = rollups.aggregate(latest=Max('bucket_start'))['latest']
+        if latest is None:
+            break
+        range_start = get_bucket_start(start, bucket_size)
+        range_end = min(get_bucket_start(end, bucket_size) + bucket_size, latest + bucket_size)
+        if range_start >= range_end:
+            break
+        if finer_resolution is None:
+            new_rollups = _build_raw_rollups(range_start, range_end)
+        else:
+            new_rollups = _build_finer_rollups(finer_resolution, resolution, range_start, range_end)
+        rolled_up = set(rollups.filter(bucket_start__gte=range_start, bucket_start__lt=range_end)
+                        .values_list('client_id', 'bucket_start'))
+        new_rollups = [rollup for rollup in new_rollups if (rollup.client_id, rollup.bucket_start) not in rolled_up]
+        ConnectionSampleRollup.objects.bulk_create(new_rollups)
+        added += len(new_rollups)
+    return added
+
+
+def _build_raw_rollups(start, end):
+    """Returns the unsaved 1 minute rollups of the raw samples from start up to end"""
+    resolution = RESOLUTIONS[0]
+    samples = (ConnectionSample.objects
+               .filter(time_of_sample__gte=start, time_of_sample__lt=end)
+               .order_by('client_id', 'time_of_sample')
+               .values_list('client_id', 'time_of_sample', 'tx', 'rx', 'rssi'))
+    bucket_size = datetime.timedelta(seconds=resolution)
+    rollups = []
+    for client_id, client_samples in groupby(samples.iterator(), key=lambda sample: sample[0]):
+        bucket_starts = groupby(client_samples, key=lambda sample: get_bucket_start(sample[1], bucket_size))
+        for bucket_start, bucket_samples in bucket_starts:
+            bucket_samples = list(bucket_samples)
+            rollup = ConnectionSampleRollup(client_id=client_id, resolution=resolution, bucket_start=bucket_start,
+                                            sample_count=len(bucket_samples))
+            for i, metric in enumerate(METRICS, start=2):
+                values = sorted(sample[i] for sample in bucket_samples)
+                setattr(rollup, f'{metric}_min', values[0])
+                setattr(rollup, f'{metric}_avg', sum(values) / len(values))
+                setattr(rollup, f'{metric}_max', values[-1])
+                setattr(rollup, f'{metric}_p95', percentile(values, 95))
+            rollups.append(rollup)
+    return rollups
+
+
+def _build_finer_rollups(finer_resolution, resolution, start, end):
+    """Returns the unsaved resolution rollups combining the finer_resolution rollups from start up to end"""
+    finer_rollups = (ConnectionSampleRollup.objects
+                     .filter(resolution=finer_resolution, bucket_start__gte=start, bucket_start__lt=end)
+                     .order_by('client_id', 'bucket_start'))
+    bucket_size = datetime.timedelta(seconds=resolution)
+    rollups = []
+    for client_id, client_rollups in groupby(finer_rollups.iterator(), key=lambda rollup: rollup.client_id):
+        bucket_starts = groupby(client_rollups, key=lambda rollup: get_bucket_start(rollup.bucket_start, bucket_size))
+        for bucket_start, bucket_rollups in bucket_starts:
+            bucket_rollups = list(bucket_rollups)
+            sample_count = sum(rollup.sample_count for rollup in bucket_rollups)
+            rollup = ConnectionSampleRollup(client_id=client_id, resolution=resolution, bucket_start=bucket_start,
+                                            sample_count=sample_count)
+            for metric in METRICS:
+                setattr(rollup, f'{metric}_min', min(getattr(r, f'{metric}_min') for r in bucket_rollups))
+                setattr(rollup, f'{metric}_avg',
+                        sum(getattr(r, f'{metric}_avg') * r.sample_count for r in bucket_rollups) / sample_count)
+                setattr(rollup, f'{metric}_max', max(getattr(r, f'{metric}_max') for r in bucket_rollups))
+                p95s = sorted(getattr(r, f'{metric}_p95') for r in bucket_rollups)
+                setattr(rollup, f'{metric}_p95', percentile(p95s, 95))
+            rollups.append(rollup)
+    return rollups
+
+
+def remove_old_rollups(now=None):
+    now = now if now is not None else timezone.now()
+    retention_days = getattr(settings, 'CONNECTION_SAMPLE_ROLLUP_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    removed = 0
+    for resolution, days in retention_days.items():
+        if days is not None:
+            removed += ConnectionSampleRollup.objects.filter(
+                resolution=resolution, bucket_start__lt=now-datetime.timedelta(days=days)).delete()[0]
+    return removed
+
+
+def _get_pending_range(resolution, source, time_field, now):
+    """
+    Returns the (start, end) range of ended buckets at resolution that haven't been rolled up from source yet.
+    Returns (None, None) when there's nothing to roll up.
+    """
+    bucket_size = datetime.timedelta(seconds=resolution)
+    rollups = ConnectionSampleRollup.objects.filter(resolution=resolution)
+    latest = rollups.aggregate(latest=Max('bucket_start'))['latest']
+    if latest is not None:
+        start = latest + bucket_size
+    else:
+        oldest = source.aggregate(oldest=Min(time_field))['oldest']
+        if oldest is None:
+            return None, None
+        start = get_bucket_start(oldest, bucket_size)
+    end = get_bucket_start(now, bucket_size)
+    if start >= end:
+        return None, None
+    return start, end
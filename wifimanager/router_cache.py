@@ -0,0 +1,114 @@
+"""
+Shared snapshot cache of the router's connected clients, connection statuses and blocked macs.
+Each router has its own snapshots, keyed by the wrapped AsusApi's router name.
+
+Snapshots are kept in the django cache set by ROUTER_SNAPSHOT_CACHE for ROUTER_SNAPSHOT_TTL seconds.
+Concurrent requesters coalesce onto a single router request: threads in a process wait on a lock and processes
+wait on a lock key in the cache, so use a cache shared by every worker (memcached, redis or the db cache)
+when running several workers. Writes to the router must call invalidate.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'router_snapshot'
+
+
+class RouterSnapshotCache:
+    """Wraps an AsusApi and serves its reads from the cache. Has the same read methods as AsusApi"""
+
+    _local_locks = {}
+    _local_locks_lock = threading.Lock()
+
+    def __init__(self, api, ttl=None, cache=None, lock_timeout=None, wait_interval=.05):
+        self.api = api
+        self.router = api.router
+        self.ttl = ttl if ttl is not None else getattr(settings, 'ROUTER_SNAPSHOT_TTL', 1)
+        self.cache = cache if cache is not None else caches[getattr(settings, 'ROUTER_SNAPSHOT_CACHE', 'default')]
+        self.lock_timeout = lock_timeout if lock_timeout is not None else getattr(
+            settings, 'ROUTER_SNAPSHOT_LOCK_TIMEOUT', 15)
+        self.wait_interval = wait_interval
+
+    def get_connected_clients(self, max_age=None):
+        return self._get('connected_clients', self.api.get_connected_clients, max_age)
+
+    def get_client_connection_statuses(self, max_age=None):
+        return self._get('client_connection_statuses', self.api.get_client_connection_statuses, max_age)
+
+    def get_blocked_macs(self, max_age=None):
+        return self._get('blocked_macs', self.api.get_blocked_macs, max_age)
+
+    def login(self):
+        self.api.login()
+
+    def block_clients(self, client_macs):
+        try:
+            return self.api.block_clients(client_macs)
+        finally:
+            self.invalidate()
+
+    def unblock_all_clients(self):
+        return self.block_clients([])
+
+    def invalidate(self):
+        """Makes every cached snapshot stale, including ones being fetched right now"""
+        try:
+            self.cache.incr(self._get_key('generation'))
+        except ValueError:
+            self.cache.set(self._get_key('generation'), 1, None)
+
+    def _get(self, name, fetch, max_age=None):
+        """
+        Returns the cached snapshot of name or fetches it, coalescing with any fetch already in flight.
+        :param max_age: only use a snapshot fetched less than max_age seconds ago. 0 only accepts a snapshot
+                        fetched after this call started, so concurrent callers still share one router request.
+        """
+        not_before = time.time() - max_age if max_age is not None else 0
+        generation = self.cache.get(self._get_key('generation'), 0)
+        key = self._get_key(f'{name}:{generation}')
+        snapshot = self._get_fresh(key, not_before)
+        if snapshot is not None:
+            return snapshot
+        with self._get_local_lock(f'{self.router}:{name}'):
+            snapshot = self._get_fresh(key, not_before)
+            if snapshot is not None:
+                return snapshot
+            lock_key = self._get_key(f'{name}:lock')
+            lock_token = uuid.uuid4().hex
+            deadline = time.monotonic() + self.lock_timeout
+            while not self.cache.add(lock_key, lock_token, self.lock_timeout):
+                time.sleep(self.wait_interval)
+                snapshot = self._get_fresh(key, not_before)
+                if snapshot is not None:
+                    return snapshot
+                if time.monotonic() > deadline:
+                    logger.info(f'Gave up waiting on another worker fetching {name}')
+                    break
+            try:
+                snapshot = fetch()
+                self.cache.set(key, (time.time(), snapshot), self.ttl)
+            finally:
+                if self.cache.get(lock_key) == lock_token:
+                    self.cache.delete(lock_key)
+            return snapshot
+
+    def _get_fresh(self, key, not_before):
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] >= not_before:
+            return cached[1]
+        return None
+
+    @classmethod
+    def _get_local_lock(cls, name):
+        with cls._local_locks_lock:
+            return cls._local_locks.setdefault(name, threading.Lock())
+
+    def _get_key(self, name):
+        return f'{KEY_PREFIX}:{self.router}:{name}'
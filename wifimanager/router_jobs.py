@@ -0,0 +1,149 @@
+"""
+Runs router writes in the background so requests don't wait out the router's firewall restart.
+
+submit records a RouterJob and hands its action to the block queue of every router involved. The job row is updated
+when the applies finish, so its status can be polled from any worker.
+Set ROUTER_JOBS_SYNC to apply before submit returns, eg. in tests.
+Every block records why the client is blocked as a BlockReason: manual for the views and admin, schedule or quota for
+the schedule runner and quota engine. A schedule or quota unblock only removes its own reason and leaves clients that
+are still blocked for another one alone, while a manual unblock clears every reason.
+A job is only finished by the process that submitted it, so jobs still pending after ROUTER_JOB_TIMEOUT seconds are
+failed by fail_stale_jobs, their process must have stopped before the apply finished.
+"""
+import datetime
+import functools
+import json
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .asus_router import DEFAULT_ROUTER, get_block_router, get_router_configs
+from .block_queue import get_block_queue
+from .models import BlockReason, Client, RouterJob
+
+
+def submit(action, macs=(), client_routers=None, reason='manual'):
+    """
+    :param action: one of RouterJob.ACTION_CHOICES
+    :param macs: the macs to block or unblock, ignored by unblock_all
+    :param client_routers: {mac: router} of the clients when already known, saves looking them up
+    :param reason: one of BlockReason.REASON_CHOICES, see the module docstring
+    :return: the RouterJob, None when an unblock leaves every client blocked for another reason
+    """
+    macs = list(macs)
+    to_apply = update_block_reasons(action, macs, reason)
+    if macs and not to_apply:
+        return None
+    macs = to_apply
+    job = RouterJob.objects.create(action=action, macs=','.join(macs))
+    if action == 'unblock_all':
+        queues = [get_block_queue(router) for router in sorted({get_block_router(r) for r in get_router_configs()})]
+        futures = [queue.unblock_all() for queue in queues]
+    elif action in ('block', 'unblock'):
+        queues, futures = [], []
+        for router, router_macs in group_by_block_router(macs, client_routers).items():
+            queue = get_block_queue(router)
+            queues.append(queue)
+            futures.append(queue.block(*router_macs) if action == 'block' else queue.unblock(*router_macs))
+    else:
+        raise ValueError(f'Unknown router job action {action}')
+    combine(futures).add_done_callback(functools.partial(finish, job.pk))
+    if getattr(settings, 'ROUTER_JOBS_SYNC', False):
+        for queue in queues:
+            queue.flush()
+        job.refresh_from_db()
+    return job
+
+
+def update_block_reasons(action, macs, reason):
+    """
+    Records reason for a block or removes it for an unblock
+    :return: the macs to apply the action to
+    """
+    with transaction.atomic():
+        if action == 'unblock_all':
+            BlockReason.objects.all().delete()
+        elif action == 'block':
+            reasons = {}
+            for mac, mac_reason in BlockReason.objects.filter(mac_addr__in=macs).values_list('mac_addr', 'reason'):
+                reasons.setdefault(mac, set()).add(mac_reason)
+            added = [BlockReason(mac_addr=mac, reason=reason) for mac in macs if reason not in reasons.get(mac, ())]
+            if reason != 'manual':
+                # clients blocked by hand from the router, or before reasons were recorded, stay blocked afterwards
+                unexplained = [mac for mac in macs if mac not in reasons]
+                added += [BlockReason(mac_addr=mac, reason='manual') for mac in
+                          Client.objects.filter(pk__in=unexplained, is_blocked=True).values_list('pk', flat=True)]
+            BlockReason.objects.bulk_create(added)
+        elif action == 'unblock':
+            if reason == 'manual':
+                BlockReason.objects.filter(mac_addr__in=macs).delete()
+            else:
+                BlockReason.objects.filter(mac_addr__in=macs, reason=reason).delete()
+                still_blocked = set(BlockReason.objects.filter(mac_addr__in=macs).values_list('mac_addr', flat=True))
+                macs = [mac for mac in macs if mac not in still_blocked]
+    return macs
+
+
+def group_by_block_router(macs, client_routers=None):
+    """Returns {router: macs} of the router each client's blocks are applied on"""
+    if client_routers is None:
+        client_routers = dict(Client.objects.filter(pk__in=macs).values_list('mac_addr', 'router'))
+    macs_by_router = {}
+    for mac in macs:
+        macs_by_router.setdefault(get_block_router(client_routers.get(mac, DEFAULT_ROUTER)), []).append(mac)
+    return macs_by_router
+
+
+def combine(futures):
+    """Returns a Future of the merged block queue results of futures. It fails if any of them fails"""
+    combined = Future()
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    def done(future):
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            if remaining > 0:
+                return
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            combined.set_exception(errors[0])
+        else:
+            combined.set_result({
+                'blocked': sorted(mac for future in futures for mac in future.result()['blocked']),
+                'applied': any(future.result()['applied'] for future in futures),
+            })
+
+    if not futures:
+        combined.set_result({'blocked': [], 'applied': False})
+    for future in futures:
+        future.add_done_callback(done)
+    return combined
+
+
+def get_stale_cutoff():
+    """Jobs created before this and still pending won't finish"""
+    return timezone.now() - datetime.timedelta(seconds=getattr(settings, 'ROUTER_JOB_TIMEOUT', 60))
+
+
+def fail_stale_jobs():
+    """Fails the jobs still pending after ROUTER_JOB_TIMEOUT and returns how many there were"""
+    return RouterJob.objects.filter(status='pending', created__lt=get_stale_cutoff()).update(
+        status='failed', error='timed out, the process running the job may have restarted', finished=timezone.now())
+
+
+def finish(job_pk, future):
+    """Records the outcome of the job's future"""
+    try:
+        result = future.result()
+    except Exception as e:
+        RouterJob.objects.filter(pk=job_pk).update(status='failed', error=str(e) or type(e).__name__,
+                                                   finished=timezone.now())
+    else:
+        RouterJob.objects.filter(pk=job_pk).update(status='succeeded', result=json.dumps(result, cls=DjangoJSONEncoder),
+                                                   finished=timezone.now())
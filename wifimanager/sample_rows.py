@@ -0,0 +1,44 @@
+"""Column layouts and grouping of connection sample rows served to the dashboard"""
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+
+
+# response column: db column. The first column must be the client mac and the second the id
+RAW_SAMPLE_COLUMNS = OrderedDict([
+    ('client', 'client_id'),
+    ('id', 'id'),
+    ('time_of_sample', 'time_of_sample'),
+    ('tx', 'tx'),
+    ('rx', 'rx'),
+    ('rssi', 'rssi'),
+    ('connection_time', 'connection_time'),
+])
+
+# rollups use the same names for their averages as raw samples so they can be drawn the same way
+ROLLUP_SAMPLE_COLUMNS = OrderedDict([
+    ('client', 'client_id'),
+    ('id', 'id'),
+    ('time_of_sample', 'bucket_start'),
+    ('sample_count', 'sample_count'),
+    ('tx', 'tx_avg'),
+    ('rx', 'rx_avg'),
+    ('rssi', 'rssi_avg'),
+] + [(f'{metric}_{stat}', f'{metric}_{stat}') for metric in ('tx', 'rx', 'rssi') for stat in ('min', 'max', 'p95')])
+
+
+def group_rows(rows, columns):
+    """Groups rows ordered by client mac in one pass. Returns a dict of mac_addr_safe: [{column: value}...]"""
+    return {
+        mac.replace(':', '_'): [dict(zip(columns, row)) for row in mac_rows]
+        for mac, mac_rows in groupby(rows, key=itemgetter(0))
+    }
+
+
+def group_rows_columnar(rows, columns):
+    """Groups rows ordered by client mac in one pass. Returns a dict of mac_addr_safe: {column: [values...]}"""
+    client_columns = {}
+    for mac, mac_rows in groupby(rows, key=itemgetter(0)):
+        column_values = list(zip(*mac_rows))[1:]
+        client_columns[mac.replace(':', '_')] = dict(zip(columns[1:], map(list, column_values)))
+    return client_columns
@@ -0,0 +1,126 @@
+"""
+In-process pub/sub that pushes new connection samples to every open dashboard.
+
+The collector runs in its own process, so each web process runs one feeder thread while anyone is subscribed.
+The feeder reads the samples added since its cursor once per SAMPLE_STREAM_INTERVAL and publishes them as one
+batch that every subscriber gets. Db load stays the same no matter how many dashboards are open.
+Each open stream holds a worker thread, so run the app with a threaded or async worker when streaming.
+"""
+import json
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Max
+
+from .models import ConnectionSample
+from .sample_rows import RAW_SAMPLE_COLUMNS, group_rows_columnar
+
+
+logger = logging.getLogger(__name__)
+
+
+class SampleBatch:
+    """
+    New sample rows with ids in (since, cursor]. Each row ends with the router that took the sample.
+    The json payload is built once per router and shared by subscribers.
+    """
+
+    def __init__(self, since, cursor, rows):
+        self.since = since
+        self.cursor = cursor
+        self.rows = rows
+        self._payloads = {}
+
+    def get_payload(self, after=0, router=None):
+        """Returns the batch as json, leaving out rows with ids <= after and, if router is given, other routers' rows"""
+        if after <= self.since:
+            if router not in self._payloads:
+                self._payloads[router] = self._to_json(self._filter_rows(self.rows, router))
+            return self._payloads[router]
+        return self._to_json(self._filter_rows([row for row in self.rows if row[1] > after], router))
+
+    @staticmethod
+    def _filter_rows(rows, router):
+        return [row for row in rows if row[-1] == router] if router else rows
+
+    def _to_json(self, rows):
+        # the trailing router column has no name so it's left out of the columns
+        return json.dumps({
+            'cursor': self.cursor,
+            'client_samples': group_rows_columnar(rows, tuple(RAW_SAMPLE_COLUMNS)),
+        }, cls=DjangoJSONEncoder)
+
+
+class SampleBroker:
+    """Fans batches of new samples out to subscriber queues. Slow subscribers lose their oldest batches"""
+
+    def __init__(self, interval=None, max_queued_batches=10):
+        self.interval = interval if interval is not None else getattr(settings, 'SAMPLE_STREAM_INTERVAL', 1)
+        self.max_queued_batches = max_queued_batches
+        self.cursor = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._feeder_stop_event = None
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_queued_batches)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._feeder_stop_event is None:
+                # start from the newest sample now, before the subscriber reads its snapshot, so nothing is missed
+                self.cursor = ConnectionSample.objects.aggregate(cursor=Max('id'))['cursor'] or 0
+                self._feeder_stop_event = threading.Event()
+                threading.Thread(target=self._feed, args=(self._feeder_stop_event,), name='sample-stream-feeder',
+                                 daemon=True).start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers and self._feeder_stop_event is not None:
+                self._feeder_stop_event.set()
+                self._feeder_stop_event = None
+
+    def publish(self, batch):
+        """Hands batch to every subscriber, dropping it if it isn't newer than what was published before"""
+        with self._lock:
+            if self.cursor is not None and batch.cursor <= self.cursor:
+                return
+            self.cursor = batch.cursor
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(batch)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def poll(self):
+        """Reads the samples added since the last published batch and publishes them"""
+        rows = list(ConnectionSample.objects
+                    .filter(id__gt=self.cursor)
+                    .order_by('client_id', 'id')
+                    .values_list(*RAW_SAMPLE_COLUMNS.values(), 'router'))
+        if rows:
+            self.publish(SampleBatch(self.cursor, max(row[1] for row in rows), rows))
+
+    def _feed(self, stop_event):
+        try:
+            while not stop_event.wait(self.interval):
+                try:
+                    self.poll()
+                except Exception as e:
+                    logger.exception(f'Failed to read new connection samples: {e}')
+        finally:
+            connection.close()
+
+
+broker = SampleBroker()
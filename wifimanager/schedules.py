@@ -0,0 +1,122 @@
+"""
+Blocks clients and client groups during their BlockSchedules.
+
+The runner works out which clients the enabled schedules block right now and when the next schedule starts or ends,
+and sleeps until then instead of polling. At each transition every change is submitted at once as one block and one
+unblock router job, which the block queue applies to the router in a single firewall restart.
+Schedules edited from another process are picked up within BLOCK_SCHEDULE_RELOAD_INTERVAL seconds, call wake to
+pick them up right away.
+
+Blocks are submitted with the schedule reason, so an unblock leaves clients that are also blocked by hand or by a
+quota alone, see router_jobs. On start the runner picks the clients it had blocked back up from their BlockReasons,
+so the ones whose schedule ended while it was stopped are unblocked.
+The router's own per client daytime field isn't used since its format varies between firmwares, so schedules only
+apply while the runner is running.
+"""
+import functools
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from . import router_jobs
+from .models import BlockReason, BlockSchedule, ClientGroup
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_scheduled_macs(schedules, time, memberships):
+    """
+    Returns the macs of the clients blocked by schedules at time
+    :param memberships: {group name: macs} of the groups, see ClientGroup.get_memberships
+    """
+    return {mac for schedule in schedules if schedule.is_active_at(time) for mac in schedule.get_macs(memberships)}
+
+
+def get_next_transition(schedules, after):
+    """Returns the first time after after that any of schedules starts or stops blocking, None if they never do"""
+    return min(filter(None, (schedule.get_next_transition(after) for schedule in schedules)), default=None)
+
+
+class ScheduleRunner:
+    """Applies the enabled BlockSchedules at each of their transitions until stop is called"""
+
+    def __init__(self, stop_event=None, reload_interval=None,
+                 submit=functools.partial(router_jobs.submit, reason='schedule'), clock=timezone.now):
+        """
+        :param reload_interval: the most seconds to sleep before reloading the schedules
+        :param submit: called with ('block' or 'unblock', macs) to apply changes
+        """
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        if reload_interval is None:
+            reload_interval = getattr(settings, 'BLOCK_SCHEDULE_RELOAD_INTERVAL', 60)
+        self.reload_interval = reload_interval
+        self.submit = submit
+        self.clock = clock
+        self.blocked = set()
+        self._wake_event = threading.Event()
+
+    def run(self):
+        try:
+            self.restore_blocked()
+        except Exception as e:
+            logger.exception(f'Failed to restore the clients blocked by schedules: {e}')
+        while not self.stop_event.is_set():
+            try:
+                next_transition = self.apply()
+            except Exception as e:
+                logger.exception(f'Failed to apply block schedules: {e}')
+                next_transition = None
+            wait = self.reload_interval
+            if next_transition is not None:
+                wait = min(wait, (next_transition - self.clock()).total_seconds())
+            self._wake_event.wait(max(wait, 0))
+            self._wake_event.clear()
+
+    def restore_blocked(self):
+        """Picks up the clients blocked by schedules before a restart"""
+        self.blocked = set(BlockReason.objects.filter(reason='schedule').values_list('mac_addr', flat=True))
+
+    def apply(self):
+        """
+        Blocks and unblocks clients to match the schedules now
+        :return: when the schedules next change, None if they never do
+        """
+        now = self.clock()
+        # schedules saved without exactly one of client and group, eg. from the shell, are skipped
+        has_one_target = Q(client__isnull=True, group__isnull=False) | Q(client__isnull=False, group__isnull=True)
+        schedules = list(BlockSchedule.objects.filter(has_one_target, enabled=True).select_related('group'))
+        memberships = ClientGroup.get_memberships() if any(schedule.group_id for schedule in schedules) else {}
+        scheduled = get_scheduled_macs(schedules, now, memberships)
+        to_block, to_unblock = sorted(scheduled - self.blocked), sorted(self.blocked - scheduled)
+        for action, macs in (('block', to_block), ('unblock', to_unblock)):
+            if macs:
+                logger.info(f'Schedule {action} of {", ".join(macs)}')
+                self.submit(action, macs)
+        self.blocked = scheduled
+        return get_next_transition(schedules, now)
+
+    def wake(self):
+        """Reloads the schedules now, eg. after one was edited"""
+        self._wake_event.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self._wake_event.set()
+
+    def start_in_background(self):
+        """Runs the runner on a daemon thread and returns the thread"""
+
+        def run():
+            try:
+                self.run()
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run, name='block-schedules', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,277 @@
+"""
+Local append only spool of connection sample batches, so the collector keeps sampling while the db is slow or down.
+
+The collector appends each router's batch of samples to the spool instead of writing it to the db, and a
+SpoolDrainer thread moves them into the db in large transactions. The spool is a directory of segment files of
+SAMPLE_SPOOL_SEGMENT_SIZE bytes, memory mapped by the writer and rotated when full. Each record is its payload's
+length and crc32 followed by the payload, a length of 0 marks the end of what's been written. How far the spool has
+been drained is saved as a SpoolCheckpoint in the same transaction as the samples, so after a crash or restart
+everything not committed yet is replayed, and nothing twice. Drained segments are deleted.
+The checkpoint also keeps the time of the newest sample drained, samples still in the spool can be older than what's
+in the db, so rollups and retention only go up to a bucket before it, see rollups.get_raw_rollup_end.
+
+The writer always starts a new segment when it's opened, so a record torn by a crash is only ever at the end of a
+finished segment, where its bad crc ends the segment.
+"""
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .asus_router import ClientConnectionSample
+from .models import ConnectionSample, SpoolCheckpoint
+
+
+logger = logging.getLogger(__name__)
+
+# payload length, crc32 of the payload
+RECORD_HEADER = struct.Struct('<II')
+# router name length, number of samples
+BATCH_HEADER = struct.Struct('<HI')
+# mac, sample time as a unix timestamp, rssi, tx, rx, connection time
+SAMPLE = struct.Struct('<17sdhddI')
+
+SEGMENT_NAME_RE = re.compile(r'^(\d{10})\.spool$')
+
+
+def encode_batch(router, samples):
+    router_bytes = router.encode()
+    parts = [BATCH_HEADER.pack(len(router_bytes), len(samples)), router_bytes]
+    sample_times = {}
+    for sample in samples:
+        if sample.sample_time not in sample_times:
+            sample_times[sample.sample_time] = sample.sample_time.timestamp()
+        parts.append(SAMPLE.pack(sample.mac_addr.encode(), sample_times[sample.sample_time], sample.rssi,
+                                 sample.tx_rate, sample.rx_rate, sample.connection_time))
+    return b''.join(parts)
+
+
+def decode_batch(payload):
+    """Returns the (router, ClientConnectionSamples) of an encoded batch"""
+    router_length, num_samples = BATCH_HEADER.unpack_from(payload)
+    offset = BATCH_HEADER.size
+    router = payload[offset:offset + router_length].decode()
+    sample_times = {}
+    samples = []
+    for mac, timestamp, rssi, tx, rx, connection_time in SAMPLE.iter_unpack(payload[offset + router_length:]):
+        if timestamp not in sample_times:
+            sample_times[timestamp] = datetime.fromtimestamp(timestamp, timezone.utc)
+        samples.append(ClientConnectionSample(mac.rstrip(b'\0').decode(), rssi, tx, rx, connection_time,
+                                              sample_times[timestamp]))
+    if len(samples) != num_samples:
+        raise ValueError(f'Spooled batch has {len(samples)} samples, expected {num_samples}')
+    return router, samples
+
+
+def read_records(buffer, offset, max_records):
+    """
+    Reads up to max_records payloads from buffer starting at offset
+    :return: the payloads and the offset after the last one
+    """
+    payloads = []
+    while len(payloads) < max_records and offset + RECORD_HEADER.size <= len(buffer):
+        length, crc = RECORD_HEADER.unpack_from(buffer, offset)
+        start = offset + RECORD_HEADER.size
+        if length == 0 or start + length > len(buffer):
+            break
+        payload = bytes(buffer[start:start + length])
+        if zlib.crc32(payload) != crc:
+            break
+        payloads.append(payload)
+        offset = start + length
+    return payloads, offset
+
+
+def get_drained_until():
+    """
+    Returns the time of the newest sample drained from the SAMPLE_SPOOL_DIR spool, None when spooling is off or
+    nothing has been drained yet
+    """
+    path = getattr(settings, 'SAMPLE_SPOOL_DIR', None)
+    if not path:
+        return None
+    return SpoolCheckpoint.objects.filter(spool=os.path.abspath(path)).values_list('sample_time', flat=True).first()
+
+
+class SampleSpool:
+    """A spool directory, see the module docstring. Only one process should append to a spool at a time"""
+
+    def __init__(self, path, segment_size=None, fsync=None):
+        """
+        :param segment_size: bytes per segment file, defaults to SAMPLE_SPOOL_SEGMENT_SIZE
+        :param fsync: flush every batch to disk so it survives a power cut too, defaults to SAMPLE_SPOOL_FSYNC.
+                      Batches always survive the process crashing.
+        """
+        self.path = os.path.abspath(path)
+        self.segment_size = segment_size or getattr(settings, 'SAMPLE_SPOOL_SEGMENT_SIZE', 4 * 1024 * 1024)
+        self.fsync = fsync if fsync is not None else getattr(settings, 'SAMPLE_SPOOL_FSYNC', False)
+        self._lock = threading.Lock()
+        self._segment = None
+        self._mmap = None
+        self._offset = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def from_settings(cls):
+        """Returns the spool in SAMPLE_SPOOL_DIR, None when spooling isn't turned on"""
+        path = getattr(settings, 'SAMPLE_SPOOL_DIR', None)
+        return cls(path) if path else None
+
+    def append(self, router, samples):
+        """Appends a batch of router's ClientConnectionSamples"""
+        payload = encode_batch(router, samples)
+        record_size = RECORD_HEADER.size + len(payload)
+        with self._lock:
+            if self._mmap is None or self._offset + record_size > len(self._mmap):
+                self._open_next_segment(record_size)
+            start = self._offset + RECORD_HEADER.size
+            # the header goes in last so a reader never sees a length before its payload
+            self._mmap[start:start + len(payload)] = payload
+            self._mmap[self._offset:start] = RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+            self._offset = start + len(payload)
+            if self.fsync:
+                self._mmap.flush()
+
+    def read(self, position, max_batches):
+        """
+        Reads up to max_batches batches written after position
+        :param position: a (segment, offset) tuple
+        :return: a list of (router, samples) and the position after them
+        """
+        segment, offset = position
+        payloads = []
+        while len(payloads) < max_batches:
+            segments = self.get_segments()
+            if segment not in segments and segments and segments[-1] < segment:
+                logger.warning(f'Spool segment {segment} is gone, the spool was reset. Draining from {segments[0]}')
+                segment, offset = segments[0], 0
+            segment_payloads, offset = self._read_segment(segment, offset, max_batches - len(payloads))
+            payloads += segment_payloads
+            later_segments = [s for s in self.get_segments() if s > segment]
+            if len(payloads) >= max_batches or not later_segments:
+                break
+            # the writer only moves on once it's done with a segment, so everything in it can be read by now
+            segment_payloads, offset = self._read_segment(segment, offset, max_batches - len(payloads))
+            payloads += segment_payloads
+            if len(payloads) < max_batches:
+                segment, offset = later_segments[0], 0
+        return [decode_batch(payload) for payload in payloads], (segment, offset)
+
+    def get_segments(self):
+        """Returns the numbers of the segment files, in order"""
+        matches = (SEGMENT_NAME_RE.match(name) for name in os.listdir(self.path))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def remove_segments_before(self, segment):
+        """Deletes the segment files before segment once they've been drained"""
+        for old_segment in self.get_segments():
+            if old_segment >= segment:
+                break
+            os.remove(self._get_segment_path(old_segment))
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.flush()
+                self._mmap.close()
+                self._mmap = None
+
+    def _open_next_segment(self, min_size):
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+        segments = self.get_segments()
+        self._segment = segments[-1] + 1 if segments else 0
+        size = max(self.segment_size, min_size + RECORD_HEADER.size)
+        with open(self._get_segment_path(self._segment), 'w+b') as fh:
+            # a sparse file of zeros, every record is followed by a 0 length until the next one is written
+            fh.truncate(size)
+            self._mmap = mmap.mmap(fh.fileno(), size)
+        self._offset = 0
+
+    def _read_segment(self, segment, offset, max_records):
+        try:
+            with open(self._get_segment_path(segment), 'rb') as fh:
+                if os.fstat(fh.fileno()).st_size == 0:
+                    return [], offset
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    return read_records(buffer, offset, max_records)
+        except FileNotFoundError:
+            return [], offset
+
+    def _get_segment_path(self, segment):
+        return os.path.join(self.path, f'{segment:010d}.spool')
+
+
+class SpoolDrainer:
+    """Moves batches from a spool into the db until stop is called. Retries every interval while the db is down"""
+
+    def __init__(self, spool, stop_event=None, interval=None, max_batches=None):
+        """
+        :param interval: seconds to wait when the spool is empty or the db failed, defaults to SAMPLE_SPOOL_INTERVAL
+        :param max_batches: the most batches written in one transaction, defaults to SAMPLE_SPOOL_MAX_BATCHES
+        """
+        self.spool = spool
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.interval = interval if interval is not None else getattr(settings, 'SAMPLE_SPOOL_INTERVAL', 1)
+        self.max_batches = max_batches or getattr(settings, 'SAMPLE_SPOOL_MAX_BATCHES', 500)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                drained = self.drain()
+            except Exception as e:
+                logger.exception(f'Failed to drain the sample spool: {e}')
+                # the connection may be broken, a new one is made on the next query
+                connection.close()
+                drained = 0
+            if drained < self.max_batches:
+                self.stop_event.wait(self.interval)
+
+    def drain(self):
+        """Writes the next batches to the db in one transaction and returns how many were written"""
+        checkpoint, _ = SpoolCheckpoint.objects.get_or_create(spool=self.spool.path)
+        batches, (segment, offset) = self.spool.read((checkpoint.segment, checkpoint.offset), self.max_batches)
+        if batches:
+            samples_by_router = {}
+            for router, samples in batches:
+                samples_by_router.setdefault(router, []).extend(samples)
+            sample_time = checkpoint.sample_time
+            # batches of routers that had no clients are empty and leave the time where it was
+            newest = max((sample.sample_time.timestamp() for router, samples in batches for sample in samples),
+                         default=None)
+            if newest is not None:
+                newest = datetime.fromtimestamp(newest, timezone.utc)
+                sample_time = max(newest, sample_time) if sample_time is not None else newest
+            with transaction.atomic():
+                for router, samples in samples_by_router.items():
+                    ConnectionSample.create_from_asus_samples(samples, router=router)
+                SpoolCheckpoint.objects.filter(spool=self.spool.path).update(segment=segment, offset=offset,
+                                                                             sample_time=sample_time)
+        elif (segment, offset) != (checkpoint.segment, checkpoint.offset):
+            SpoolCheckpoint.objects.filter(spool=self.spool.path).update(segment=segment, offset=offset)
+        self.spool.remove_segments_before(segment)
+        return len(batches)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def start_in_background(self):
+        """Runs the drainer on a daemon thread and returns the thread"""
+
+        def run():
+            try:
+                self.run()
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run, name='sample-spool-drainer', daemon=True)
+        thread.start()
+        return thread
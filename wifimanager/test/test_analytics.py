@@ -0,0 +1,72 @@
+from django.core.urlresolvers import reverse
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+import datetime
+
+from ..analytics import SampleWindow, get_anomalies, get_top_talkers
+from ..models import Client, ConnectionSample
+from ..rollups import percentile
+
+
+class TestSampleWindow(SimpleTestCase):
+
+    def setUp(self):
+        # phone sampled every 2s with a weakening signal, laptop once
+        rx = [float(v) for v in range(1, 21)]
+        self.rows = [('AC:63:BE:B6:74:36', 1000.0, 5.0, 100.0, -50)]
+        self.rows += [('FC:C2:DE:53:BA:96', 1000.0 + i * 2, 1.0, rx[i], -40 - i) for i in range(20)]
+        self.stats = SampleWindow.from_rows(self.rows).get_client_stats()
+        self.rx = rx
+
+    def test_rate_stats_per_client(self):
+        phone = self.stats['FC:C2:DE:53:BA:96']
+        self.assertEqual(phone['sample_count'], 20)
+        self.assertAlmostEqual(phone['rx_mean'], sum(self.rx) / 20)
+        self.assertEqual(phone['rx_max'], 20)
+        self.assertEqual(phone['rx_p95'], percentile(self.rx, 95))
+        self.assertEqual(self.stats['AC:63:BE:B6:74:36']['rx_p95'], 100)
+
+    def test_transfer_estimated_from_rate_and_sample_gaps(self):
+        # every phone sample lasts the 2s until the next one, in Mbps / 8 = MB
+        self.assertAlmostEqual(self.stats['FC:C2:DE:53:BA:96']['rx_mb'], sum(self.rx) * 2 / 8)
+        self.assertAlmostEqual(self.stats['AC:63:BE:B6:74:36']['rx_mb'], 100 * 2 / 8)
+
+    def test_rssi_trend_in_dbm_per_minute(self):
+        self.assertAlmostEqual(self.stats['FC:C2:DE:53:BA:96']['rssi_trend'], -30)
+        self.assertEqual(self.stats['AC:63:BE:B6:74:36']['rssi_trend'], 0)
+
+    def test_top_talkers_and_anomalies(self):
+        client_stats = {f'mac{i}': {'tx_mb': 1.0 + i % 2, 'rx_mb': 10.0} for i in range(10)}
+        client_stats['hog'] = {'tx_mb': 1.0, 'rx_mb': 500.0}
+        self.assertEqual(get_top_talkers(client_stats, 2), ['hog', 'mac1'])
+        self.assertEqual(get_anomalies(client_stats), ['hog'])
+
+    def test_clients_carried_across_chunks(self):
+        self.assertEqual(SampleWindow.from_rows(self.rows, chunk_size=3).get_client_stats(), self.stats)
+
+    def test_empty_window(self):
+        self.assertEqual(SampleWindow.from_rows([]).get_client_stats(), {})
+
+
+class TestGetBandwidthAnalytics(TestCase):
+
+    def test_stats_keyed_by_safe_mac(self):
+        client = Client.objects.create(mac_addr='FC:C2:DE:53:BA:96', name='phone')
+        now = timezone.now()
+        for i in range(3):
+            sample = ConnectionSample.objects.create(client=client, tx=1, rx=8, rssi=-60, connection_time=i)
+            ConnectionSample.objects.filter(pk=sample.pk).update(
+                time_of_sample=now - datetime.timedelta(seconds=6 - i * 2))
+        res = self.client.get(reverse('wifimanager:get-bandwidth-analytics'), {'dt': 1})
+        data = res.json()
+        self.assertEqual(data['sample_count'], 3)
+        self.assertEqual(data['top_talkers'], ['FC_C2_DE_53_BA_96'])
+        stats = data['clients']['FC_C2_DE_53_BA_96']
+        self.assertEqual(stats['name'], 'phone')
+        self.assertAlmostEqual(stats['rx_mb'], 3 * 8 * 2 / 8, places=3)
+
+    def test_bad_query_values_rejected(self):
+        for params in ({'dt': 'soon'}, {'dt': 'inf'}, {'dt': -1}, {'top': 'ten'}, {'top': -1}):
+            res = self.client.get(reverse('wifimanager:get-bandwidth-analytics'), params)
+            self.assertEqual(res.status_code, 400, params)
@@ -0,0 +1,87 @@
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+import datetime
+import io
+import os
+import tempfile
+
+import numpy as np
+
+from ..archive import export_samples, import_samples
+from ..models import Client, ConnectionSample, ConnectionSampleRollup
+from ..rollups import rollup_connection_samples, rollup_raw_samples
+
+FIELDS = ('time_of_sample', 'client_id', 'router', 'tx', 'rx', 'rssi', 'connection_time')
+
+
+class TestArchive(TestCase):
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.path = os.path.join(archive_dir.name, 'samples.npz')
+        self.start = timezone.make_aware(datetime.datetime(2017, 9, 1, 12))
+        for i, mac in enumerate(('FC:C2:DE:53:BA:96', 'AC:63:BE:B6:74:36')):
+            client = Client.objects.create(mac_addr=mac)
+            for j in range(5):
+                ConnectionSample.objects.create(
+                    client=client, tx=121.5, rx=144.4 + j, rssi=-60 - i, connection_time=j,
+                    router='main' if i == 0 else 'node',
+                    time_of_sample=self.start + datetime.timedelta(seconds=j * 2, microseconds=i + 1))
+
+    def get_samples(self):
+        return list(ConnectionSample.objects.order_by('time_of_sample', 'id').values_list(*FIELDS))
+
+    def test_round_trip_in_chunks(self):
+        samples = self.get_samples()
+        self.assertEqual(export_samples(ConnectionSample.objects.all(), self.path, chunk_size=3), (10, 0))
+        ConnectionSample.objects.all().delete()
+        Client.objects.all().delete()
+        self.assertEqual(import_samples(self.path, batch_size=4), (10, 0))
+        self.assertEqual(self.get_samples(), samples)
+        self.assertEqual(Client.objects.count(), 2)
+
+    def test_rollups_round_trip(self):
+        rollup_connection_samples(now=self.start + datetime.timedelta(days=2))
+        fields = [field.name for field in ConnectionSampleRollup._meta.fields if field.name != 'id']
+        rollups = list(ConnectionSampleRollup.objects.order_by(*fields).values_list(*fields))
+        # a minute, hour and day of each client
+        self.assertEqual(len(rollups), 6)
+        self.assertEqual(export_samples(ConnectionSample.objects.none(), self.path, chunk_size=2,
+                                        rollups=ConnectionSampleRollup.objects.all()), (0, len(rollups)))
+        ConnectionSampleRollup.objects.all().delete()
+        Client.objects.all().delete()
+        self.assertEqual(import_samples(self.path), (0, len(rollups)))
+        self.assertEqual(list(ConnectionSampleRollup.objects.order_by(*fields).values_list(*fields)), rollups)
+        # rollups already in the db are kept
+        self.assertEqual(import_samples(self.path), (0, 0))
+
+    def test_samples_older_than_the_rollups_rolled_up_on_import(self):
+        export_samples(ConnectionSample.objects.all(), self.path)
+        ConnectionSample.objects.all().delete()
+        ConnectionSample.objects.create(client_id='FC:C2:DE:53:BA:96', tx=1, rx=1, rssi=-60, connection_time=1,
+                                        time_of_sample=self.start + datetime.timedelta(minutes=10))
+        rollup_raw_samples(now=self.start + datetime.timedelta(minutes=11))
+        self.assertEqual(import_samples(self.path), (10, 2))
+        self.assertEqual(list(ConnectionSampleRollup.objects.filter(bucket_start=self.start)
+                              .order_by('client_id').values_list('client_id', 'sample_count', 'rx_max')),
+                         [('AC:63:BE:B6:74:36', 5, 148.4), ('FC:C2:DE:53:BA:96', 5, 148.4)])
+
+    def test_readable_with_numpy(self):
+        export_samples(ConnectionSample.objects.all(), self.path, chunk_size=4)
+        with np.load(self.path) as archive:
+            self.assertEqual(archive['macs'].tolist(), ['FC:C2:DE:53:BA:96', 'AC:63:BE:B6:74:36'])
+            self.assertEqual(archive['chunk_000000/client'].tolist(), [0, 1, 0, 1])
+            self.assertEqual(archive['chunk_000002/rx'].tolist(), [148.4, 148.4])
+
+    def test_commands_export_a_range(self):
+        out = io.StringIO()
+        call_command('export_connection_samples', self.path, '--start', '2017-09-01T12:00:03',
+                     '--router', 'main', stdout=out)
+        self.assertIn('Exported 3 samples and 0 rollups', out.getvalue())
+        ConnectionSample.objects.all().delete()
+        call_command('import_connection_samples', self.path, stdout=out)
+        self.assertEqual(list(ConnectionSample.objects.values_list('connection_time', flat=True).order_by('id')),
+                         [2, 3, 4])
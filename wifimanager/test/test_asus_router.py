@@ -1,9 +1,13 @@
 from django.test import SimpleTestCase
 
 import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock, patch
 
-from ..asus_router import AsusApi, AsusToken, Client, ClientConnectionSample
+from ..asus_router import (AsusApi, AsusToken, Client, ClientConnectionSample, NotLoggedInError, TokenManager,
+                           build_session, get_session)
 
 
 class TestAsusToken(SimpleTestCase):
@@ -83,16 +87,99 @@ class TestAsusToken(SimpleTestCase):
         self.assertEqual(token, '1070711480134875637378320976216')
 
 
+class TestTokenManager(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        AsusToken('7860691732068997083136838469969')
+        self.token_manager = TokenManager(max_age=600, clock=lambda: self.now)
+        self.token_manager.issued_at = self.now
+        self.login = Mock(side_effect=lambda: AsusToken(f'token{self.login.call_count}'))
+
+    def test_token_read_from_file_once(self):
+        self.assertEqual(self.token_manager.token, '7860691732068997083136838469969')
+        AsusToken('1234abcd')
+        self.assertEqual(self.token_manager.get_token(self.login), '7860691732068997083136838469969')
+        self.login.assert_not_called()
+
+    def test_token_refreshed_once_past_max_age(self):
+        self.now += 599
+        self.token_manager.get_token(self.login)
+        self.login.assert_not_called()
+        self.now += 1
+        self.assertEqual(self.token_manager.get_token(self.login), 'token1')
+        self.assertEqual(self.token_manager.get_token(self.login), 'token1')
+        self.assertEqual(self.login.call_count, 1)
+
+    def test_concurrent_refreshes_share_one_login(self):
+        stale_token = self.token_manager.token
+        login_started = threading.Event()
+
+        def slow_login():
+            login_started.set()
+            time.sleep(.05)
+            return AsusToken('token1')
+        self.login.side_effect = slow_login
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.token_manager.refresh(self.login, stale_token)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.login.call_count, 1)
+        self.assertEqual(results, ['token1'] * 5)
+
+    def test_token_file_replaced_atomically(self):
+        replaced = []
+        real_replace = os.replace
+
+        def replace(src, dst):
+            with open(src) as fh:
+                replaced.append((os.path.basename(src), dst, fh.read()))
+            real_replace(src, dst)
+
+        with patch('wifimanager.asus_router.os.replace', side_effect=replace):
+            token = AsusToken('1234abcd')
+        (tmp_name, dst, content), = replaced
+        self.assertTrue(tmp_name.startswith('.asus_token'))
+        self.assertEqual(dst, token._get_token_full_path())
+        self.assertEqual(content, '1234abcd')
+        self.assertFalse([name for name in os.listdir(os.path.dirname(dst)) if name.startswith('.asus_token')])
+
+
 class TestAsusApi(SimpleTestCase):
 
     def setUp(self):
         self.test_token_str = '7860691732068997083136838469969'
         self.test_token = AsusToken(self.test_token_str)
+        self.token_manager = TokenManager()
+        patcher = patch('wifimanager.asus_router.get_token_manager', return_value=self.token_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.api = AsusApi()
 
     def test_asus_token_set_correctly_on_init(self):
         self.assertEqual(self.api.asus_token, self.test_token_str)
 
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_login_page_response_logs_in_and_retries(self, mock_get, mock_post):
+        login_page = Mock(content=b"<script>top.location.href='/Main_Login.asp';</script>")
+        mock_get.side_effect = [login_page, Mock(content=b"fromNetworkmapd = ''")]
+        mock_post.return_value.headers = {'Set-Cookie': 'asus_token=1070711480134875637378320976216; HttpOnly;'}
+        self.assertEqual(self.api.get_connected_clients(), [])
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(mock_get.call_args[1]['headers']['Cookie'], 'asus_token=1070711480134875637378320976216')
+
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
+    def test_login_page_after_login_raises(self, mock_get, mock_post):
+        mock_get.return_value.content = b"<script>top.location.href='/Main_Login.asp';</script>"
+        mock_post.return_value.headers = {'Set-Cookie': ''}
+        with self.assertRaises(NotLoggedInError):
+            self.api.get_connected_clients()
+
     def test_get_credentials_b64_encoded(self):
         api = AsusApi('bob', 'brown')
         self.assertEqual(api.get_credentials_b64_encoded(), b'Ym9iOmJyb3du')
@@ -102,14 +189,64 @@ class TestAsusApi(SimpleTestCase):
         self.assertEqual(api.username, 'boy')
         self.assertEqual(api.password, 'george')
 
-    @patch('requests.post')
+    def test_apis_share_process_session(self):
+        self.assertIs(AsusApi().session, AsusApi().session)
+        self.assertIs(AsusApi().session, get_session())
+
+    def test_session_passed_in_is_used(self):
+        session = build_session()
+        self.assertIs(AsusApi(session=session).session, session)
+
+    def test_build_session_pool_size_and_retries(self):
+        adapter = build_session(pool_size=8, retries=3).get_adapter('http://192.168.1.1/')
+        self.assertEqual(adapter._pool_maxsize, 8)
+        self.assertEqual(adapter.max_retries.total, 3)
+
+    def test_connections_reused_polling_several_hosts(self):
+        connections = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                connections.append(self.server.server_port)
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+        servers = [ThreadingHTTPServer(('127.0.0.1', 0), Handler) for i in range(2)]
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+        session = build_session(num_hosts=2)
+        self.addCleanup(session.close)
+        for i in range(10):
+            for server in servers:
+                session.get(f'http://127.0.0.1:{server.server_port}/')
+        self.assertEqual(sorted(connections), sorted(server.server_port for server in servers))
+
+    @patch('requests.Session.get')
+    def test_requests_sent_with_timeout(self, mock_get):
+        mock_get.return_value.content = b'fromNetworkmapd = \'\''
+        api = AsusApi(timeout=(1, 2))
+        api.get_connected_clients()
+        self.assertEqual(mock_get.call_args[1]['timeout'], (1, 2))
+
+    @patch('requests.Session.post')
     def test_login_invalid_credentials(self, mock_post):
         mock_post.return_value.headers = {'Set-Cookie': ''}
         api = AsusApi('boy', 'george123')
         api.login()
         self.assertEqual(api.asus_token, '')
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_login_valid_credentials(self, mock_post):
         """Requires that valid credentials are set either in config or env"""
         mock_post.return_value.headers = {'Set-Cookie': 'asus_token=1070711480134875637378320976216; HttpOnly;'}
@@ -181,21 +318,21 @@ class TestAsusApi(SimpleTestCase):
         ]
         self.assertListEqual(clients, expected)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_client_connection_statuses_multiple_clients(self, mock_get):
         with open('wifimanager/test/test_res/client_connection_statuses.html', 'rb') as fh:
             html_content = fh.read()
         mock_get.return_value.content = html_content
         api = AsusApi()
         expected = [
-            ClientConnectionSample('34:DE:1A:01:A1:E9', '-60dBm', '121.5', '6.5', '00:01:42'),
-            ClientConnectionSample('DC:0B:34:97:C8:69', '-69dBm', '26', '6.5', '00:06:00'),
-            ClientConnectionSample('FC:C2:DE:53:BA:96', '-65dBm', '1', '24', '01:24:12')
+            ClientConnectionSample('34:DE:1A:01:A1:E9', -60, 121.5, 6.5, 102),
+            ClientConnectionSample('DC:0B:34:97:C8:69', -69, 26.0, 6.5, 360),
+            ClientConnectionSample('FC:C2:DE:53:BA:96', -65, 1.0, 24.0, 5052)
         ]
         client_statuses = api.get_client_connection_statuses()
         self.assertListEqual(client_statuses, expected)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_client_connection_statuses_no_clients(self, mock_get):
         with open('wifimanager/test/test_res/client_connection_statuses_no_connections.html', 'rb') as fh:
             html_content = fh.read()
@@ -204,6 +341,57 @@ class TestAsusApi(SimpleTestCase):
         client_statuses = api.get_client_connection_statuses()
         self.assertListEqual(client_statuses, [])
 
+    def test_parse_client_connection_html_fast_matches_soup(self):
+        connections_html = (
+            '<html><body><textarea cols="63" readonly="readonly">Stations List\n'
+            'idx MAC               Associated Authorized    RSSI PSM  Tx rate  Rx rate Connect Time\n'
+            '34:DE:1A:01:A1:E9 Yes        Yes          -60dBm No   121.5M   6.5M 00:01:42\n'
+            '    DC:0B:34:97:C8:69\tYes Yes -69dBm No 26M 6.5M 00:06:00\n\n'
+            '</textarea></body></html>'
+        )
+        expected = [
+            ClientConnectionSample('34:DE:1A:01:A1:E9', -60, 121.5, 6.5, 102),
+            ClientConnectionSample('DC:0B:34:97:C8:69', -69, 26.0, 6.5, 360)
+        ]
+        self.assertListEqual(AsusApi.parse_client_connection_html_fast(connections_html), expected)
+        self.assertListEqual(AsusApi.parse_client_connection_html_soup(connections_html), expected)
+
+    def test_parse_client_connection_html_falls_back_to_soup(self):
+        connections_html = '<TEXTAREA>idx MAC\n34:DE:1A:01:A1:E9 Yes Yes -60dBm No 1M 2M 00:00:01</TEXTAREA>'
+        with self.assertRaises(ValueError):
+            AsusApi.parse_client_connection_html_fast(connections_html)
+        self.assertListEqual(AsusApi.parse_client_connection_html(connections_html),
+                             [ClientConnectionSample('34:DE:1A:01:A1:E9', -60, 1.0, 2.0, 1)])
+
+    @patch.object(AsusApi, 'parse_client_connection_html_soup')
+    def test_parse_client_connection_html_no_stations_list(self, mock_soup_parse):
+        with self.assertRaisesRegex(ValueError, 'stations list not found'):
+            AsusApi.parse_client_connection_html('<textarea>Stations List</textarea>')
+        self.assertFalse(mock_soup_parse.called)
+
+    def test_parse_client_connection_html_fast_unescapes_entities(self):
+        connections_html = '<textarea>SSID: &quot;boogie&quot;\nidx MAC\n34:DE:1A:01:A1:E9 Yes Yes -60dBm No 1M 2M 00:00:01</textarea>'
+        self.assertListEqual(AsusApi.parse_client_connection_html_fast(connections_html),
+                             [ClientConnectionSample('34:DE:1A:01:A1:E9', -60, 1.0, 2.0, 1)])
+
+    def test_client_connection_sample_numeric_fields(self):
+        sample = ClientConnectionSample.from_raw_sample_text('FC:C2:DE:53:BA:96 Yes Yes -65dBm No 1M 24M 01:24:12')
+        self.assertEqual((sample.rssi, sample.tx_rate, sample.rx_rate, sample.connection_time), (-65, 1.0, 24.0, 5052))
+
+    def test_samples_from_one_page_share_sample_time(self):
+        connections_html = ('<textarea>idx MAC\n34:DE:1A:01:A1:E9 Yes Yes -60dBm No 1M 2M 00:00:01\n'
+                            'DC:0B:34:97:C8:69 Yes Yes -69dBm No 26M 6.5M 00:06:00</textarea>')
+        first, second = AsusApi.parse_client_connection_html_fast(connections_html)
+        self.assertIs(first.sample_time, second.sample_time)
+
+    def test_records_hashable_by_value(self):
+        samples = {ClientConnectionSample('34:DE:1A:01:A1:E9', -60, 1.0, 2.0, 1),
+                   ClientConnectionSample('34:DE:1A:01:A1:E9', -60, 1.0, 2.0, 1)}
+        clients = {Client('phone', '34:DE:1A:01:A1:E9', '192.168.1.96', False),
+                   Client('phone', '34:DE:1A:01:A1:E9', '192.168.1.96', False)}
+        self.assertEqual((len(samples), len(clients)), (1, 1))
+        self.assertFalse(hasattr(next(iter(samples)), '__dict__'))
+
     def test_build_block_clientlist_str_no_clients(self):
         api = AsusApi()
         data = api.build_block_clients_data([])
@@ -230,4 +418,3 @@ class TestAsusApi(SimpleTestCase):
         self.assertEqual(data['MULTIFILTER_MAC'], 'FC:C2:DE:53:BA:96>AC:63:BE:B6:74:36>68:37:E9:1D:A7:CE')
         self.assertEqual(data['MULTIFILTER_MACFILTER_DAYTIME'], '<><><')
         self.assertEqual(data['custom_clientlist'], '<boogie>FC:C2:DE:53:BA:96>0>0>><boogie>AC:63:BE:B6:74:36>0>0>><boogie>68:37:E9:1D:A7:CE>0>0>>')
-
@@ -0,0 +1,66 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from unittest.mock import Mock
+
+from ..block_queue import BlockStateQueue
+from ..models import Client
+from ..router_cache import RouterSnapshotCache
+
+
+class TestBlockStateQueue(TestCase):
+
+    def setUp(self):
+        self.api = Mock()
+        self.api.get_blocked_macs.return_value = ['FC:C2:DE:53:BA:96']
+        self.queue = BlockStateQueue(api=self.api, window=3600)
+        for mac in ('FC:C2:DE:53:BA:96', 'AC:63:BE:B6:74:36', '68:37:E9:1D:A7:CE'):
+            Client.objects.create(mac_addr=mac, is_blocked=mac == 'FC:C2:DE:53:BA:96')
+
+    def test_burst_of_intents_applied_once(self):
+        futures = [
+            self.queue.block('AC:63:BE:B6:74:36'),
+            self.queue.block('68:37:E9:1D:A7:CE'),
+            self.queue.unblock('FC:C2:DE:53:BA:96'),
+            self.queue.unblock('68:37:E9:1D:A7:CE'),
+        ]
+        self.queue.flush()
+        self.api.block_clients.assert_called_once_with(['AC:63:BE:B6:74:36'])
+        for future in futures:
+            self.assertEqual(future.result(timeout=0), {'blocked': ['AC:63:BE:B6:74:36'], 'applied': True})
+        self.assertEqual(list(Client.objects.filter(is_blocked=True).values_list('mac_addr', flat=True)),
+                         ['AC:63:BE:B6:74:36'])
+
+    def test_no_apply_when_router_already_matches(self):
+        future = self.queue.block('FC:C2:DE:53:BA:96')
+        self.queue.flush()
+        self.api.block_clients.assert_not_called()
+        self.assertFalse(future.result(timeout=0)['applied'])
+
+    def test_intents_after_unblock_all_still_apply(self):
+        self.queue.block('AC:63:BE:B6:74:36')
+        self.queue.unblock_all()
+        self.queue.block('68:37:E9:1D:A7:CE')
+        self.queue.flush()
+        self.api.block_clients.assert_called_once_with(['68:37:E9:1D:A7:CE'])
+
+    def test_failed_apply_fails_every_intent(self):
+        self.api.block_clients.side_effect = ConnectionError('router unreachable')
+        futures = [self.queue.block('AC:63:BE:B6:74:36'), self.queue.unblock_all()]
+        self.queue.flush()
+        for future in futures:
+            self.assertIsInstance(future.exception(timeout=0), ConnectionError)
+        self.assertTrue(Client.objects.get(pk='FC:C2:DE:53:BA:96').is_blocked)
+
+    def test_applied_on_a_fresh_read_of_the_blocked_macs(self):
+        cache.clear()
+        router_api = Mock(router='default')
+        router_api.get_blocked_macs.return_value = []
+        snapshots = RouterSnapshotCache(router_api, ttl=60, cache=cache)
+        snapshots.get_blocked_macs()
+        # blocked from the router's page after the snapshot was taken
+        router_api.get_blocked_macs.return_value = ['FC:C2:DE:53:BA:96']
+        queue = BlockStateQueue(api=snapshots, window=3600)
+        queue.block('AC:63:BE:B6:74:36')
+        queue.flush()
+        router_api.block_clients.assert_called_once_with(['AC:63:BE:B6:74:36', 'FC:C2:DE:53:BA:96'])
@@ -0,0 +1,79 @@
+from django.test import SimpleTestCase
+
+import threading
+
+from ..collector import Job, JobScheduler
+
+
+class FakeClock:
+    """A clock that only moves when the scheduler waits or a job takes time. Stops the scheduler at stop_time"""
+
+    def __init__(self, stop_time):
+        self.now = 0
+        self.stop_time = stop_time
+
+    def __call__(self):
+        return self.now
+
+    def wait(self, timeout):
+        self.now += timeout
+        return self.is_set()
+
+    def is_set(self):
+        return self.now >= self.stop_time
+
+
+class TestJobScheduler(SimpleTestCase):
+
+    def test_jobs_run_on_their_own_intervals(self):
+        clock = FakeClock(stop_time=10)
+        fast_job = Job('fast', lambda: None, 1)
+        slow_job = Job('slow', lambda: None, 5)
+        JobScheduler([fast_job, slow_job], stop_event=clock, clock=clock).run()
+        self.assertEqual(fast_job.runs, 10)
+        self.assertEqual(slow_job.runs, 2)
+
+    def test_run_duration_does_not_cause_drift(self):
+        clock = FakeClock(stop_time=10)
+        run_times = []
+
+        def take_time():
+            run_times.append(clock.now)
+            clock.now += .3
+        JobScheduler([Job('job', take_time, 2)], stop_event=clock, clock=clock).run()
+        self.assertListEqual(run_times, [0, 2, 4, 6, 8])
+
+    def test_overrun_skips_missed_runs(self):
+        clock = FakeClock(stop_time=10)
+        run_times = []
+
+        def overrun():
+            run_times.append(clock.now)
+            clock.now += 2.5
+        JobScheduler([Job('job', overrun, 1)], stop_event=clock, clock=clock).run()
+        self.assertListEqual(run_times, [0, 3, 6, 9])
+
+    def test_job_on_its_own_thread_does_not_hold_up_the_others(self):
+        stop_event = threading.Event()
+        slow_started = threading.Event()
+
+        def slow():
+            slow_started.set()
+            stop_event.wait(5)
+
+        def fast():
+            if slow_started.wait(5) and fast_job.runs >= 3:
+                stop_event.set()
+        slow_job = Job('slow', slow, 1, thread='slow')
+        fast_job = Job('fast', fast, .01)
+        JobScheduler([slow_job, fast_job], stop_event=stop_event).run()
+        self.assertEqual(fast_job.runs, 4)
+        self.assertEqual(slow_job.runs, 1)
+
+    def test_failures_counted_in_stats(self):
+        job = Job('job', lambda: 1 / 0, 1)
+        job.run()
+        stats = job.get_stats()
+        self.assertEqual(stats['runs'], 1)
+        self.assertEqual(stats['failures'], 1)
+        self.assertIn('p95_ms', stats)
@@ -0,0 +1,126 @@
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+from ..asus_router import ClientConnectionSample
+from ..models import BlockReason, Client, ClientGroup
+from ..quotas import QuotaEngine, QuotaRule, RateAverage
+
+START = datetime(2017, 9, 1, 12)
+
+
+def batch(seconds, *rates):
+    """Samples of mac0, mac1... with their rx rates, sampled seconds after START"""
+    sample_time = START + timedelta(seconds=seconds)
+    return [ClientConnectionSample(f'mac{i}', -50, 1., rx, 60, sample_time) for i, rx in enumerate(rates)]
+
+
+class TestRateAverage(SimpleTestCase):
+
+    def test_average_is_independent_of_sample_interval(self):
+        every_second, every_ten_seconds = RateAverage(60, 0), RateAverage(60, 0)
+        for t in range(1, 121):
+            every_second.update(10, t)
+            if t % 10 == 0:
+                every_ten_seconds.update(10, t)
+        self.assertAlmostEqual(every_second.value, every_ten_seconds.value)
+        self.assertAlmostEqual(every_second.value, 10 * (1 - 1 / 7.389), places=2)
+
+    def test_rate_after_long_gap_only_counts_for_max_gap(self):
+        average = RateAverage(300, 0, max_gap=10)
+        average.update(200, 1200)
+        self.assertAlmostEqual(average.value, 200 * (1 - 2.718 ** (-10 / 300)), places=2)
+
+    def test_decays_without_samples(self):
+        average = RateAverage(60, 0)
+        average.update(10, 600)
+        self.assertAlmostEqual(average.get_decayed(660), average.value / 2.718, places=2)
+
+
+class TestQuotaEngine(SimpleTestCase):
+
+    def setUp(self):
+        self.submit = Mock()
+        self.engine = QuotaEngine([QuotaRule('rx', window=10, limit=50, release=20)], min_block_seconds=30,
+                                  submit=self.submit)
+
+    def test_blocks_client_over_limit(self):
+        decisions = [self.engine.observe(batch(t, 100, 10)) for t in range(0, 20, 2)]
+        self.assertEqual([d['block'] for d in decisions if d['block']], [['mac0']])
+        self.submit.assert_called_once_with('block', ['mac0'])
+        self.assertTrue(self.engine.is_blocked('mac0'))
+        self.assertFalse(self.engine.is_blocked('mac1'))
+
+    def test_short_burst_not_blocked(self):
+        self.engine.observe(batch(0, 0))
+        self.engine.observe(batch(2, 200))
+        for t in range(4, 60, 2):
+            self.engine.observe(batch(t, 0))
+        self.submit.assert_not_called()
+
+    def test_unblocked_after_min_block_time_once_under_release(self):
+        for t in range(0, 20, 2):
+            self.engine.observe(batch(t, 100))
+        # mac0 sends nothing while blocked, mac1 keeps the engine fed
+        unblocked_at = [t for t in range(20, 60, 2) if self.engine.observe(batch(t, 100, 0)[1:])['unblock']]
+        # blocked at 8s once the average passed 50
+        self.assertEqual(unblocked_at, [38])
+        self.submit.assert_called_with('unblock', ['mac0'])
+
+    def test_client_back_after_long_gap_not_blocked_on_one_sample(self):
+        engine = QuotaEngine([QuotaRule('rx', window=300, limit=50)], submit=self.submit)
+        engine.observe(batch(0, 0))
+        self.assertEqual(engine.observe(batch(1200, 200))['block'], [])
+        self.assertLess(engine.get_averages('mac0')[0], 10)
+
+    def test_not_blocked_again_right_after_unblock_and_reconnect(self):
+        engine = QuotaEngine([QuotaRule('rx', window=300, limit=50)], min_block_seconds=30, submit=self.submit)
+        t = 0
+        while not engine.is_blocked('mac0'):
+            engine.observe(batch(t, 200))
+            t += 2
+        # mac0 is gone while blocked, mac1 keeps the engine fed until mac0 is unblocked
+        while engine.is_blocked('mac0'):
+            engine.observe(batch(t, 200, 0)[1:])
+            t += 2
+        self.assertEqual(engine.observe(batch(t, 200))['block'], [])
+
+    def test_hysteresis_keeps_client_blocked_between_release_and_limit(self):
+        for t in range(0, 20, 2):
+            self.engine.observe(batch(t, 100))
+        for t in range(20, 120, 2):
+            self.engine.observe(batch(t, 35))
+        self.assertTrue(self.engine.is_blocked('mac0'))
+        self.assertEqual(self.submit.call_count, 1)
+
+    def test_no_rules_does_nothing(self):
+        engine = QuotaEngine([], submit=self.submit)
+        self.assertEqual(engine.observe(batch(0, 1000)), {'block': [], 'unblock': []})
+        self.assertIsNone(engine.get_averages('mac0'))
+
+
+class TestGroupQuotas(TestCase):
+
+    def test_group_rule_only_applies_to_members(self):
+        kids = ClientGroup.objects.create(name='kids')
+        kids.clients.add(Client.objects.create(mac_addr='mac1'))
+        submit = Mock()
+        engine = QuotaEngine([QuotaRule('rx', window=10, limit=50), QuotaRule('rx', window=10, limit=5, group='kids')],
+                             min_block_seconds=30, submit=submit)
+        for t in range(0, 20, 2):
+            engine.observe(batch(t, 10, 10))
+        submit.assert_called_once_with('block', ['mac1'])
+
+
+class TestRestoredBlocks(TestCase):
+
+    def test_restored_client_unblocked_once_released(self):
+        BlockReason.objects.create(mac_addr='mac0', reason='quota')
+        BlockReason.objects.update(created=timezone.make_aware(START - timedelta(minutes=10)))
+        submit = Mock()
+        engine = QuotaEngine([QuotaRule('rx', window=10, limit=50)], min_block_seconds=300, submit=submit)
+        engine.restore_blocked()
+        self.assertTrue(engine.is_blocked('mac0'))
+        self.assertEqual(engine.observe(batch(0, 0, 10))['unblock'], ['mac0'])
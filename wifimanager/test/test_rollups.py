@@ -0,0 +1,65 @@
+import datetime
+import os
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..models import Client, ConnectionSample, ConnectionSampleRollup, SpoolCheckpoint
+from ..rollups import choose_resolution, rollup_connection_samples, rollup_raw_samples
+
+
+class TestRollups(TestCase):
+
+    def setUp(self):
+        self.now = datetime.datetime(2017, 8, 9, 12, 0, 30, tzinfo=datetime.timezone.utc)
+        self.client_model = Client.objects.create(mac_addr='FC:C2:DE:53:BA:96')
+
+    def add_sample(self, time_of_sample, tx, rx, rssi=-60):
+        sample = ConnectionSample.objects.create(client=self.client_model, tx=tx, rx=rx, rssi=rssi, connection_time=1)
+        ConnectionSample.objects.filter(pk=sample.pk).update(time_of_sample=time_of_sample)
+
+    def test_raw_samples_rolled_into_ended_minutes_only(self):
+        minute = datetime.datetime(2017, 8, 9, 11, 58, tzinfo=datetime.timezone.utc)
+        for i, rx in enumerate([1, 2, 3, 10]):
+            self.add_sample(minute + datetime.timedelta(seconds=i * 10), tx=1, rx=rx)
+        self.add_sample(self.now, tx=1, rx=100)
+        self.assertEqual(rollup_raw_samples(self.now), 1)
+        rollup = ConnectionSampleRollup.objects.get()
+        self.assertEqual((rollup.resolution, rollup.bucket_start, rollup.sample_count), (60, minute, 4))
+        self.assertEqual((rollup.rx_min, rollup.rx_avg, rollup.rx_max, rollup.rx_p95), (1, 4, 10, 10))
+        self.assertEqual(rollup_raw_samples(self.now), 0)
+
+    def test_minutes_rolled_into_hours_weighted_by_sample_count(self):
+        hour = datetime.datetime(2017, 8, 9, 10, 0, tzinfo=datetime.timezone.utc)
+        self.add_sample(hour, tx=1, rx=2)
+        self.add_sample(hour + datetime.timedelta(minutes=1), tx=1, rx=8)
+        self.add_sample(hour + datetime.timedelta(minutes=1, seconds=2), tx=1, rx=8)
+        rollup_connection_samples(self.now)
+        hour_rollup = ConnectionSampleRollup.objects.get(resolution=3600)
+        self.assertEqual((hour_rollup.bucket_start, hour_rollup.sample_count, hour_rollup.rx_avg), (hour, 3, 6))
+        self.assertEqual(ConnectionSampleRollup.objects.filter(resolution=60).count(), 2)
+        self.assertFalse(ConnectionSampleRollup.objects.filter(resolution=86400).exists())
+
+    def test_remove_old_samples_rolls_up_first(self):
+        self.add_sample(timezone.now() - datetime.timedelta(minutes=10), tx=1, rx=2)
+        ConnectionSample.remove_old_samples()
+        self.assertFalse(ConnectionSample.objects.exists())
+        self.assertEqual(ConnectionSampleRollup.objects.get().rx_avg, 2)
+
+    @override_settings(SAMPLE_SPOOL_DIR='spool')
+    def test_only_rolled_up_to_a_minute_before_the_spool_is_drained(self):
+        start = timezone.now() - datetime.timedelta(minutes=20)
+        for minute in range(10):
+            self.add_sample(start + datetime.timedelta(minutes=minute), tx=1, rx=2)
+        # the samples of the last minutes are still in the spool, which is drained up to 12 minutes ago
+        SpoolCheckpoint.objects.create(spool=os.path.abspath('spool'),
+                                       sample_time=start + datetime.timedelta(minutes=8))
+        ConnectionSample.remove_old_samples()
+        self.assertEqual(ConnectionSampleRollup.objects.count(), 7)
+        self.assertEqual(ConnectionSample.objects.count(), 3)
+
+    def test_choose_resolution(self):
+        self.assertIsNone(choose_resolution(datetime.timedelta(minutes=.5)))
+        self.assertEqual(choose_resolution(datetime.timedelta(minutes=10)), 60)
+        self.assertEqual(choose_resolution(datetime.timedelta(days=2)), 3600)
+        self.assertEqual(choose_resolution(datetime.timedelta(days=90)), 86400)
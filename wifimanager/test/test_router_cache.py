@@ -0,0 +1,50 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+import threading
+import time
+from unittest.mock import Mock
+
+from ..router_cache import RouterSnapshotCache
+
+
+class TestRouterSnapshotCache(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.api = Mock(router='default')
+        self.api.get_connected_clients.side_effect = lambda: [self.api.get_connected_clients.call_count]
+        self.snapshots = RouterSnapshotCache(self.api, ttl=60, cache=cache)
+
+    def test_snapshot_reused_within_ttl(self):
+        self.assertEqual(self.snapshots.get_connected_clients(), [1])
+        self.assertEqual(self.snapshots.get_connected_clients(), [1])
+        self.assertEqual(self.api.get_connected_clients.call_count, 1)
+
+    def test_block_clients_invalidates(self):
+        self.snapshots.get_connected_clients()
+        self.snapshots.block_clients(['FC:C2:DE:53:BA:96'])
+        self.api.block_clients.assert_called_once_with(['FC:C2:DE:53:BA:96'])
+        self.assertEqual(self.snapshots.get_connected_clients(), [2])
+
+    def test_max_age_0_always_fetches(self):
+        self.snapshots.get_connected_clients()
+        self.assertEqual(self.snapshots.get_connected_clients(max_age=0), [2])
+
+    def test_concurrent_requesters_share_one_fetch(self):
+        def slow_fetch():
+            time.sleep(.2)
+            return ['slow']
+        self.api.get_client_connection_statuses.side_effect = slow_fetch
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                RouterSnapshotCache(self.api, ttl=60, cache=cache).get_client_connection_statuses(max_age=0)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [['slow']] * 5)
+        self.assertEqual(self.api.get_client_connection_statuses.call_count, 1)
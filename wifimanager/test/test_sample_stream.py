@@ -0,0 +1,98 @@
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+from django.db import DatabaseError
+
+import json
+from unittest.mock import patch
+
+from ..models import Client, ConnectionSample
+from ..sample_stream import SampleBatch, SampleBroker
+
+
+class TestSampleBroker(TestCase):
+
+    def setUp(self):
+        self.client_model = Client.objects.create(mac_addr='FC:C2:DE:53:BA:96')
+        self.broker = SampleBroker(interval=3600)
+
+    def add_sample(self, rx, router='default'):
+        return ConnectionSample.objects.create(client=self.client_model, tx=1, rx=rx, rssi=-60, connection_time=1,
+                                               router=router)
+
+    def test_new_samples_published_once_to_every_subscriber(self):
+        self.add_sample(rx=1)
+        subscribers = [self.broker.subscribe(), self.broker.subscribe()]
+        newer_sample = self.add_sample(rx=2)
+        with self.assertNumQueries(1):
+            self.broker.poll()
+        self.broker.poll()
+        batches = [subscriber.get_nowait() for subscriber in subscribers]
+        self.assertIs(batches[0], batches[1])
+        self.assertTrue(all(subscriber.empty() for subscriber in subscribers))
+        payload = json.loads(batches[0].get_payload())
+        self.assertEqual(payload['cursor'], newer_sample.id)
+        self.assertEqual(payload['client_samples']['FC_C2_DE_53_BA_96']['rx'], [2])
+        for subscriber in subscribers:
+            self.broker.unsubscribe(subscriber)
+
+    def test_slow_subscriber_drops_oldest_batches(self):
+        broker = SampleBroker(interval=3600, max_queued_batches=2)
+        subscriber = broker.subscribe()
+        for cursor in range(1, 4):
+            broker.publish(SampleBatch(cursor - 1, cursor, []))
+        self.assertEqual([subscriber.get_nowait().cursor for _ in range(2)], [2, 3])
+        broker.unsubscribe(subscriber)
+
+    def test_batch_payload_leaves_out_rows_already_seen(self):
+        rows = [('FC:C2:DE:53:BA:96', 4, None, 1, 1, -60, 1, 'default'),
+                ('FC:C2:DE:53:BA:96', 5, None, 1, 2, -60, 1, 'default')]
+        payload = json.loads(SampleBatch(3, 5, rows).get_payload(after=4))
+        self.assertEqual(payload['client_samples']['FC_C2_DE_53_BA_96'], {
+            'id': [5], 'time_of_sample': [None], 'tx': [1], 'rx': [2], 'rssi': [-60], 'connection_time': [1]
+        })
+
+    def test_batch_payload_filtered_by_router(self):
+        rows = [('FC:C2:DE:53:BA:96', 4, None, 1, 1, -60, 1, 'upstairs'),
+                ('FC:C2:DE:53:BA:96', 5, None, 1, 2, -60, 1, 'downstairs')]
+        batch = SampleBatch(3, 5, rows)
+        for router, rx in (('upstairs', [1]), ('downstairs', [2]), (None, [1, 2])):
+            payload = json.loads(batch.get_payload(router=router))
+            self.assertEqual(payload['client_samples']['FC_C2_DE_53_BA_96']['rx'], rx)
+        self.assertEqual(json.loads(batch.get_payload(router='attic'))['client_samples'], {})
+
+    def test_stream_starts_with_snapshot(self):
+        self.add_sample(rx=1)
+        with patch('wifimanager.sample_stream.broker', self.broker):
+            res = self.client.get(reverse('wifimanager:stream-connection-samples'), {'dt': .5})
+            events = iter(res.streaming_content)
+            snapshot = next(events).decode('utf-8')
+            res.close()
+        self.assertEqual(res['Content-Type'], 'text/event-stream')
+        self.assertTrue(snapshot.startswith('event: snapshot\n'))
+        self.assertEqual(json.loads(snapshot.split('data: ')[1])['client_samples']['FC_C2_DE_53_BA_96']['rx'], [1])
+
+    def test_stream_filtered_by_router(self):
+        self.add_sample(rx=1, router='upstairs')
+        self.add_sample(rx=2, router='downstairs')
+        with patch('wifimanager.sample_stream.broker', self.broker):
+            res = self.client.get(reverse('wifimanager:stream-connection-samples'), {'dt': .5, 'router': 'upstairs'})
+            events = iter(res.streaming_content)
+            snapshot = next(events).decode('utf-8')
+            self.add_sample(rx=3, router='upstairs')
+            self.add_sample(rx=4, router='downstairs')
+            self.broker.poll()
+            samples = next(events).decode('utf-8')
+            res.close()
+        self.assertEqual(json.loads(snapshot.split('data: ')[1])['client_samples']['FC_C2_DE_53_BA_96']['rx'], [1])
+        self.assertTrue(samples.startswith('event: samples\n'))
+        self.assertEqual(json.loads(samples.split('data: ')[1])['client_samples']['FC_C2_DE_53_BA_96']['rx'], [3])
+
+    def test_failed_snapshot_leaves_no_subscriber(self):
+        with patch('wifimanager.sample_stream.broker', self.broker), \
+                patch('wifimanager.views.group_rows_columnar', side_effect=DatabaseError('db gone')):
+            res = self.client.get(reverse('wifimanager:stream-connection-samples'), {'dt': .5})
+            self.assertFalse(self.broker._subscribers)
+            with self.assertRaises(DatabaseError):
+                next(iter(res.streaming_content))
+        self.assertFalse(self.broker._subscribers)
+        self.assertIsNone(self.broker._feeder_stop_event)
@@ -0,0 +1,115 @@
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from django.utils import timezone
+
+import datetime
+from unittest.mock import Mock
+
+from ..models import BlockReason, BlockSchedule, Client, ClientGroup
+from ..schedules import ScheduleRunner, get_next_transition
+
+
+def local(day, hour, minute=0):
+    """An aware time in the week of monday 2017-09-04"""
+    return timezone.make_aware(datetime.datetime(2017, 9, 4 + day, hour, minute))
+
+
+class TestBlockSchedule(TestCase):
+
+    def setUp(self):
+        self.client_model = Client.objects.create(mac_addr='FC:C2:DE:53:BA:96')
+        # school nights, sunday to thursday 21:00 until 07:00 the next morning
+        self.bedtime = BlockSchedule.objects.create(client=self.client_model, days='01236',
+                                                    start=datetime.time(21), end=datetime.time(7))
+
+    def test_overnight_window(self):
+        self.assertTrue(self.bedtime.is_active_at(local(0, 22)))
+        self.assertTrue(self.bedtime.is_active_at(local(1, 6, 59)))
+        self.assertFalse(self.bedtime.is_active_at(local(1, 7)))
+        # friday night isn't a school night but thursday's window runs into friday morning
+        self.assertTrue(self.bedtime.is_active_at(local(4, 3)))
+        self.assertFalse(self.bedtime.is_active_at(local(4, 22)))
+
+    def test_needs_exactly_one_of_client_or_group(self):
+        self.bedtime.full_clean()
+        with self.assertRaises(ValidationError):
+            BlockSchedule(start=datetime.time(21), end=datetime.time(7)).full_clean()
+        group = ClientGroup.objects.create(name='kids')
+        with self.assertRaises(ValidationError):
+            BlockSchedule(client=self.client_model, group=group, start=datetime.time(21),
+                          end=datetime.time(7)).full_clean()
+
+    def test_next_transition(self):
+        self.assertEqual(self.bedtime.get_next_transition(local(0, 12)), local(0, 21))
+        self.assertEqual(self.bedtime.get_next_transition(local(0, 21)), local(1, 7))
+        self.assertEqual(self.bedtime.get_next_transition(local(4, 8)), local(6, 21))
+
+    def test_windows_on_dst_changes(self):
+        # in America/Los_Angeles 2017-03-12 skips 02:00-03:00 and 2017-11-05 repeats 01:00-02:00
+        utc = datetime.timezone.utc
+        nights = BlockSchedule(client=self.client_model, start=datetime.time(2, 30), end=datetime.time(1, 30))
+        self.assertEqual(nights.get_next_transition(datetime.datetime(2017, 3, 12, 9, 45, tzinfo=utc)),
+                         datetime.datetime(2017, 3, 12, 10, 30, tzinfo=utc))
+        self.assertFalse(nights.is_active_at(datetime.datetime(2017, 3, 12, 10, 0, tzinfo=utc)))
+        self.assertTrue(nights.is_active_at(datetime.datetime(2017, 3, 12, 10, 45, tzinfo=utc)))
+        # the first 01:45 is still blocked, the second one isn't
+        self.assertTrue(nights.is_active_at(datetime.datetime(2017, 11, 5, 8, 45, tzinfo=utc)))
+        self.assertFalse(nights.is_active_at(datetime.datetime(2017, 11, 5, 9, 45, tzinfo=utc)))
+        self.assertEqual(nights.get_next_transition(datetime.datetime(2017, 11, 5, 7, 0, tzinfo=utc)),
+                         datetime.datetime(2017, 11, 5, 9, 30, tzinfo=utc))
+
+    def test_next_transition_of_several_schedules(self):
+        homework = BlockSchedule(client=self.client_model, days='0', start=datetime.time(16), end=datetime.time(18))
+        self.assertEqual(get_next_transition([self.bedtime, homework], local(0, 12)), local(0, 16))
+        self.assertIsNone(get_next_transition([], local(0, 12)))
+
+
+class TestScheduleRunner(TestCase):
+
+    def setUp(self):
+        for mac in ('FC:C2:DE:53:BA:96', 'AC:63:BE:B6:74:36'):
+            client = Client.objects.create(mac_addr=mac)
+            BlockSchedule.objects.create(client=client, start=datetime.time(21), end=datetime.time(7))
+        self.now = local(0, 12)
+        self.submit = Mock()
+        self.runner = ScheduleRunner(submit=self.submit, clock=lambda: self.now)
+
+    def test_transitions_applied_once_for_every_client(self):
+        self.assertEqual(self.runner.apply(), local(0, 21))
+        self.submit.assert_not_called()
+        self.now = local(0, 21)
+        self.assertEqual(self.runner.apply(), local(1, 7))
+        self.submit.assert_called_once_with('block', ['AC:63:BE:B6:74:36', 'FC:C2:DE:53:BA:96'])
+        self.runner.apply()
+        self.assertEqual(self.submit.call_count, 1)
+        self.now = local(1, 7)
+        self.runner.apply()
+        self.submit.assert_called_with('unblock', ['AC:63:BE:B6:74:36', 'FC:C2:DE:53:BA:96'])
+
+    def test_disabling_a_schedule_unblocks_its_client(self):
+        self.now = local(0, 22)
+        self.runner.apply()
+        BlockSchedule.objects.filter(client_id='FC:C2:DE:53:BA:96').update(enabled=False)
+        self.runner.apply()
+        self.submit.assert_called_with('unblock', ['FC:C2:DE:53:BA:96'])
+
+    def test_group_schedule_blocks_every_member(self):
+        BlockSchedule.objects.all().delete()
+        kids = ClientGroup.objects.create(name='kids')
+        kids.clients.set(Client.objects.all())
+        BlockSchedule.objects.create(group=kids, start=datetime.time(16), end=datetime.time(18), days='0')
+        self.now = local(0, 16, 30)
+        self.assertEqual(self.runner.apply(), local(0, 18))
+        self.submit.assert_called_once_with('block', ['AC:63:BE:B6:74:36', 'FC:C2:DE:53:BA:96'])
+
+    def test_schedule_without_client_or_group_skipped(self):
+        BlockSchedule.objects.create(start=datetime.time(21), end=datetime.time(7))
+        self.now = local(0, 22)
+        self.runner.apply()
+        self.submit.assert_called_once_with('block', ['AC:63:BE:B6:74:36', 'FC:C2:DE:53:BA:96'])
+
+    def test_restarted_runner_unblocks_clients_whose_schedule_ended(self):
+        BlockReason.objects.create(mac_addr='FC:C2:DE:53:BA:96', reason='schedule')
+        self.runner.restore_blocked()
+        self.runner.apply()
+        self.submit.assert_called_once_with('unblock', ['FC:C2:DE:53:BA:96'])
@@ -0,0 +1,129 @@
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+import os
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+from unittest.mock import Mock, call, patch
+
+from ..asus_router import ClientConnectionSample
+from ..models import ConnectionSample, SpoolCheckpoint
+from ..spool import SampleSpool, SpoolDrainer, decode_batch, encode_batch
+
+SAMPLE_TIME = datetime(2017, 9, 1, 12, 0, 0, 500000, tzinfo=timezone.utc)
+
+
+def build_batch(num_clients, rx=6.5):
+    return [ClientConnectionSample(f'02:00:00:00:00:{i:02X}', -60, 121.5, rx, 102, SAMPLE_TIME)
+            for i in range(num_clients)]
+
+
+class TestSampleSpool(SimpleTestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool_dir.cleanup)
+        self.spool = SampleSpool(self.spool_dir.name, segment_size=1024)
+        self.addCleanup(self.spool.close)
+
+    def test_batch_round_trip(self):
+        router, samples = decode_batch(encode_batch('main', build_batch(3)))
+        self.assertEqual(router, 'main')
+        self.assertEqual(samples, build_batch(3))
+        self.assertIs(samples[0].sample_time, samples[2].sample_time)
+        self.assertEqual(samples[0].sample_time, SAMPLE_TIME)
+
+    def test_read_from_position(self):
+        for rx in range(5):
+            self.spool.append('default', build_batch(2, rx))
+        batches, position = self.spool.read((0, 0), 3)
+        self.assertEqual([samples[0].rx_rate for router, samples in batches], [0, 1, 2])
+        batches, position = self.spool.read(position, 10)
+        self.assertEqual([samples[0].rx_rate for router, samples in batches], [3, 4])
+        self.assertEqual(self.spool.read(position, 10), ([], position))
+
+    def test_rotates_by_size(self):
+        for rx in range(20):
+            self.spool.append('default', build_batch(2, rx))
+        self.assertGreater(len(self.spool.get_segments()), 1)
+        batches, position = self.spool.read((0, 0), 100)
+        self.assertEqual([samples[0].rx_rate for router, samples in batches], list(range(20)))
+        self.assertEqual(position[0], self.spool.get_segments()[-1])
+        self.spool.remove_segments_before(position[0])
+        self.assertEqual(self.spool.get_segments(), [position[0]])
+
+    def test_torn_record_ends_segment_after_restart(self):
+        self.spool.append('default', build_batch(2, 1))
+        self.spool.append('default', build_batch(2, 2))
+        self.spool.close()
+        # a crash halfway through writing the second record
+        record_size = 8 + len(encode_batch('default', build_batch(2)))
+        with open(os.path.join(self.spool_dir.name, '0000000000.spool'), 'r+b') as fh:
+            fh.seek(record_size * 2 - 10)
+            fh.write(b'\0' * 10)
+        restarted = SampleSpool(self.spool_dir.name, segment_size=1024)
+        self.addCleanup(restarted.close)
+        restarted.append('default', build_batch(2, 3))
+        batches, position = restarted.read((0, 0), 10)
+        self.assertEqual([samples[0].rx_rate for router, samples in batches], [1, 3])
+        self.assertEqual(position[0], 1)
+
+
+class TestSpoolDrainer(TestCase):
+
+    def setUp(self):
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        self.spool = SampleSpool(spool_dir.name, segment_size=1024)
+        self.addCleanup(self.spool.close)
+        self.drainer = SpoolDrainer(self.spool, max_batches=100)
+
+    def test_drains_batches_with_their_sample_time(self):
+        self.spool.append('main', build_batch(2))
+        self.spool.append('node', build_batch(1))
+        self.assertEqual(self.drainer.drain(), 2)
+        self.assertEqual(ConnectionSample.objects.count(), 3)
+        self.assertEqual(ConnectionSample.objects.filter(router='node').get().time_of_sample.timestamp(),
+                         SAMPLE_TIME.timestamp())
+        self.assertEqual(SpoolCheckpoint.objects.get().sample_time.timestamp(), SAMPLE_TIME.timestamp())
+        self.assertEqual(self.drainer.drain(), 0)
+        self.assertEqual(ConnectionSample.objects.count(), 3)
+
+    def test_empty_batches_drained(self):
+        self.spool.append('main', build_batch(2))
+        self.assertEqual(self.drainer.drain(), 1)
+        for i in range(150):
+            self.spool.append('main', [])
+        self.assertEqual(self.drainer.drain(), 100)
+        self.assertEqual(self.drainer.drain(), 50)
+        self.assertEqual(self.drainer.drain(), 0)
+        self.assertEqual(ConnectionSample.objects.count(), 2)
+        self.assertEqual(SpoolCheckpoint.objects.get().sample_time.timestamp(), SAMPLE_TIME.timestamp())
+
+    def test_failed_write_is_replayed(self):
+        self.spool.append('main', build_batch(2))
+        with patch.object(ConnectionSample.objects, 'bulk_create', side_effect=ConnectionError('db down')):
+            with self.assertRaises(ConnectionError):
+                self.drainer.drain()
+        self.assertEqual(ConnectionSample.objects.count(), 0)
+        self.assertEqual(SpoolCheckpoint.objects.get().offset, 0)
+        self.assertEqual(SpoolDrainer(self.spool).drain(), 1)
+        self.assertEqual(ConnectionSample.objects.count(), 2)
+
+    def test_collect_command_joins_drainer_before_closing_spool(self):
+        command = 'wifimanager.management.commands.collect_connection_samples'
+        calls = Mock()
+        spool = calls.spool
+        drainer = calls.drainer
+        drainer.start_in_background.return_value = calls.thread
+        with patch(f'{command}.SampleSpool.from_settings', return_value=spool), \
+                patch(f'{command}.SpoolDrainer', return_value=drainer), \
+                patch(f'{command}.build_jobs', return_value=[]), \
+                patch(f'{command}.ScheduleRunner'), \
+                patch(f'{command}.JobScheduler') as scheduler, \
+                patch(f'{command}.signal.signal'):
+            scheduler.return_value.run.side_effect = RuntimeError('scheduler failed')
+            with self.assertRaises(RuntimeError):
+                call_command('collect_connection_samples', stdout=StringIO())
+        self.assertEqual(calls.mock_calls[-3:], [call.drainer.stop(), call.thread.join(), call.spool.close()])
@@ -0,0 +1,328 @@
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.urlresolvers import reverse
+
+import datetime
+import threading
+from unittest.mock import patch
+
+from .. import collector, router_jobs
+from ..asus_router import AsusApi, Client as AsusClient, ClientConnectionSample
+from ..collector import RouterPollError
+from ..models import BlockReason, Client, ClientGroup, ConnectionSample, ConnectionSampleRollup, RouterJob
+
+
+def build_asus_samples(num_clients):
+    return [ClientConnectionSample(f'02:00:00:00:00:{i:02X}', -60, 121.5, 6.5, 102)
+            for i in range(num_clients)]
+
+
+def build_asus_clients(num_clients):
+    return [AsusClient(f'client-{i}', f'02:00:00:00:00:{i:02X}', f'192.168.1.{i + 1}', False)
+            for i in range(num_clients)]
+
+
+class TestCollectConnectionSamples(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def collect(self, asus_samples):
+        with patch('wifimanager.asus_router.AsusApi.get_client_connection_statuses', return_value=asus_samples):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(reverse('wifimanager:collect-connection-samples'))
+        self.assertEqual(res.status_code, 200)
+        return queries
+
+    def test_samples_and_new_clients_saved(self):
+        Client.objects.create(mac_addr='02:00:00:00:00:00', name='phone')
+        self.collect(build_asus_samples(3))
+        self.assertEqual(ConnectionSample.objects.count(), 3)
+        self.assertEqual(Client.objects.count(), 3)
+        self.assertEqual(Client.objects.get(pk='02:00:00:00:00:00').name, 'phone')
+        sample = ConnectionSample.objects.first()
+        self.assertEqual((sample.rssi, sample.connection_time), (-60, 102))
+        self.assertEqual(Client.objects.filter(last_seen=None).count(), 0)
+
+    def test_query_count_constant_as_clients_grow(self):
+        few_clients_queries = self.collect(build_asus_samples(2))
+        ConnectionSample.objects.all().delete()
+        Client.objects.all().delete()
+        many_clients_queries = self.collect(build_asus_samples(60))
+        self.assertEqual(len(few_clients_queries), len(many_clients_queries))
+        self.assertEqual(ConnectionSample.objects.count(), 60)
+
+    def test_samples_and_clients_fetched_at_the_same_time(self):
+        # both pages have to be fetching at the same time to get past the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fetch_after_barrier(result):
+            def fetch(api):
+                barrier.wait()
+                return result
+            return fetch
+        with patch.object(AsusApi, 'get_client_connection_statuses', autospec=True,
+                          side_effect=fetch_after_barrier(build_asus_samples(2))):
+            with patch.object(AsusApi, 'get_connected_clients', autospec=True,
+                              side_effect=fetch_after_barrier(build_asus_clients(2))):
+                collector.collect_samples_and_clients(collector.get_routers())
+        self.assertEqual(ConnectionSample.objects.count(), 2)
+        self.assertEqual(list(Client.objects.order_by('mac_addr').values_list('name', flat=True)),
+                         ['client-0', 'client-1'])
+
+
+class TestIndex(TestCase):
+
+    def test_currently_connected_clients_in_one_query(self):
+        now = timezone.now()
+        Client.objects.create(mac_addr='02:00:00:00:00:01', name='phone', last_seen=now)
+        Client.objects.create(mac_addr='02:00:00:00:00:02', name='laptop', last_seen=now-datetime.timedelta(minutes=10))
+        Client.objects.create(mac_addr='02:00:00:00:00:03', name='tv')
+        with self.assertNumQueries(1):
+            res = self.client.get(reverse('wifimanager:index'))
+        self.assertEqual([client.name for client in res.context['clients']], ['phone'])
+        self.assertContains(res, 'id="02_00_00_00_00_01"')
+
+
+class TestUpdateConnectedClients(TestCase):
+
+    def update(self, asus_clients):
+        cache.clear()
+        with patch('wifimanager.asus_router.AsusApi.get_connected_clients', return_value=asus_clients):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(reverse('wifimanager:update-connected-clients'))
+        self.assertEqual(res.status_code, 200)
+        return res.json(), queries
+
+    def test_diff_summary(self):
+        asus_clients = build_asus_clients(3)
+        Client.objects.create(mac_addr=asus_clients[0].mac_addr, name=asus_clients[0].name,
+                              ip_addr=asus_clients[0].ip_addr)
+        Client.objects.create(mac_addr=asus_clients[1].mac_addr, name='old name', ip_addr=asus_clients[1].ip_addr)
+        asus_clients[1].is_blocked = True
+        diff, _ = self.update(asus_clients)
+        self.assertListEqual(diff['added'], [asus_clients[2].mac_addr])
+        self.assertListEqual(diff['changed'], [asus_clients[1].mac_addr])
+        self.assertEqual(diff['unchanged'], 1)
+        changed_client = Client.objects.get(pk=asus_clients[1].mac_addr)
+        self.assertTrue(changed_client.compare_to_asus_client(asus_clients[1]))
+
+    def test_query_count_constant_as_clients_grow(self):
+        _, few_clients_queries = self.update(build_asus_clients(2))
+        Client.objects.all().update(name='old name')
+        _, few_clients_changed_queries = self.update(build_asus_clients(2))
+        Client.objects.all().delete()
+        _, many_clients_queries = self.update(build_asus_clients(60))
+        Client.objects.all().update(name='old name')
+        _, many_clients_changed_queries = self.update(build_asus_clients(60))
+        self.assertEqual(len(few_clients_queries), len(many_clients_queries))
+        self.assertEqual(len(few_clients_changed_queries), len(many_clients_changed_queries))
+
+
+class TestGetConnectionSamples(TestCase):
+
+    def test_long_range_served_from_rollups(self):
+        client = Client.objects.create(mac_addr='FC:C2:DE:53:BA:96')
+        ConnectionSampleRollup.objects.create(
+            client=client, resolution=60, bucket_start=timezone.now()-datetime.timedelta(minutes=3), sample_count=2,
+            tx_min=1, tx_avg=2, tx_max=3, tx_p95=3, rx_min=4, rx_avg=5, rx_max=6, rx_p95=6,
+            rssi_min=-70, rssi_avg=-65, rssi_max=-60, rssi_p95=-60)
+        res = self.client.get(reverse('wifimanager:get-connection-samples'), {'dt': 120}).json()
+        self.assertEqual(res['resolution'], 60)
+        self.assertEqual(res['client_samples']['FC_C2_DE_53_BA_96'][0]['rx'], 5)
+
+    def test_samples_grouped_by_client_in_one_query(self):
+        for mac in ('FC:C2:DE:53:BA:96', '68:37:E9:1D:A7:CE'):
+            client = Client.objects.create(mac_addr=mac)
+            for rx in (1, 2):
+                ConnectionSample.objects.create(client=client, tx=3, rx=rx, rssi=-60, connection_time=10)
+        with self.assertNumQueries(1):
+            res = self.client.get(reverse('wifimanager:get-connection-samples'), {'dt': .5}).json()
+        self.assertIsNone(res['resolution'])
+        self.assertEqual([sample['rx'] for sample in res['client_samples']['FC_C2_DE_53_BA_96']], [1, 2])
+        self.assertEqual(res['client_samples']['68_37_E9_1D_A7_CE'][0]['client'], '68:37:E9:1D:A7:CE')
+
+    def test_columnar_format(self):
+        client = Client.objects.create(mac_addr='FC:C2:DE:53:BA:96')
+        for rx in (1, 2):
+            ConnectionSample.objects.create(client=client, tx=3, rx=rx, rssi=-60, connection_time=10)
+        res = self.client.get(reverse('wifimanager:get-connection-samples'), {'dt': .5, 'format': 'columnar'}).json()
+        columns = res['client_samples']['FC_C2_DE_53_BA_96']
+        self.assertEqual(columns['rx'], [1, 2])
+        self.assertEqual(columns['rssi'], [-60, -60])
+        self.assertNotIn('client', columns)
+
+    def test_since_cursor_returns_only_newer_samples(self):
+        client = Client.objects.create(mac_addr='FC:C2:DE:53:BA:96')
+        ConnectionSample.objects.create(client=client, tx=3, rx=1, rssi=-60, connection_time=10)
+        url = reverse('wifimanager:get-connection-samples')
+        cursor = self.client.get(url, {'dt': .5}).json()['cursor']
+        newer_sample = ConnectionSample.objects.create(client=client, tx=3, rx=2, rssi=-60, connection_time=12)
+        res = self.client.get(url, {'dt': .5, 'since': cursor}).json()
+        self.assertEqual(res['cursor'], newer_sample.id)
+        self.assertEqual([sample['rx'] for sample in res['client_samples']['FC_C2_DE_53_BA_96']], [2])
+        res = self.client.get(url, {'dt': .5, 'since': res['cursor']}).json()
+        self.assertEqual((res['cursor'], res['client_samples']), (newer_sample.id, {}))
+
+
+@override_settings(ROUTER_JOBS_SYNC=True)
+class TestRouterJobs(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Client.objects.create(mac_addr='FC:C2:DE:53:BA:96')
+        Client.objects.create(mac_addr='AC:63:BE:B6:74:36')
+
+    @patch('wifimanager.asus_router.AsusApi.block_clients')
+    @patch('wifimanager.asus_router.AsusApi.get_blocked_macs', return_value=[])
+    def test_block_client_returns_job(self, get_blocked_macs, block_clients):
+        res = self.client.get(reverse('wifimanager:block-client', args=['FC:C2:DE:53:BA:96']),
+                              HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        job = res.json()['job']
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result'], {'blocked': ['FC:C2:DE:53:BA:96'], 'applied': True})
+        block_clients.assert_called_once_with(['FC:C2:DE:53:BA:96'])
+        res = self.client.get(res.json()['job_url'])
+        self.assertEqual(res.json()['job']['status'], 'succeeded')
+
+    @patch('wifimanager.asus_router.AsusApi.block_clients', side_effect=ConnectionError('router unreachable'))
+    @patch('wifimanager.asus_router.AsusApi.get_blocked_macs', return_value=[])
+    def test_failed_job_reports_error(self, get_blocked_macs, block_clients):
+        res = self.client.get(reverse('wifimanager:block-all-clients'))
+        job = RouterJob.objects.get()
+        self.assertRedirects(res, f"{reverse('wifimanager:index')}?job={job.pk}", fetch_redirect_response=False)
+        res = self.client.get(reverse('wifimanager:get-router-job', args=[job.pk]))
+        self.assertEqual(res.json()['job']['status'], 'failed')
+        self.assertEqual(res.json()['job']['error'], 'router unreachable')
+        self.assertEqual(Client.objects.filter(is_blocked=True).count(), 0)
+
+    def test_unknown_job(self):
+        res = self.client.get(reverse('wifimanager:get-router-job', args=[1]))
+        self.assertEqual(res.status_code, 404)
+
+    def test_stale_pending_job_fails(self):
+        job = RouterJob.objects.create(action='block', macs='FC:C2:DE:53:BA:96')
+        RouterJob.objects.filter(pk=job.pk).update(created=timezone.now() - datetime.timedelta(minutes=5))
+        res = self.client.get(reverse('wifimanager:index'), {'job': job.pk})
+        self.assertIsNone(res.context['router_job'])
+        res = self.client.get(reverse('wifimanager:get-router-job', args=[job.pk]))
+        self.assertEqual(res.json()['job']['status'], 'failed')
+        self.assertIn('timed out', res.json()['job']['error'])
+
+    @patch('wifimanager.router_jobs.get_block_queue')
+    def test_schedule_unblock_leaves_client_blocked_by_hand(self, get_block_queue):
+        self.client.get(reverse('wifimanager:block-client', args=['FC:C2:DE:53:BA:96']))
+        router_jobs.submit('block', ['FC:C2:DE:53:BA:96'], reason='schedule')
+        self.assertIsNone(router_jobs.submit('unblock', ['FC:C2:DE:53:BA:96'], reason='schedule'))
+        get_block_queue.return_value.unblock.assert_not_called()
+        self.client.get(reverse('wifimanager:unblock-client', args=['FC:C2:DE:53:BA:96']))
+        get_block_queue.return_value.unblock.assert_called_once_with('FC:C2:DE:53:BA:96')
+        self.assertFalse(BlockReason.objects.exists())
+
+    @patch('wifimanager.router_jobs.get_block_queue')
+    def test_quota_unblock_leaves_client_blocked_from_router(self, get_block_queue):
+        Client.objects.filter(pk='FC:C2:DE:53:BA:96').update(is_blocked=True)
+        router_jobs.submit('block', ['FC:C2:DE:53:BA:96', 'AC:63:BE:B6:74:36'], reason='quota')
+        router_jobs.submit('unblock', ['FC:C2:DE:53:BA:96', 'AC:63:BE:B6:74:36'], reason='quota')
+        get_block_queue.return_value.unblock.assert_called_once_with('AC:63:BE:B6:74:36')
+        self.assertEqual(list(BlockReason.objects.values_list('mac_addr', 'reason')), [('FC:C2:DE:53:BA:96', 'manual')])
+
+
+class TestClientGroups(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.group = ClientGroup.objects.create(name='iot')
+        self.group.clients.set(Client.objects.create(mac_addr=f'02:00:00:00:00:{i:02X}') for i in range(50))
+        Client.objects.create(mac_addr='FC:C2:DE:53:BA:96')
+
+    @patch('wifimanager.router_jobs.get_block_queue')
+    def test_block_group_in_constant_queries(self, get_block_queue):
+        # the members, the block reasons in a savepoint and the job, however big the group is
+        with self.assertNumQueries(6):
+            self.client.get(reverse('wifimanager:block-group', args=[self.group.pk]))
+        get_block_queue.assert_called_once_with('default')
+        self.assertEqual(len(get_block_queue.return_value.block.call_args[0]), 50)
+
+    @override_settings(ROUTER_JOBS_SYNC=True)
+    @patch('wifimanager.asus_router.AsusApi.block_clients')
+    @patch('wifimanager.asus_router.AsusApi.get_blocked_macs', return_value=['FC:C2:DE:53:BA:96'])
+    def test_group_toggled_in_one_apply(self, get_blocked_macs, block_clients):
+        self.client.get(reverse('wifimanager:block-group', args=[self.group.pk]))
+        block_clients.assert_called_once()
+        self.assertEqual(len(block_clients.call_args[0][0]), 51)
+        self.assertEqual(Client.objects.filter(is_blocked=True).count(), 51)
+        get_blocked_macs.return_value = block_clients.call_args[0][0]
+        self.client.get(reverse('wifimanager:unblock-group', args=[self.group.pk]))
+        block_clients.assert_called_with(['FC:C2:DE:53:BA:96'])
+        self.assertEqual(list(Client.objects.filter(is_blocked=True).values_list('mac_addr', flat=True)),
+                         ['FC:C2:DE:53:BA:96'])
+
+    def test_unknown_group(self):
+        res = self.client.get(reverse('wifimanager:block-group', args=[self.group.pk + 1]))
+        self.assertEqual(res.status_code, 404)
+
+
+@override_settings(ASUS_ROUTERS={'main': {}, 'node': {'BLOCK_VIA': 'main'}, 'cabin': {}})
+class TestMultipleRouters(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.samples_by_router = {
+            'main': build_asus_samples(2),
+            'node': [ClientConnectionSample('02:00:00:00:01:00', -70, 6.5, 6.5, 10)],
+            'cabin': [ClientConnectionSample('02:00:00:00:02:00', -50, 6.5, 6.5, 10)],
+        }
+
+    def test_routers_polled_in_parallel(self):
+        # every router has to be fetching at the same time to get past the barrier
+        barrier = threading.Barrier(3, timeout=5)
+
+        def get_client_connection_statuses(api):
+            barrier.wait()
+            return self.samples_by_router[api.router]
+        with patch.object(AsusApi, 'get_client_connection_statuses', autospec=True,
+                          side_effect=get_client_connection_statuses):
+            res = self.client.post(reverse('wifimanager:collect-connection-samples'))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(dict(Client.objects.values_list('mac_addr', 'router')), {
+            '02:00:00:00:00:00': 'main',
+            '02:00:00:00:00:01': 'main',
+            '02:00:00:00:01:00': 'node',
+            '02:00:00:00:02:00': 'cabin',
+        })
+        self.assertEqual(ConnectionSample.objects.filter(router='node').count(), 1)
+
+    def test_failing_router_does_not_stop_the_others(self):
+        def get_client_connection_statuses(api):
+            if api.router == 'cabin':
+                raise ConnectionError('cabin unreachable')
+            return self.samples_by_router[api.router]
+        with patch.object(AsusApi, 'get_client_connection_statuses', autospec=True,
+                          side_effect=get_client_connection_statuses):
+            with self.assertRaises(RouterPollError):
+                collector.collect_connection_samples(collector.get_routers())
+        self.assertEqual(ConnectionSample.objects.count(), 3)
+
+    def test_dashboard_filtered_by_router(self):
+        with patch.object(AsusApi, 'get_client_connection_statuses', autospec=True,
+                          side_effect=lambda api: self.samples_by_router[api.router]):
+            collector.collect_connection_samples(collector.get_routers())
+        res = self.client.get(reverse('wifimanager:index'), {'router': 'cabin'})
+        self.assertEqual([client.mac_addr for client in res.context['clients']], ['02:00:00:00:02:00'])
+        res = self.client.get(reverse('wifimanager:get-connection-samples'), {'dt': .5, 'router': 'node'})
+        self.assertEqual(list(res.json()['client_samples']), ['02_00_00_00_01_00'])
+
+    @override_settings(ROUTER_JOBS_SYNC=True)
+    @patch.object(AsusApi, 'block_clients', autospec=True)
+    @patch.object(AsusApi, 'get_blocked_macs', autospec=True, return_value=[])
+    def test_blocks_applied_on_block_router(self, get_blocked_macs, block_clients):
+        Client.objects.create(mac_addr='02:00:00:00:01:00', router='node')
+        Client.objects.create(mac_addr='02:00:00:00:02:00', router='cabin')
+        res = self.client.get(reverse('wifimanager:block-all-clients'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(res.json()['job']['result']['blocked'], ['02:00:00:00:01:00', '02:00:00:00:02:00'])
+        self.assertEqual(sorted((call[0][0].router, call[0][1]) for call in block_clients.call_args_list),
+                         [('cabin', ['02:00:00:00:02:00']), ('main', ['02:00:00:00:01:00'])])
@@ -10,9 +10,14 @@ urlpatterns = [
     url(r'^collect_connection_samples/$', views.collect_connection_samples, name='collect-connection-samples'),
     url(r'^remove_old_connection_samples/$', views.remove_old_connection_samples, name='remove-old-connection-samples'),
     url(r'^connection_samples/$', views.get_connection_samples, name='get-connection-samples'),
+    url(r'^connection_samples/stream/$', views.stream_connection_samples, name='stream-connection-samples'),
+    url(r'^analytics/bandwidth/$', views.get_bandwidth_analytics, name='get-bandwidth-analytics'),
     url(r'^update_client_name_alias/$', views.update_client_name_alias, name='update-client-name-alias'),
     url(r'^block_client/(?P<mac_addr>.+)$', views.block_client, name='block-client'),
     url(r'^unblock_client/(?P<mac_addr>.+)$', views.unblock_client, name='unblock-client'),
     url(r'^block_all_clients/$', views.block_all_clients, name='block-all-clients'),
     url(r'^unblock_all_clients/$', views.unblock_all_clients, name='unblock-all-clients'),
+    url(r'^groups/(?P<group_id>[0-9]+)/block/$', views.block_group, name='block-group'),
+    url(r'^groups/(?P<group_id>[0-9]+)/unblock/$', views.unblock_group, name='unblock-group'),
+    url(r'^router_jobs/(?P<job_id>[0-9]+)/$', views.get_router_job, name='get-router-job'),
 ]
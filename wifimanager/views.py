@@ -1,17 +1,22 @@
 from django.shortcuts import render
-from .asus_router import AsusApi
-from django.db import models
+from .asus_router import get_router_configs
+from . import analytics, collector, rollups, router_jobs, sample_stream
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.forms.models import model_to_dict
 from django.utils import timezone
+from django.db import connection
 from django.core.urlresolvers import reverse
+from django.core.serializers.json import DjangoJSONEncoder
 
 import datetime
+import json
 import logging
+import queue
 
-from .models import Client, ConnectionSample
+from .models import Client, ClientGroup, ConnectionSample, ConnectionSampleRollup, RouterJob
+from .sample_rows import RAW_SAMPLE_COLUMNS, ROLLUP_SAMPLE_COLUMNS, group_rows, group_rows_columnar
 
 logger = logging.getLogger(__name__)
 
@@ -21,69 +26,69 @@ def index(request):
 
     # hack to get around my two wifi interfaces not working with ui quite right
     user_ip_addr = '192.168.1.53' if remote_addr  == '192.168.1.192' else remote_addr
+    job_id = request.GET.get('job', '')
+    router = request.GET.get('router', '')
     context = {
-        'clients': Client.get_currently_connnected_clients(),
+        'clients': Client.get_currently_connnected_clients(router),
         'user_ip_addr': user_ip_addr,
+        'routers': list(get_router_configs()),
+        'router': router,
+        'router_job': RouterJob.objects.filter(pk=job_id, status='pending', created__gte=router_jobs.get_stale_cutoff())
+                                       .first() if job_id.isdigit() else None,
     }
     return render(request, 'wifimanager/index.html', context=context)
 
 
 def block_client(request, mac_addr):
-    try:
-        block_clients(mac_addr)
-    except Exception as e:
-        print(e)
-        pass
-    return HttpResponseRedirect(reverse('wifimanager:index'))
+    return router_job_response(request, router_jobs.submit('block', [mac_addr]))
 
 
 def unblock_client(request, mac_addr):
-    try:
-        unblock_clients(mac_addr)
-    except Exception as e:
-        pass
-    return HttpResponseRedirect(reverse('wifimanager:index'))
+    return router_job_response(request, router_jobs.submit('unblock', [mac_addr]))
 
 
 def block_all_clients(request):
-    try:
-        clients_not_blocked = Client.objects.filter(is_blocked=False)
-        block_clients(*[client.mac_addr for client in clients_not_blocked])
-    except Exception as e:
-        print(e)
-        pass
-    return HttpResponseRedirect(reverse('wifimanager:index'))
+    clients_not_blocked = dict(Client.objects.filter(is_blocked=False).values_list('mac_addr', 'router'))
+    return router_job_response(request, router_jobs.submit('block', clients_not_blocked, clients_not_blocked))
 
 
 def unblock_all_clients(request):
-    try:
-        api = AsusApi()
-        api.unblock_all_clients()
-    except Exception as e:
-        logger.debug(e)
-    return HttpResponseRedirect(reverse('wifimanager:index'))
+    return router_job_response(request, router_jobs.submit('unblock_all'))
 
 
-def block_clients(*new_macs_to_block):
-    clients_currently_blocked = Client.objects.filter(is_blocked=True)
-    all_macs_to_block = [client.mac_addr for client in clients_currently_blocked] + list(new_macs_to_block)
-    api = AsusApi()
-    try:
-        api.block_clients(all_macs_to_block)
-    except Exception as e:
-        api.login()
-        api.block_clients(all_macs_to_block)
+def block_group(request, group_id):
+    return submit_group_job(request, 'block', group_id)
+
+
+def unblock_group(request, group_id):
+    return submit_group_job(request, 'unblock', group_id)
+
+
+def submit_group_job(request, action, group_id):
+    """Blocks or unblocks every client of a group in one router job"""
+    client_routers = ClientGroup.get_client_routers(group_id)
+    if not client_routers and not ClientGroup.objects.filter(pk=group_id).exists():
+        return JsonResponse({'error': 'client group not found'}, status=404)
+    return router_job_response(request, router_jobs.submit(action, client_routers, client_routers))
+
 
+def router_job_response(request, job):
+    """Returns the submitted job as json to ajax requests, otherwise redirects to the index which waits on the job"""
+    if request.is_ajax():
+        return JsonResponse({'success': True, 'job': job.to_dict(),
+                             'job_url': reverse('wifimanager:get-router-job', args=[job.pk])})
+    return HttpResponseRedirect(f"{reverse('wifimanager:index')}?job={job.pk}")
 
-def unblock_clients(*macs_to_unblock):
-    clients_currently_blocked = Client.objects.filter(is_blocked=True)
-    all_macs_to_block = [client.mac_addr for client in clients_currently_blocked if client.mac_addr not in macs_to_unblock]
-    api = AsusApi()
+
+def get_router_job(request, job_id):
+    """Gets the status of a router job and its result once it's finished"""
+    router_jobs.fail_stale_jobs()
     try:
-        api.block_clients(all_macs_to_block)
-    except Exception as e:
-        api.login()
-        api.block_clients(all_macs_to_block)
+        job = RouterJob.objects.get(pk=job_id)
+    except RouterJob.DoesNotExist:
+        return JsonResponse({'error': 'router job not found'}, status=404)
+    return JsonResponse({'success': True, 'job': job.to_dict()})
+
 
 @csrf_exempt
 def update_client_name_alias(request):
@@ -99,87 +104,130 @@ def update_client_name_alias(request):
 
 
 def get_connection_samples(request):
-    """Gets the connections samples from the db in the range of now-dt"""
-    dt = request.GET['dt']
-    connection_samples = ConnectionSample.objects.filter(time_of_sample__gt=timezone.now()-datetime.timedelta(minutes=float(dt)))
-    client_samples = group_by('client.mac_addr', connection_samples)
-    json_client_samples = {}
-    for mac, samples in client_samples.items():
-        mac = mac.replace(':', '_')
-        json_client_samples[mac] = [model_to_dict(m) for m in samples]
-    return JsonResponse({'success': True, 'client_samples': json_client_samples})
+    """
+    Gets the connections samples from the db in the range of now-dt grouped by client mac.
+    Ranges longer than the raw sample retention are served from rollups, see rollups.choose_resolution.
+    Pass format=columnar to get parallel arrays per mac instead of a list of sample dicts.
+    Pass the cursor from the previous response as since to only get the samples added after it.
+    A cursor is only valid for requests with the same dt.
+    Pass router to only get the samples taken by that router.
+    """
+    dt = datetime.timedelta(minutes=float(request.GET['dt']))
+    since = int(request.GET.get('since', 0))
+    resolution = rollups.choose_resolution(dt)
+    if resolution is None:
+        columns = RAW_SAMPLE_COLUMNS
+        rows = ConnectionSample.objects.filter(time_of_sample__gt=timezone.now()-dt).order_by('client_id', 'id')
+    else:
+        columns = ROLLUP_SAMPLE_COLUMNS
+        rows = ConnectionSampleRollup.objects.filter(
+            resolution=resolution, bucket_start__gt=timezone.now()-dt).order_by('client_id', 'bucket_start')
+    if since:
+        rows = rows.filter(id__gt=since)
+    router = request.GET.get('router')
+    if router:
+        # rollups mix the routers a client was on, so they're filtered by the client's current router
+        rows = rows.filter(router=router) if resolution is None else rows.filter(client__router=router)
+    rows = list(rows.values_list(*columns.values()))
+    cursor = max((row[1] for row in rows), default=since)
+    if request.GET.get('format') == 'columnar':
+        client_samples = group_rows_columnar(rows, tuple(columns))
+    else:
+        client_samples = group_rows(rows, tuple(columns))
+    return JsonResponse({'success': True, 'resolution': resolution, 'cursor': cursor, 'client_samples': client_samples})
+
+
+def get_bandwidth_analytics(request):
+    """
+    Per client bandwidth stats over the raw samples in the range of now-dt, see analytics.SampleWindow.get_client_stats.
+    Clients are keyed by mac_addr_safe. top_talkers and anomalies list them by estimated transfer.
+    Pass router to only analyze the samples taken by that router and top for the number of top talkers.
+    """
+    try:
+        dt = datetime.timedelta(minutes=float(request.GET.get('dt', 5)))
+        top = int(request.GET.get('top', 10))
+    except (ValueError, OverflowError):
+        dt = top = None
+    if dt is None or dt <= datetime.timedelta(0) or top < 0:
+        return JsonResponse({'error': 'dt must be a positive number of minutes and top a whole number'}, status=400)
+    result = analytics.analyze(dt, request.GET.get('router'), top)
+    names = {mac: name_alias or name for mac, name, name_alias in
+             Client.objects.filter(pk__in=list(result['clients'])).values_list('mac_addr', 'name', 'name_alias')}
+    client_stats = {}
+    for mac, stats in result['clients'].items():
+        client_stats[mac.replace(':', '_')] = dict(stats, name=names.get(mac, ''))
+    result.update({
+        'clients': client_stats,
+        'top_talkers': [mac.replace(':', '_') for mac in result['top_talkers']],
+        'anomalies': [mac.replace(':', '_') for mac in result['anomalies']],
+    })
+    return JsonResponse({'success': True, **result})
+
+
+def stream_connection_samples(request):
+    """
+    Streams connection samples as server-sent events.
+    A snapshot event with the samples in the range of now-dt comes first, then a samples event for each new batch.
+    Both hold a cursor and client_samples in the columnar format of get_connection_samples.
+    Pass router to only stream the samples taken by that router.
+    """
+    dt = datetime.timedelta(minutes=float(request.GET.get('dt', .5)))
+    router = request.GET.get('router')
+
+    def events():
+        # subscribe before reading the snapshot so no batch is missed, and only once the stream is being read
+        subscriber = sample_stream.broker.subscribe()
+        try:
+            rows = (ConnectionSample.objects
+                    .filter(time_of_sample__gt=timezone.now()-dt)
+                    .order_by('client_id', 'id'))
+            if router:
+                rows = rows.filter(router=router)
+            rows = list(rows.values_list(*RAW_SAMPLE_COLUMNS.values()))
+            cursor = max((row[1] for row in rows), default=0)
+            snapshot = json.dumps({'cursor': cursor,
+                                   'client_samples': group_rows_columnar(rows, tuple(RAW_SAMPLE_COLUMNS))},
+                                  cls=DjangoJSONEncoder)
+            # the stream can stay open for hours, don't hold on to a db connection while it does
+            if not connection.in_atomic_block:
+                connection.close()
+            yield f'event: snapshot\ndata: {snapshot}\n\n'
+            while True:
+                try:
+                    batch = subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if batch.cursor > cursor:
+                    yield f'event: samples\ndata: {batch.get_payload(after=cursor, router=router)}\n\n'
+                    cursor = batch.cursor
+        finally:
+            sample_stream.broker.unsubscribe(subscriber)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @csrf_exempt
 def update_connected_clients(request):
     """Gets the connected clients from the asus router and updates the db"""
-    api = AsusApi()
-    asus_clients = api.get_connected_clients()
-    for asus_client in asus_clients:
-        try:
-            client = Client.objects.get(pk=asus_client.mac_addr)
-            if not client.compare_to_asus_client(asus_client):
-                client.update_from_asus_client(asus_client)
-                client.save()
-                print(f'{client} ---------- not equal -----------')
-        except models.ObjectDoesNotExist as e:
-            client = Client(mac_addr=asus_client.mac_addr, name=asus_client.name,
-                            ip_addr=asus_client.ip_addr, is_blocked=asus_client.is_blocked)
-            client.save()
-    return JsonResponse({'success': True})
+    clients_diff = collector.update_connected_clients(collector.get_routers())
+    return JsonResponse({'success': True, **clients_diff})
 
 
 # @require_POST
 @csrf_exempt
 def collect_connection_samples(request):
     """Gets the connection info for current clients at the moment in time and adds them to the db"""
-    api = AsusApi()
-    try:
-        asus_connection_samples = api.get_client_connection_statuses()
-    except Exception as e:
-        api.login()
-        asus_connection_samples = api.get_client_connection_statuses()
-    new_samples = []
-    for asus_sample in asus_connection_samples:
-        try:
-            client = Client.objects.get(pk=asus_sample.mac_addr)
-        except Exception as e:
-            client = Client(mac_addr=asus_sample.mac_addr)
-            client.save()
-        new_sample = ConnectionSample(client=client, tx=asus_sample.tx_rate, rx=asus_sample.rx_rate,
-                                      rssi=asus_sample.rssi, connection_time=asus_sample.connection_time)
-        new_sample.save()
-        new_samples.append(new_sample)
+    new_samples = collector.collect_connection_samples(collector.get_routers())
     return JsonResponse({'success': True, 'samples': [model_to_dict(m) for m in new_samples]},)
 
 
 @csrf_exempt
 def remove_old_connection_samples(request):
     try:
-        deleted_samples = ConnectionSample.objects.filter(
-                                                        time_of_sample__lt=timezone.now()-datetime.timedelta(minutes=5)
-                                                    ).delete()
-        return JsonResponse({'samples_removed': deleted_samples[0]})
+        return JsonResponse({'samples_removed': ConnectionSample.remove_old_samples()})
     except Exception as e:
         return JsonResponse({'error': 'failed to remove connection samples'})
-
-
-# ----------- Utils --------------
-
-def get_field(row, field):
-    """Gets the field of a queryobject by reference. Will get subfields as well eg. client.mac_addr or client"""
-    sub_fields = field.split('.')
-    for sub_field in sub_fields:
-        row = getattr(row, sub_field)
-    return row
-
-
-def group_by(field, query_set):
-    """Groups by a field eg. ConnectionSample.client. Returns a dict of field: [queryobjects...]"""
-    groups = {}
-    for row in query_set:
-        if get_field(row, field) not in groups:
-            groups[get_field(row, field)] = []
-        groups[get_field(row, field)].append(row)
-    return groups
-